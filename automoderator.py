@@ -1,10 +1,24 @@
+import atexit
+from collections import deque, OrderedDict
+import cPickle
 from datetime import datetime, timedelta
+from functools import partial
+import hashlib
+import itertools
+import json
 import logging, logging.config
+import multiprocessing
+import operator
+import os
+import random
+import signal
+import threading
 from time import sleep, time
+import zlib
 
 import HTMLParser
+import Queue
 import praw
-# import re2 as re
 import re
 import yaml
 from requests.exceptions import HTTPError
@@ -12,13 +26,414 @@ from sqlalchemy.sql import and_
 from sqlalchemy.orm.exc import NoResultFound
 
 from models import cfg_file, path_to_cfg, session
-from models import Log, StandardCondition, Subreddit
+from models import CompiledConditions, Log, StandardCondition
+from models import StandardConditionsVersion, Subreddit
+from recording import ListingRecorder
+from regex_analysis import adversarial_strings, find_hazards
 
 import sys, traceback
 
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import re2
+    re2.set_fallback_notification(re2.FALLBACK_QUIETLY)
+except ImportError:
+    re2 = None
+
 # global reddit session
 r = None
 
+
+def get_config_value(section, option, default):
+    """Returns a config value, or the default if it isn't set."""
+    if cfg_file.has_option(section, option):
+        return cfg_file.get(section, option)
+    return default
+
+
+class LRUCache(object):
+
+    """A size-bounded mapping that evicts the least recently used entries.
+
+    Entries can optionally expire after a number of seconds, either set
+    for the whole cache or per entry.
+    """
+
+    def __init__(self, max_size, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, default=None):
+        try:
+            value, expires = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return default
+
+        if expires is not None and expires <= time():
+            self.misses += 1
+            return default
+
+        # re-insert to mark as most recently used
+        self._entries[key] = (value, expires)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl=None):
+        if ttl is None:
+            ttl = self.ttl
+        expires = time() + ttl if ttl is not None else None
+
+        self._entries.pop(key, None)
+        self._entries[key] = (value, expires)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def discard(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+
+class PatternCache(object):
+
+    """Process-wide table of compiled match patterns.
+
+    Identical patterns (e.g. from a standard condition used by many
+    subreddits) share a single compiled object. The re module's own cache
+    only holds ~100 patterns and is thrown away entirely when full, so it
+    can't be relied on with thousands of conditions.
+
+    With the re2 engine, patterns are compiled with the linear-time RE2
+    library where possible, so they can't backtrack catastrophically.
+    Patterns it doesn't support (backreferences, lookarounds, etc.) or
+    would match differently (see re2_differs) fall back to the re module.
+    """
+
+    engines = ('re', 're2')
+    _re_pattern_type = type(re.compile(''))
+
+    def __init__(self, max_size, engine='re'):
+        self._cache = LRUCache(max_size)
+        self.compiles = 0
+        self.engine = engine
+        self.engine_counts = dict((name, 0) for name in self.engines)
+
+    def compile(self, pattern, flags=0):
+        key = (pattern, flags)
+        regex = self._cache.get(key)
+        if regex is None:
+            regex = compile_pattern(pattern, flags, self.engine)
+            self.compiles += 1
+            self.engine_counts[pattern_engine(regex)] += 1
+            self._cache.set(key, regex)
+
+        return regex
+
+    def stats(self):
+        return {'size': len(self._cache),
+                'hits': self._cache.hits,
+                'misses': self._cache.misses,
+                'compiles': self.compiles,
+                'engines': dict(self.engine_counts)}
+
+
+def compile_pattern(pattern, flags=0, engine='re'):
+    """Compiles a pattern with the engine, falling back to re if needed."""
+    if (engine == 're2' and re2 is not None and
+            not re2_differs(pattern, flags)):
+        try:
+            return re2.compile(pattern, flags)
+        except Exception:
+            pass
+
+    return re.compile(pattern, flags)
+
+
+def re2_differs(pattern, flags=0):
+    """Returns True if RE2 could match the pattern differently from re.
+
+    RE2's \\b, \\B, \\w and \\W only know ASCII word characters, even with
+    re.UNICODE, and its $ doesn't match before a trailing newline.
+    """
+    in_class = False
+    i = 0
+    while i < len(pattern):
+        char = pattern[i]
+        if char == '\\':
+            escaped = pattern[i+1:i+2]
+            if flags & re.UNICODE and (escaped in ('w', 'W') or
+                                       (escaped in ('b', 'B') and
+                                        not in_class)):
+                return True
+            i += 2
+            continue
+
+        if in_class:
+            if char == ']':
+                in_class = False
+        elif char == '[':
+            in_class = True
+            # a ] straight after [ or [^ is part of the class
+            if pattern[i+1:i+2] == '^':
+                i += 1
+            if pattern[i+1:i+2] == ']':
+                i += 1
+        elif char == '$' and not flags & re.MULTILINE:
+            return True
+        i += 1
+
+    return False
+
+
+def pattern_engine(regex):
+    """Returns the name of the engine a compiled pattern is using."""
+    if isinstance(regex, PatternCache._re_pattern_type):
+        return 're'
+    return 're2'
+
+pattern_cache = PatternCache(
+    int(get_config_value('performance', 'pattern_cache_size', 10000)),
+    get_config_value('performance', 'regex_engine', 're'))
+
+
+class RegexTimeout(Exception):
+
+    """Raised when a regex search takes longer than the time budget."""
+
+    def __init__(self, pattern, length, elapsed):
+        Exception.__init__(self, 'Regex search timed out after {0:.1f}s on '
+                                 '{1} chars'.format(elapsed, length))
+        self.pattern = pattern
+        self.length = length
+        self.elapsed = elapsed
+
+
+class RegexWatchdog(object):
+
+    """Enforces a time budget on searches with moderator-written regexes.
+
+    The re module can't be interrupted in the middle of a search, so a
+    pathological regex would otherwise pin the bot for as long as it takes.
+    The searches are run in a worker process instead, which is killed (and
+    replaced) if one takes longer than the budget, and also replaced if it
+    dies any other way. Only whether it matched
+    is sent back, so a matching search is repeated in this process to get
+    the match object, which is safe since it's known to finish in time.
+
+    Conditions that time out repeatedly in a subreddit are quarantined,
+    and not checked there until the subreddit's wiki page is updated.
+    """
+
+    def __init__(self, timeout, strikes):
+        self.timeout = timeout
+        self.strikes = strikes
+        self.timeouts = {}
+        self.quarantined = set()
+        self._lock = threading.Lock()
+        self._process = None
+        self._conn = None
+
+    def _start_worker(self):
+        self._conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(target=regex_worker,
+                                                args=(child_conn,))
+        self._process.daemon = True
+        self._process.start()
+
+    def _kill_worker(self):
+        self._process.terminate()
+        self._process.join()
+        self._process = None
+        self._conn.close()
+        self._conn = None
+
+    def search(self, regex, string):
+        """Searches the string, raising RegexTimeout if it takes too long."""
+        # the linear-time engine doesn't need watching
+        if not self.timeout or pattern_engine(regex) == 're2':
+            return regex.search(string)
+
+        with self._lock:
+            for attempt in range(2):
+                if self._process is None:
+                    self._start_worker()
+
+                start_time = time()
+                try:
+                    self._conn.send((regex.pattern, regex.flags, string))
+                    if not self._conn.poll(self.timeout):
+                        self._kill_worker()
+                        raise RegexTimeout(regex.pattern, len(string),
+                                           time() - start_time)
+                    matched = self._conn.recv()
+                    break
+                except (IOError, EOFError) as e:
+                    # the worker died some other way (killed, out of memory),
+                    # so it's replaced and the search is sent again once
+                    logging.warning('Regex worker died, restarting it: {0}'
+                                    .format(e))
+                    self._kill_worker()
+                    if attempt:
+                        raise
+
+        if matched:
+            return regex.search(string)
+        return None
+
+    def is_quarantined(self, subreddit, condition):
+        return (subreddit.name.lower(), condition.yaml) in self.quarantined
+
+    def record_timeout(self, subreddit, condition, timeout):
+        """Counts a timeout against a condition, quarantining it if needed."""
+        key = (subreddit.name.lower(), condition.yaml)
+        timeouts = self.timeouts.setdefault(key, [])
+        timeouts.append(timeout)
+        logging.warning(u'Regex timeout {0}/{1} in /r/{2}: {3}\n{4}'
+                        .format(len(timeouts), self.strikes, subreddit.name,
+                                timeout, condition.yaml))
+
+        if len(timeouts) >= self.strikes:
+            self.quarantined.add(key)
+            del self.timeouts[key]
+            logging.warning(u'Quarantined condition in /r/{0}:\n{1}'
+                            .format(subreddit.name, condition.yaml))
+            try:
+                send_quarantine_message(subreddit.name, condition, timeouts,
+                                        self.timeout)
+            except Exception as e:
+                logging.error('ERROR: {0}'.format(e))
+                logging.debug(traceback.format_exc())
+
+    def release(self, sr_name):
+        """Clears the quarantined conditions and timeouts for a subreddit."""
+        sr_name = sr_name.lower()
+        self.quarantined = set(key for key in self.quarantined
+                               if key[0] != sr_name)
+        self.timeouts = dict((key, timeouts)
+                             for key, timeouts in self.timeouts.iteritems()
+                             if key[0] != sr_name)
+
+
+def regex_worker(conn):
+    """Runs regex searches sent by a RegexWatchdog in a worker process."""
+    # the bot's SIGTERM handler only runs between bytecodes, so it would
+    # keep the worker from being killed in the middle of a slow search
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    regexes = {}
+    while True:
+        try:
+            pattern, flags, string = conn.recv()
+        except EOFError:
+            return
+
+        key = (pattern, flags)
+        if key not in regexes:
+            regexes[key] = re.compile(pattern, flags)
+        conn.send(regexes[key].search(string) is not None)
+
+regex_watchdog = RegexWatchdog(
+    float(get_config_value('performance', 'regex_timeout_secs', 2)),
+    int(get_config_value('performance', 'regex_timeout_strikes', 3)))
+
+# times regexes from the wiki before they're accepted, killing slow searches
+regex_analyzer = RegexWatchdog(
+    float(get_config_value('performance', 'regex_cost_limit_ms', 100)) / 1000,
+    0)
+
+
+class RecentItems(object):
+
+    """The title and body of the last few items seen in each subreddit.
+
+    New regexes from a subreddit's wiki are timed against these, as well as
+    generated strings, since real items are what they'll be checked on.
+    To bound the memory used, items are only kept for subreddits that
+    already have regex conditions, and only the start of each string.
+    """
+
+    _sources = ('title', 'body')
+    _max_chars = 4096
+
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self._items = {}
+
+    def track(self, sr_name, tracked):
+        """Starts or stops keeping items for the subreddit."""
+        if not tracked or not self.max_items:
+            self._items.pop(sr_name, None)
+        elif sr_name not in self._items:
+            self._items[sr_name] = deque(maxlen=self.max_items)
+
+    def add(self, sr_name, view):
+        items = self._items.get(sr_name)
+        if items is not None:
+            items.append(dict((source, view.target(source)[:self._max_chars])
+                              for source in self._sources))
+
+    def get(self, sr_name):
+        """Returns a list of dicts of the sources' strings for each item."""
+        return list(self._items.get(sr_name.lower(), ()))
+
+recent_items = RecentItems(
+    int(get_config_value('performance', 'regex_sample_items', 10)))
+
+
+class RedditorCache(object):
+
+    """Profile data for redditors, kept between items and conditions.
+
+    Reading any of these attributes from a praw Redditor makes a request
+    the first time, and a new Redditor comes with every item, so without
+    this a prolific user gets fetched again for each of their items.
+    """
+
+    _attrs = ('link_karma', 'comment_karma', 'created_utc', 'is_gold')
+
+    def __init__(self, max_size, ttl):
+        self._cache = LRUCache(max_size, ttl)
+        self.requests_saved = 0
+
+    def get(self, user):
+        """Returns a dict of the user's profile attributes."""
+        key = user.name.lower()
+        profile = self._cache.get(key)
+        if profile is not None:
+            if not getattr(user, '_has_fetched', True):
+                self.requests_saved += 1
+            return profile
+
+        profile = {attr: getattr(user, attr, 0) for attr in self._attrs}
+        self._cache.set(key, profile)
+        return profile
+
+    def stats(self):
+        lookups = self._cache.hits + self._cache.misses
+        hit_ratio = float(self._cache.hits) / lookups if lookups else 0.0
+        return {'size': len(self._cache),
+                'hit_ratio': hit_ratio,
+                'requests_saved': self.requests_saved}
+
+redditor_cache = RedditorCache(
+    int(get_config_value('performance', 'redditor_cache_size', 10000)),
+    60 * float(get_config_value('performance', 'redditor_cache_ttl_mins', 60)))
+
+
 class Condition(object):
     _defaults = {'reports': None,
                  'author_is_submitter': None,
@@ -67,21 +482,68 @@ class Condition(object):
                           'author_flair_css_class': 'full-exact',
                           'link_url': 'includes'}
 
+    _user_operators = {'<': operator.lt,
+                       '>': operator.gt,
+                       '=': operator.eq,
+                       '==': operator.eq}
+    _rank_values = {'user': 0, 'contributor': 1, 'moderator': 2}
+    # fields that can contain placeholders (besides comment/modmail/message)
+    _template_fields = ('report_reason', 'report',
+                        'link_flair_text', 'link_flair_class',
+                        'user_flair_text', 'user_flair_class',
+                        'modmail_subject', 'message_subject')
+
+    # attributes built by compile(), which aren't part of the stored state
+    _compiled_attrs = ('match_regexes', 'user_predicates', 'templates')
+
     _standard_cache = {}
-    _standard_rows = None
+    _standard_checksums = {}
+    _standards_version = -1
     _update_standards = False
 
     @classmethod
     def update_standards(cls):
-        standards = session.query(StandardCondition).all()
-        if (standards != cls._standard_rows or
-                cls._update_standards):
-            cls._standard_cache = {cond.name.lower(): yaml.safe_load(cond.yaml)
-                                   for cond in standards}
-            cls._standard_rows = standards
-            cls._update_standards = False
-            return True
-        return False
+        """Reloads the standard conditions if they've been updated.
+
+        Only the standards version number is checked unless it changed, and
+        then only the standards with a different checksum are parsed again.
+        Returns the set of names of the standards that changed.
+        """
+        version = session.query(StandardConditionsVersion.version).scalar()
+        if version == cls._standards_version and not cls._update_standards:
+            return set()
+
+        rows = session.query(StandardCondition.name,
+                             StandardCondition.checksum).all()
+        current_names = set(name.lower() for name, checksum in rows)
+        changed = set(name for name in cls._standard_checksums
+                      if name not in current_names)
+        for name in changed:
+            del cls._standard_cache[name]
+            del cls._standard_checksums[name]
+
+        # rows without a checksum haven't been updated since checksums
+        # were added, so they need to be checked from their yaml
+        to_load = [name for name, checksum in rows
+                   if checksum is None or
+                      checksum != cls._standard_checksums.get(name.lower())]
+        if to_load:
+            for name, std_yaml in (session.query(StandardCondition.name,
+                                                 StandardCondition.yaml)
+                                          .filter(StandardCondition.name
+                                                  .in_(to_load))):
+                name = name.lower()
+                checksum = yaml_checksum(std_yaml)
+                if checksum == cls._standard_checksums.get(name):
+                    continue
+
+                cls._standard_cache[name] = yaml.safe_load(std_yaml)
+                cls._standard_checksums[name] = checksum
+                changed.add(name)
+
+        cls._standards_version = version
+        cls._update_standards = False
+        return changed
 
     @classmethod
     def get_standard_condition(cls, name):
@@ -124,8 +586,12 @@ class Condition(object):
 
         # set match target/pattern definitions
         self.match_patterns = {}
+        self.match_sources = {}
         self.match_success = {}
         self.match_flags = {}
+        self.match_exact = {}
+        self.match_literals = {}
+        self.match_watched = {}
         match_fields = set()
         for key in [k for k in init
                     if self.trimmed_key(k) in self._match_targets or '+' in k]:
@@ -134,6 +600,10 @@ class Condition(object):
             else:
                 modifiers = self.modifiers
             self.match_patterns[key] = self.get_pattern(key, modifiers)
+            self.match_exact[key] = self.get_exact_values(key, modifiers)
+            self.match_literals[key] = self.get_literal_values(key, modifiers)
+            # moderator-written regexes could backtrack catastrophically
+            self.match_watched[key] = 'regex' in modifiers
 
             if 'inverse' in modifiers or key.startswith('~'):
                 self.match_success[key] = False
@@ -145,8 +615,8 @@ class Condition(object):
             if 'case-sensitive' not in modifiers:
                 self.match_flags[key] |= re.IGNORECASE
 
-            for field in self.trimmed_key(key).split('+'):
-                match_fields.add(field)
+            self.match_sources[key] = set(self.trimmed_key(key).split('+'))
+            match_fields.update(self.match_sources[key])
 
         # if type wasn't defined, set based on fields being matched against
         if not getattr(self, 'type', None):
@@ -162,6 +632,86 @@ class Condition(object):
         if self.set_options and not isinstance(self.set_options, list):
             self.set_options = self.set_options.split()
 
+        self.user_must_satisfy = self.user_conditions.get('must_satisfy',
+                                                          'all')
+
+        self.compile()
+
+    def compile(self):
+        """Compiles the regexes, user conditions and placeholder templates.
+
+        They're built from the other attributes, so they're left out of the
+        condition's stored state (see get_state) and compiled again when
+        it's loaded.
+        """
+        self.match_regexes = {}
+        for key, pattern in self.match_patterns.iteritems():
+            self.match_regexes[key] = pattern_cache.compile(
+                pattern, self.match_flags[key])
+
+        self.user_predicates = self.compile_user_conditions()
+
+        # split up the strings with placeholders once, for rendering later
+        self.templates = {}
+        for field in self._template_fields:
+            if getattr(self, field):
+                self.templates[field] = PlaceholderTemplate(
+                    getattr(self, field))
+        if self.comment:
+            self.templates['comment'] = self.build_message_template(
+                self.comment, disclaimer=True)
+        if self.modmail:
+            self.templates['modmail'] = self.build_message_template(
+                self.modmail, permalink=True)
+        if self.message:
+            self.templates['message'] = self.build_message_template(
+                self.message, disclaimer=True, permalink=True)
+
+    def get_state(self):
+        """Returns the condition's attributes, except the compiled ones."""
+        return dict((key, value) for key, value in self.__dict__.iteritems()
+                    if key not in self._compiled_attrs)
+
+    @classmethod
+    def from_state(cls, state):
+        """Returns a condition with attributes returned by get_state."""
+        condition = cls.__new__(cls)
+        condition.__dict__.update(state)
+        condition.compile()
+        return condition
+
+    def compile_user_conditions(self):
+        """Returns the user_conditions as (attr, compare, value) predicates.
+
+        The rank only needs the subreddit's moderator/contributor lists,
+        which are cached, so it's ordered before the attributes that need
+        the user's profile to be fetched.
+        """
+        predicates = []
+        for attr, compare in self.user_conditions.iteritems():
+            if attr == 'must_satisfy':
+                continue
+
+            # extract the comparison operator
+            operator_str = '='
+            if not isinstance(compare, bool):
+                compare = unicode(compare)
+                match = re.search('^(==?|<|>)', compare)
+                if match:
+                    operator_str = match.group(1)
+                    compare = compare[len(operator_str):].strip()
+
+            # convert rank to a numerical value
+            if attr == 'rank':
+                compare = self._rank_values[compare]
+
+            predicates.append((attr,
+                               self._user_operators[operator_str],
+                               int(compare)))
+
+        predicates.sort(key=lambda (attr, compare, value): attr != 'rank')
+        return tuple(predicates)
+
     def trimmed_key(self, key):
         subjects = key.lstrip('~')
         subjects = re.sub(r'#.+$', '', subjects)
@@ -181,27 +731,75 @@ class Condition(object):
             values = [re.escape(val) for val in values]
         value_str = u'({0})'.format('|'.join(values))
 
+        match_mod, subdomains = self.get_match_modifier(subject, modifiers)
+        if subdomains:
+            value_str = ur'(?:.*?\.)?' + value_str
+
+        return self._match_modifiers[match_mod].format(value_str)
+
+    def get_match_modifier(self, subject, modifiers):
+        """Returns the subject's match modifier, and if it allows subdomains."""
         # check if they defined a match modifier
         for mod in self._match_modifiers:
             if mod in modifiers:
-                match_mod = mod
-                break
-        else:
-            subject = self.trimmed_key(subject)
-            # handle subdomains for domain checks
-            if subject == 'domain':
-                value_str = ur'(?:.*?\.)?' + value_str
+                return mod, False
 
-            match_mod = self._modifier_defaults.get(subject, 'includes-word')
+        subject = self.trimmed_key(subject)
+        # handle subdomains for domain checks
+        return (self._modifier_defaults.get(subject, 'includes-word'),
+                subject == 'domain')
 
-        return self._match_modifiers[match_mod].format(value_str)
+    def get_exact_values(self, subject, modifiers):
+        """Returns the values a subject must be exactly equal to.
+
+        Returns a set of the values (lowercased unless case-sensitive) and
+        whether subdomains of them also match, or None if the subject can
+        match anything other than the values themselves.
+        """
+        if not isinstance(modifiers, list):
+            modifiers = list(modifiers.split(' '))
 
-    def check_item(self, item):
+        match_mod, subdomains = self.get_match_modifier(subject, modifiers)
+        if 'regex' in modifiers or match_mod != 'full-exact':
+            return None
+
+        values = [unicode(val) for val in getattr(self, subject)]
+        if 'case-sensitive' not in modifiers:
+            values = [val.lower() for val in values]
+
+        return frozenset(values), subdomains
+
+    def get_literal_values(self, subject, modifiers):
+        """Returns literal strings the subject can only match by containing.
+
+        Every match modifier wraps the values themselves, so without the
+        regex modifier a match is impossible unless one of the values
+        appears in the string. Returns the set of values (lowercased unless
+        case-sensitive), or None if they aren't plain strings.
+        """
+        if not isinstance(modifiers, list):
+            modifiers = list(modifiers.split(' '))
+        if 'regex' in modifiers:
+            return None
+
+        values = [unicode(val) for val in getattr(self, subject)]
+        # an empty value is contained in everything
+        if not all(values):
+            return None
+        if 'case-sensitive' not in modifiers:
+            values = [val.lower() for val in values]
+
+        return frozenset(values)
+
+    def check_item(self, item, view=None, check_shadowbanned=False):
         """Checks an item against the condition.
 
+        If check_shadowbanned is set, approvals aren't done for shadowbanned
+        users' items (unless the condition is about the user).
         Returns True if the condition is satisfied, False otherwise.
         """
-        html_parser = HTMLParser.HTMLParser()
+        if view is None:
+            view = ItemView(item)
 
         # check number of reports if necessary
         if self.reports and item.num_reports < self.reports:
@@ -220,83 +818,33 @@ class Condition(object):
             if self.author_is_submitter != author_is_submitter:
                 return False
 
-        # pull out the item's body and remove blockquotes if necessary
-        if isinstance(item, praw.objects.Submission):
-            body_string = item.selftext
-        else:
-            body_string = item.body
-        if self.ignore_blockquotes:
-            body_string = html_parser.unescape(body_string)
-            body_string = '\n'.join(line for line in body_string.splitlines()
-                                    if not line.startswith('>') and
-                                    len(line) > 0)
-
         # check body length restrictions if necessary
         if (self.body_min_length is not None or
                 self.body_max_length is not None):
-            # remove non-word chars on either end of the string
-            pattern = re.compile(r'^\W+', re.UNICODE)
-            body_text = pattern.sub('', body_string)
-            pattern = re.compile(r'\W+$', re.UNICODE)
-            body_text = pattern.sub('', body_text)
+            body_length = view.body_length(self.ignore_blockquotes)
 
             if (self.body_min_length is not None and
-                    len(body_text) < self.body_min_length):
+                    body_length < self.body_min_length):
                 return False
             if (self.body_max_length is not None and
-                    len(body_text) > self.body_max_length):
+                    body_length > self.body_max_length):
                 return False
 
         match = None
         approve_shadowbanned = False
         for subject in self.match_patterns:
-            sources = set(self.trimmed_key(subject).split('+'))
-            for source in sources:
+            for source in self.match_sources[subject]:
                 approve_shadowbanned = False
                 if source == 'user' and item.author:
-                    string = item.author.name
                     # allow approving shadowbanned if it's a username match
                     approve_shadowbanned = True
-                elif source == 'link_id':
-                    # trim off the 't3_'
-                    string = getattr(item, 'link_id', '')[3:]
-                elif source == 'parent_comment_id':
-                    parent_id = getattr(item, 'parent_id', '')
-                    # make sure it's a comment, and trim off the 't1_'
-                    if parent_id.startswith('t1_'):
-                        string = parent_id[3:]
-                    else:
-                        string = ''
-                elif source == 'body':
-                    string = body_string
-                elif (source == 'url' and
-                        getattr(item, 'is_self', False)):
-                    # get rid of the url value for self-posts
-                    string = ''
-                elif (source.startswith('media_') and
-                        getattr(item, 'media', None)):
-                    try:
-                        if source == 'media_user':
-                            string = item.media['oembed']['author_name']
-                        elif source == 'media_title':
-                            string = item.media['oembed']['title']
-                        elif source == 'media_description':
-                            string = item.media['oembed']['description']
-                        elif source == 'media_author_url':
-                            string = item.media['oembed']['author_url']
-                    except KeyError:
-                        string = ''
-                else:
-                    string = getattr(item, source, '')
-
-                if not string:
-                    string = ''
-
-                string = html_parser.unescape(string)
 
-                match = re.search(self.match_patterns[subject],
-                                  string,
-                                  self.match_flags[subject])
+                string = view.target(source, self.ignore_blockquotes)
+                if self.match_watched[subject]:
+                    match = regex_watchdog.search(self.match_regexes[subject],
+                                                  string)
+                else:
+                    match = self.match_regexes[subject].search(string)
 
                 if match:
                     break
@@ -312,7 +860,7 @@ class Condition(object):
         # don't approve shadowbanned users' posts except in special cases
         if (self.action != 'approve' or
                 self.report or
-                not self.check_shadowbanned or
+                not check_shadowbanned or
                 not user_is_shadowbanned(item.author) or
                 approve_shadowbanned):
             self.execute_actions(item, match)
@@ -325,40 +873,21 @@ class Condition(object):
         if not self.user_conditions:
             return True
 
-        must_satisfy = self.user_conditions.get('must_satisfy', 'all')
+        # stop at the first result that decides it either way
+        satisfy_any = (self.user_must_satisfy == 'any')
         user = item.author
+        profile = None
 
-        for attr, compare in self.user_conditions.iteritems():
-            if attr == 'must_satisfy':
-                continue
-
-            # extract the comparison operator
-            operator = '='
-            if not isinstance(compare, bool):
-                operator_regex = '^(==?|<|>)'
-                match = re.search(operator_regex, compare)
-                if match:
-                    operator = match.group(1)
-                    compare = compare[len(operator):].strip()
-                    if operator == '==':
-                        operator = '='
-
-            # convert rank to a numerical value
-            if attr == 'rank':
-                rank_values = {'user': 0, 'contributor': 1, 'moderator': 2}
-                compare = rank_values[compare]
-
+        for attr, compare, compare_value in self.user_predicates:
             if user:
                 try:
                     if attr == 'rank':
-                        value = rank_values[get_user_rank(user, item.subreddit)]
-                    elif attr == 'account_age':
-                        user_date = datetime.utcfromtimestamp(user.created_utc)
-                        value = (datetime.utcnow() - user_date).days
-                    elif attr == 'combined_karma':
-                        value = user.link_karma + user.comment_karma
+                        value = self._rank_values[
+                            get_user_rank(user, item.subreddit)]
                     else:
-                        value = getattr(user, attr, 0)
+                        if profile is None:
+                            profile = redditor_cache.get(user)
+                        value = self.get_profile_value(profile, attr)
                 except HTTPError as e:
                     if e.response.status_code == 404:
                         # user is shadowbanned, never satisfies conditions
@@ -373,27 +902,27 @@ class Condition(object):
             else:
                 value = 0
 
-            if operator == '<':
-                result = int(value) < int(compare)
-            elif operator == '>':
-                result = int(value) > int(compare)
-            elif operator == '=':
-                result = int(value) == int(compare)
-
-            if result and must_satisfy == 'any':
-                return True
-            elif not result and must_satisfy == 'all':
-                return False
+            if compare(int(value), compare_value) == satisfy_any:
+                return satisfy_any
 
         # if we reached this point, success depends on if this is any/all
-        if must_satisfy == 'any' and not result:
-            return False
-        return True
+        return not satisfy_any
+
+    def get_profile_value(self, profile, attr):
+        """Returns the value of a user_conditions attribute from a profile."""
+        if attr == 'account_age':
+            user_date = datetime.utcfromtimestamp(profile['created_utc'])
+            return (datetime.utcnow() - user_date).days
+        elif attr == 'combined_karma':
+            return profile['link_karma'] + profile['comment_karma']
+        return profile.get(attr, 0)
 
     def execute_actions(self, item, match):
         """Performs the action(s) for the condition.
 
         Also sends any comment/messages (if set) and creates a log entry.
+        The reddit requests themselves are handed to the action executor,
+        so checking can carry on while they're made.
         """
         if self.action or self.comment or self.modmail or self.message:
             log_actions = [self.action]
@@ -402,83 +931,87 @@ class Condition(object):
         else:
             log_actions = []
 
+        # requests to make for the item, in order
+        steps = []
+
         # perform the action
         if self.action == 'remove':
-            item.remove(False)
+            steps.append(('remove', partial(item.remove, False)))
         elif self.action == 'spam':
-            item.remove(True)
+            steps.append(('spam', partial(item.remove, True)))
         elif self.action == 'approve':
-            item.approve()
+            steps.append(('approve', item.approve))
         if (self.action == 'report' or self.report):
             if self.report_reason:
-                reason = replace_placeholders(self.report_reason, item, match)
-                reason = reason[:100]
+                reason = self.render('report_reason', item, match)[:100]
             elif self.report:
-                reason = replace_placeholders(self.report, item, match)
-                reason = reason[:100]
+                reason = self.render('report', item, match)[:100]
             else:
                 reason = None
-            item.report(reason)
+            steps.append(('report', partial(item.report, reason)))
 
         # set thread options
         if self.set_options and isinstance(item, praw.objects.Submission):
             if 'nsfw' in self.set_options and not item.over_18:
-                item.mark_as_nsfw()
+                steps.append(('nsfw', item.mark_as_nsfw))
             if 'contest' in self.set_options:
-                item.set_contest_mode(True)
+                steps.append(('contest', partial(item.set_contest_mode, True)))
             if 'sticky' in self.set_options:
-                item.sticky()
+                steps.append(('sticky', item.sticky))
 
         # set flairs
         if (isinstance(item, praw.objects.Submission) and
                 (self.link_flair_text or self.link_flair_class)):
-            text = replace_placeholders(self.link_flair_text, item, match)
-            css_class = replace_placeholders(self.link_flair_class, item, match)
-            item.set_flair(text, css_class.lower())
+            text = self.render('link_flair_text', item, match)
+            css_class = self.render('link_flair_class', item, match)
+            steps.append(('link_flair',
+                          partial(item.set_flair, text, css_class.lower())))
             item.link_flair_text = text
             item.link_flair_css_class = css_class.lower()
             log_actions.append('link_flair')
         if (self.user_flair_text or self.user_flair_class):
-            text = replace_placeholders(self.user_flair_text, item, match)
-            css_class = replace_placeholders(self.user_flair_class, item, match)
-            item.subreddit.set_flair(item.author, text, css_class.lower())
+            text = self.render('user_flair_text', item, match)
+            css_class = self.render('user_flair_class', item, match)
+            steps.append(('user_flair',
+                          partial(item.subreddit.set_flair,
+                                  item.author, text, css_class.lower())))
             item.author_flair_text = text
             item.author_flair_css_class = css_class.lower()
             log_actions.append('user_flair')
 
         if self.comment:
-            comment = self.build_message(self.comment, item, match,
-                                         disclaimer=True)
+            comment = self.render('comment', item, match)[:10000]
             if isinstance(item, praw.objects.Submission):
-                response = item.add_comment(comment)
+                post_comment = item.add_comment
             elif isinstance(item, praw.objects.Comment):
-                response = item.reply(comment)
-            response.distinguish()
+                post_comment = item.reply
+            # distinguishing needs the comment that was just posted
+            responses = []
+            steps.append(('comment',
+                          lambda: responses.append(post_comment(comment))))
+            steps.append(('distinguish',
+                          lambda: responses[-1].distinguish()))
 
         if self.modmail:
-            message = self.build_message(self.modmail, item, match,
-                                         permalink=True)
-            subject = replace_placeholders(self.modmail_subject, item, match)
-            subject = subject[:100]
-            r.send_message('/r/'+item.subreddit.display_name, subject, message)
+            message = self.render('modmail', item, match)[:10000]
+            subject = self.render('modmail_subject', item, match)[:100]
+            steps.append(('modmail',
+                          partial(r.send_message,
+                                  '/r/'+item.subreddit.display_name,
+                                  subject, message)))
 
         if self.message and item.author:
-            message = self.build_message(self.message, item, match,
-                                         disclaimer=True, permalink=True)
-            subject = replace_placeholders(self.message_subject, item, match)
-            subject = subject[:100]
-            r.send_message(item.author.name, subject, message)
-
-        log_entry = Log()
-        log_entry.item_fullname = item.name
-        log_entry.condition_yaml = self.yaml
-        log_entry.datetime = datetime.utcnow()
-
-        for entry in log_actions:
-            log_entry.action = entry
-            session.add(log_entry)
-
-        session.commit()
+            message = self.render('message', item, match)[:10000]
+            subject = self.render('message_subject', item, match)[:100]
+            steps.append(('message',
+                          partial(r.send_message,
+                                  item.author.name, subject, message)))
+
+        # a reported item needs checking again if its actions weren't done
+        action_executor.submit(item, steps, self.yaml,
+                               partial(action_log.record, item.name,
+                                       log_actions, self.yaml),
+                               partial(report_states.forget, item.name))
 
         item_time = datetime.utcfromtimestamp(item.created_utc)
         logging.info(u'Matched {0}, actions: {1} (age: {2})'
@@ -486,18 +1019,440 @@ class Condition(object):
                              log_actions,
                              datetime.utcnow() - item_time))
 
-    def build_message(self, text, item, match,
-                      disclaimer=False, permalink=False):
-        """Builds a message/comment for the bot to post or send."""
+    def build_message_template(self, text, disclaimer=False, permalink=False):
+        """Builds the template of a message/comment for the bot to send."""
         message = text
         if disclaimer:
             message = message+'\n\n'+cfg_file.get('reddit', 'disclaimer')
         if permalink and '{{permalink}}' not in message:
             message = '{{permalink}}\n\n'+message
-        message = replace_placeholders(message, item, match)
-        message = message[:10000]
 
-        return message
+        return PlaceholderTemplate(message)
+
+    def render(self, field, item, match):
+        """Returns a field's text with its placeholders filled in."""
+        template = self.templates.get(field)
+        if template is None:
+            return ''
+        return template.render(item, match)
+
+
+class ItemView(object):
+
+    """Match targets for a single item, extracted and unescaped lazily.
+
+    One view is created per item and shared by every condition the item is
+    checked against, so each field is only pulled out of the item and
+    unescaped once no matter how many conditions look at it.
+    """
+
+    _html_parser = HTMLParser.HTMLParser()
+    _leading_nonword = re.compile(r'^\W+', re.UNICODE)
+    _trailing_nonword = re.compile(r'\W+$', re.UNICODE)
+    _media_sources = {'media_user': 'author_name',
+                      'media_title': 'title',
+                      'media_description': 'description',
+                      'media_author_url': 'author_url'}
+
+    def __init__(self, item):
+        self.item = item
+        self._bodies = {}
+        self._body_lengths = {}
+        self._targets = {}
+
+    def body(self, ignore_blockquotes=False):
+        """Returns the item's body, with blockquotes removed if requested."""
+        try:
+            return self._bodies[ignore_blockquotes]
+        except KeyError:
+            pass
+
+        if isinstance(self.item, praw.objects.Submission):
+            body_string = self.item.selftext
+        else:
+            body_string = self.item.body
+        if ignore_blockquotes:
+            body_string = self._html_parser.unescape(body_string)
+            body_string = '\n'.join(line for line in body_string.splitlines()
+                                    if not line.startswith('>') and
+                                    len(line) > 0)
+
+        self._bodies[ignore_blockquotes] = body_string
+        return body_string
+
+    def body_length(self, ignore_blockquotes=False):
+        """Returns the body's length, ignoring non-word chars on either end."""
+        try:
+            return self._body_lengths[ignore_blockquotes]
+        except KeyError:
+            pass
+
+        body_text = self._leading_nonword.sub('', self.body(ignore_blockquotes))
+        body_text = self._trailing_nonword.sub('', body_text)
+
+        self._body_lengths[ignore_blockquotes] = len(body_text)
+        return len(body_text)
+
+    def target(self, source, ignore_blockquotes=False):
+        """Returns the unescaped string to match a source field against."""
+        # only the body is affected by ignoring blockquotes
+        key = (source, source == 'body' and ignore_blockquotes)
+        try:
+            return self._targets[key]
+        except KeyError:
+            pass
+
+        item = self.item
+        if source == 'user' and item.author:
+            string = item.author.name
+        elif source == 'link_id':
+            # trim off the 't3_'
+            string = getattr(item, 'link_id', '')[3:]
+        elif source == 'parent_comment_id':
+            parent_id = getattr(item, 'parent_id', '')
+            # make sure it's a comment, and trim off the 't1_'
+            if parent_id.startswith('t1_'):
+                string = parent_id[3:]
+            else:
+                string = ''
+        elif source == 'body':
+            string = self.body(ignore_blockquotes)
+        elif (source == 'url' and
+                getattr(item, 'is_self', False)):
+            # get rid of the url value for self-posts
+            string = ''
+        elif (source in self._media_sources and
+                getattr(item, 'media', None)):
+            try:
+                string = item.media['oembed'][self._media_sources[source]]
+            except KeyError:
+                string = ''
+        else:
+            string = getattr(item, source, '')
+
+        if not string:
+            string = ''
+
+        string = self._html_parser.unescape(string)
+        self._targets[key] = string
+        return string
+
+
+class ActionLog(object):
+
+    """Index of the actions already performed on items during a pass.
+
+    The log table is queried for a whole page of items at once, and the
+    index is kept up to date as new log entries are written, so checking
+    an item never needs its own round trip to the database.
+
+    New log entries are buffered and written with bulk inserts once enough
+    have built up (or enough time has passed), and at the end of each pass.
+    Buffered entries are included in the index, so actions are never
+    repeated while they're waiting to be written. Only the main thread
+    may flush, since the database session isn't thread-safe.
+    """
+
+    def __init__(self, flush_rows, flush_secs):
+        self.flush_rows = flush_rows
+        self.flush_secs = flush_secs
+        self._performed = {}
+        self._pending = []
+        self._lock = threading.Lock()
+        self._last_flush = time()
+        self.matches = 0
+        self.rows_written = 0
+
+    def reset(self):
+        self._performed.clear()
+        self.matches = 0
+        self.rows_written = 0
+
+    def prefetch(self, fullnames):
+        """Loads the logged actions for all the items with one query."""
+        missing = set(name for name in fullnames
+                      if name not in self._performed)
+        if not missing:
+            return
+
+        for name in missing:
+            self._performed[name] = (set(), set())
+
+        log_entries = (session.query(Log.item_fullname,
+                                     Log.action,
+                                     Log.condition_yaml)
+                              .filter(Log.item_fullname.in_(missing))
+                              .all())
+        with self._lock:
+            # include anything that hasn't been written out yet
+            log_entries.extend((row['item_fullname'],
+                                row['action'],
+                                row['condition_yaml'])
+                               for row in self._pending
+                               if row['item_fullname'] in missing)
+
+            for fullname, action, condition_yaml in log_entries:
+                performed_actions, performed_yaml = self._performed[fullname]
+                performed_actions.add(action)
+                performed_yaml.add(condition_yaml)
+
+    def performed(self, fullname):
+        """Returns the sets of actions and condition yaml done on the item."""
+        if fullname not in self._performed:
+            self.prefetch([fullname])
+        return self._performed[fullname]
+
+    def record(self, fullname, actions, condition_yaml):
+        """Buffers log entries for actions performed on an item.
+
+        Can be called from the action executor's workers, so this never
+        touches the database itself.
+        """
+        log_time = datetime.utcnow()
+        with self._lock:
+            for action in actions:
+                self._pending.append({'item_fullname': fullname,
+                                      'action': action,
+                                      'condition_yaml': condition_yaml,
+                                      'datetime': log_time})
+            self.matches += 1
+
+            if fullname in self._performed:
+                performed_actions, performed_yaml = self._performed[fullname]
+                performed_actions.update(actions)
+                performed_yaml.add(condition_yaml)
+
+    def flush_if_due(self):
+        if (len(self._pending) >= self.flush_rows or
+                time() - self._last_flush >= self.flush_secs):
+            self.flush()
+
+    def flush(self):
+        """Writes all the buffered log entries to the database.
+
+        Returns False if they couldn't be written, in which case they're
+        kept for the next attempt.
+        """
+        self._last_flush = time()
+        if not self._pending:
+            return True
+
+        with self._lock:
+            rows = self._pending
+            self._pending = []
+        try:
+            session.execute(Log.__table__.insert(), rows)
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            with self._lock:
+                self._pending = rows + self._pending
+            logging.error('ERROR: Unable to write {0} log entries: {1}'
+                          .format(len(rows), e))
+            logging.debug(traceback.format_exc())
+            return False
+
+        self.rows_written += len(rows)
+        return True
+
+action_log = ActionLog(
+    int(get_config_value('performance', 'log_flush_rows', 100)),
+    float(get_config_value('performance', 'log_flush_secs', 5)))
+atexit.register(action_log.flush)
+
+
+class TokenBucket(object):
+
+    """Rate limiter for reddit requests, shared between threads.
+
+    Allows bursts of up to `capacity` requests, refilled at `rate` requests
+    per second. A rate of 0 disables the limit.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Blocks until the tokens are available, then takes them."""
+        if not self.rate:
+            return
+
+        while True:
+            with self._lock:
+                now = time()
+                self._tokens = min(self.capacity,
+                                   self._tokens +
+                                   (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            sleep(wait)
+
+
+class ThreadSafeReddit(praw.Reddit):
+
+    """A reddit session that several threads can make requests with.
+
+    praw's request_json keeps the url being requested on the session until
+    the response is decoded, so concurrent requests (like the action
+    workers') delete each other's. It's kept per thread instead.
+
+    If a request_budget is given, every request takes a token from it
+    first, whichever thread makes it (the main loop, action workers,
+    listing prefetches, moderator list refreshes or shadowban probes).
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._thread_state = threading.local()
+        self._request_budget = kwargs.pop('request_budget', None)
+        praw.Reddit.__init__(self, *args, **kwargs)
+
+    def _request(self, *args, **kwargs):
+        if self._request_budget:
+            self._request_budget.acquire()
+        return praw.Reddit._request(self, *args, **kwargs)
+
+    @property
+    def _request_url(self):
+        try:
+            return self._thread_state.request_url
+        except AttributeError:
+            raise AttributeError('_request_url')
+
+    @_request_url.setter
+    def _request_url(self, url):
+        self._thread_state.request_url = url
+
+    @_request_url.deleter
+    def _request_url(self):
+        del self._thread_state.request_url
+
+
+class ActionExecutor(object):
+
+    """Makes the reddit requests for matched conditions on worker threads.
+
+    Each item always goes to the same worker, so the requests for an item
+    (e.g. posting a comment and then distinguishing it) are made in the
+    order they were submitted, across all the conditions that matched it.
+
+    Permission errors are kept and re-raised in the main thread by
+    raise_errors(), anything else is logged. With no workers, requests
+    are made immediately in the calling thread, and errors are raised
+    from submit().
+    """
+
+    def __init__(self, num_workers, queue_size):
+        self.num_workers = num_workers
+        self.queue_size = queue_size
+        self.latencies = {}
+        self._queues = []
+        self._errors = []
+        self._lock = threading.Lock()
+
+    def _start(self):
+        for i in range(self.num_workers):
+            work_queue = Queue.Queue(self.queue_size)
+            worker = threading.Thread(target=self._work, args=(work_queue,),
+                                      name='action-worker-{0}'.format(i))
+            worker.daemon = True
+            worker.start()
+            self._queues.append(work_queue)
+
+    def submit(self, item, steps, description, on_success=None,
+               on_failure=None):
+        """Queues a list of (name, function) requests to make for the item.
+
+        on_success is called once all of them have been made, on_failure
+        if any of them failed on a worker.
+        """
+        if not self.num_workers:
+            self._run(steps, description, on_success)
+            return
+
+        job = (steps, description, on_success, on_failure)
+
+        if not self._queues:
+            self._start()
+        self._queues[hash(item.name) % self.num_workers].put(job)
+
+    def queue_depth(self):
+        """Returns the number of items waiting for their requests."""
+        return sum(work_queue.qsize() for work_queue in self._queues)
+
+    def join(self):
+        """Waits until all the queued requests have been made."""
+        for work_queue in self._queues:
+            work_queue.join()
+
+    def raise_errors(self):
+        """Re-raises the first permission error hit by a worker."""
+        with self._lock:
+            if not self._errors:
+                return
+            error = self._errors[0]
+            self._errors = []
+        raise error
+
+    def stats(self):
+        """Returns the count, mean and max time of each kind of request."""
+        with self._lock:
+            return {name: {'count': count,
+                           'mean': total / count,
+                           'max': longest}
+                    for name, (count, total, longest)
+                    in self.latencies.iteritems()}
+
+    def _run(self, steps, description, on_success):
+        for name, func in steps:
+            start_time = time()
+            func()
+            elapsed = time() - start_time
+            with self._lock:
+                count, total, longest = self.latencies.get(name, (0, 0.0, 0.0))
+                self.latencies[name] = (count + 1,
+                                        total + elapsed,
+                                        max(longest, elapsed))
+
+        if on_success:
+            on_success()
+
+    def _work(self, work_queue):
+        while True:
+            steps, description, on_success, on_failure = work_queue.get()
+            try:
+                self._run(steps, description, on_success)
+            except (praw.errors.ModeratorRequired,
+                    praw.errors.ModeratorOrScopeRequired,
+                    HTTPError) as e:
+                logging.error(u'ERROR: {0}\n{1}'.format(e, description))
+                if (not isinstance(e, HTTPError) or
+                        e.response.status_code == 403):
+                    with self._lock:
+                        self._errors.append(e)
+                if on_failure:
+                    on_failure()
+            except Exception as e:
+                logging.error(u'ERROR: {0}\n{1}'.format(e, description))
+                logging.debug(traceback.format_exc())
+                if on_failure:
+                    on_failure()
+            finally:
+                work_queue.task_done()
+
+request_budget = TokenBucket(
+    float(get_config_value('performance', 'request_rate', 0.5)),
+    int(get_config_value('performance', 'request_burst', 5)))
+action_executor = ActionExecutor(
+    int(get_config_value('performance', 'action_workers', 0)),
+    int(get_config_value('performance', 'action_queue_size', 1000)))
+
 
 def update_standards_from_wiki(sr, requester):
     """Updates standard conditions from subreddit's wiki."""
@@ -573,18 +1528,24 @@ def update_standards_from_wiki(sr, requester):
                 .format(standard_num, e))
             return False
 
-        # create a condition for final checks
-        condition = Condition(std_def)
+        # create a condition for final checks, compiling its regex(es)
+        # also makes sure that they're valid
+        try:
+            condition = Condition(std_def)
+        except Exception as e:
+            send_error_message(requester, subreddit.display_name,
+                'Generated an invalid regex from section #{0} - {1}'
+                .format(standard_num, e))
+            return False
 
-        # test to make sure that the final regex(es) are valid
-        for pattern in condition.match_patterns.values():
-            try:
-                re.compile(pattern)
-            except Exception as e:
-                send_error_message(requester, subreddit.display_name,
-                    'Generated an invalid regex from section #{0} - {1}'
-                    .format(standard_num, e))
-                return False
+        # make sure the regexes won't be too slow to check items with
+        try:
+            check_regex_cost(condition)
+        except ValueError as e:
+            send_error_message(requester, subreddit.display_name,
+                'Regex too slow in section #{0} - {1}'
+                .format(standard_num, e))
+            return False
 
         standard_num += 1
         kept_sections.update({std_name: condition.yaml})
@@ -601,6 +1562,15 @@ def update_standards_from_wiki(sr, requester):
             session.add(db_standard)
 
         db_standard.yaml = std_yaml
+        db_standard.checksum = yaml_checksum(std_yaml)
+
+    # let the bot know that the standards have changed
+    db_version = session.query(StandardConditionsVersion).first()
+    if not db_version:
+        db_version = StandardConditionsVersion()
+        db_version.version = 0
+        session.add(db_version)
+    db_version.version += 1
 
     session.commit()
 
@@ -669,18 +1639,24 @@ def update_from_wiki(subreddit, requester):
                 .format(condition_num, e))
             return False
 
-        # create a condition for final checks
-        condition = Condition(cond_def)
+        # create a condition for final checks, compiling its regex(es)
+        # also makes sure that they're valid
+        try:
+            condition = Condition(cond_def)
+        except Exception as e:
+            send_error_message(requester, subreddit.display_name,
+                'Generated an invalid regex from section #{0} - {1}'
+                .format(condition_num, e))
+            return False
 
-        # test to make sure that the final regex(es) are valid
-        for pattern in condition.match_patterns.values():
-            try:
-                re.compile(pattern)
-            except Exception as e:
-                send_error_message(requester, subreddit.display_name,
-                    'Generated an invalid regex from section #{0} - {1}'
-                    .format(condition_num, e))
-                return False
+        # make sure the regexes won't be too slow to check items with
+        try:
+            check_regex_cost(condition, subreddit.display_name)
+        except ValueError as e:
+            send_error_message(requester, subreddit.display_name,
+                'Regex too slow in section #{0} - {1}'
+                .format(condition_num, e))
+            return False
 
         condition_num += 1
         kept_sections.append(cond_def)
@@ -701,11 +1677,72 @@ def update_from_wiki(subreddit, requester):
     db_subreddit.conditions_yaml = page_content
     session.commit()
 
-    r.send_message(requester,
-                   '{0} conditions updated'.format(username),
-                   "{0}'s conditions were successfully updated for /r/{1}"
-                   .format(username, subreddit.display_name))
-    return True
+    # store them compiled too, so they don't need to be built again to load.
+    # the conditions checked above had the standards merged over their own
+    # values, so they're built again the same way they're loaded
+    compiled_rows = get_compiled_conditions([db_subreddit.name])
+    store_compiled_conditions(db_subreddit,
+                              build_conditions(db_subreddit.conditions_yaml),
+                              compiled_rows.get(db_subreddit.name))
+    commit_compiled_conditions()
+
+    r.send_message(requester,
+                   '{0} conditions updated'.format(username),
+                   "{0}'s conditions were successfully updated for /r/{1}"
+                   .format(username, subreddit.display_name))
+    return True
+
+
+def check_regex_cost(condition, sr_name=None):
+    """Raises ValueError if any of the condition's regexes are too slow.
+
+    Each moderator-written regex is timed against strings generated to
+    make it backtrack, and against the subreddit's recently seen items.
+    """
+    if not regex_analyzer.timeout:
+        return
+
+    limit_ms = regex_analyzer.timeout * 1000
+    for subject, regex in sorted(condition.match_regexes.iteritems()):
+        if not condition.match_watched[subject]:
+            continue
+
+        tests = [('a generated {0}-character string'.format(len(string)),
+                  string)
+                 for string in adversarial_strings(regex.pattern,
+                                                   regex.flags)]
+        if sr_name:
+            for item in recent_items.get(sr_name):
+                tests.extend([('a recent {0} ({1} characters)'
+                               .format(source, len(item[source])),
+                               item[source])
+                              for source in condition.match_sources[subject]
+                              if source in item])
+
+        for description, string in tests:
+            start_time = time()
+            try:
+                regex_analyzer.search(regex, string)
+            except RegexTimeout:
+                pass
+            elapsed = time() - start_time
+
+            if elapsed > regex_analyzer.timeout:
+                hazards = find_hazards(regex.pattern, regex.flags)
+                message = ('Checking `{0}` took more than {1:g}ms on {2}.'
+                           .format(subject, limit_ms, description))
+                if hazards:
+                    message += (' The regex contains {0}, which can make it '
+                                'very slow on text that almost matches.'
+                                .format('; '.join(hazards)))
+                raise ValueError(message)
+
+
+def yaml_checksum(text):
+    """Returns a checksum of a YAML definition, used to detect changes."""
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return hashlib.sha1(text or '').hexdigest()
 
 
 def lowercase_keys_recursively(subject):
@@ -913,6 +1950,30 @@ def send_error_message(user, sr_name, error):
                            error))
 
 
+def send_quarantine_message(sr_name, condition, timeouts, time_budget):
+    """Sends modmail about a condition quarantined for slow regexes."""
+    global r
+    timings = '\n'.join('- {0:.1f} seconds on a {1}-character field'
+                        .format(timeout.elapsed, timeout.length)
+                        for timeout in timeouts)
+    yaml_block = '\n'.join('    ' + line
+                           for line in condition.yaml.splitlines())
+    r.send_message('/r/' + sr_name,
+                   'Condition disabled in /r/{0}'.format(sr_name),
+                   '### A condition from the [wiki configuration in /r/{0}]'
+                   '(http://www.reddit.com/r/{0}/wiki/{1}) has been '
+                   'disabled\n\nChecking its regex took longer than the '
+                   'limit of {2} seconds {3} times, so it will not be '
+                   'checked until the wiki page is updated:\n\n{4}\n\n'
+                   'Timings:\n\n{5}'
+                   .format(sr_name,
+                           cfg_file.get('reddit', 'wiki_page_name'),
+                           time_budget,
+                           len(timeouts),
+                           yaml_block,
+                           timings))
+
+
 def process_messages():
     """Processes the bot's messages looking for invites/commands."""
     global r
@@ -1029,51 +2090,303 @@ def process_messages():
     return updated_srs
 
 
+class PlaceholderTemplate(object):
+
+    """A string with {{placeholders}}, split up so it can be rendered quickly.
+
+    The string is parsed into a list of literal text and placeholder names
+    once, so rendering only looks up the placeholders that are actually
+    present (each only once) and joins the pieces. Placeholders that can't
+    be filled in for an item are left as they are.
+    """
+
+    _placeholder = re.compile(r'\{\{([a-z_]+|match-\d+)\}\}')
+    _oembed_sources = {'media_user': 'author_name',
+                       'media_title': 'title',
+                       'media_description': 'description',
+                       'media_author_url': 'author_url'}
+
+    def __init__(self, string):
+        self.string = string
+        # odd indices are placeholder names, even ones are literal text
+        self.segments = self._placeholder.split(string)
+        for i in xrange(1, len(self.segments), 2):
+            name = self.segments[i]
+            if not (name in self._values or
+                    name in self._oembed_sources or
+                    name.startswith('match-')):
+                # not a placeholder, keep it as text
+                self.segments[i] = '{{' + name + '}}'
+
+    def render(self, item, match):
+        """Returns the string with the placeholders filled in for the item."""
+        if len(self.segments) == 1:
+            return self.string
+
+        values = {}
+        parts = []
+        for i, segment in enumerate(self.segments):
+            if i % 2 == 0 or segment.startswith('{{'):
+                parts.append(segment)
+                continue
+
+            if segment not in values:
+                values[segment] = self.get_value(segment, item, match)
+            parts.append(values[segment])
+
+        return ''.join(parts)
+
+    def get_value(self, name, item, match):
+        """Returns the value of a placeholder for the item."""
+        unfilled = '{{' + name + '}}'
+        if name.startswith('match-'):
+            if not match:
+                return unfilled
+            try:
+                return match.group(int(name[len('match-'):])) or ''
+            except IndexError:
+                return unfilled
+        elif name in self._oembed_sources:
+            # comments don't have media at all
+            media = getattr(item, 'media', None)
+            try:
+                return media['oembed'][self._oembed_sources[name]]
+            except (KeyError, TypeError):
+                return unfilled
+
+        return self._values[name](item)
+
+    _values = {
+        'body': lambda item: (item.body
+                              if isinstance(item, praw.objects.Comment)
+                              else item.selftext),
+        'kind': lambda item: ('comment'
+                              if isinstance(item, praw.objects.Comment)
+                              else 'submission'),
+        'link_id': lambda item: (item.link_id.split('_')[1]
+                                 if isinstance(item, praw.objects.Comment)
+                                 else item.id),
+        'domain': lambda item: getattr(item, 'domain', ''),
+        'permalink': lambda item: get_permalink(item),
+        'subreddit': lambda item: item.subreddit.display_name,
+        'title': lambda item: (item.link_title
+                               if isinstance(item, praw.objects.Comment)
+                               else item.title),
+        'url': lambda item: getattr(item, 'url', ''),
+        'user': lambda item: (item.author.name if item.author
+                              else '[deleted]'),
+    }
+
+
 def replace_placeholders(string, item, match):
     """Replaces placeholders in the string."""
-    if isinstance(item, praw.objects.Comment):
-        string = string.replace('{{body}}', item.body)
-        string = string.replace('{{kind}}', 'comment')
-        string = string.replace('{{link_id}}', item.link_id.split('_')[1])
-    else:
-        string = string.replace('{{body}}', item.selftext)
-        string = string.replace('{{kind}}', 'submission')
-        string = string.replace('{{link_id}}', item.id)
-    string = string.replace('{{domain}}', getattr(item, 'domain', ''))
-    string = string.replace('{{permalink}}', get_permalink(item))
-    string = string.replace('{{subreddit}}', item.subreddit.display_name)
-    if isinstance(item, praw.objects.Comment):
-        string = string.replace('{{title}}', item.link_title)
-    else:
-        string = string.replace('{{title}}', item.title)
-    string = string.replace('{{url}}', getattr(item, 'url', ''))
-    if item.author:
-        string = string.replace('{{user}}', item.author.name)
-    else:
-        string = string.replace('{{user}}', '[deleted]')
-
-    if getattr(item, 'media', None):
-        oembed_mapping = {'{{media_user}}': 'author_name',
-                          '{{media_title}}': 'title',
-                          '{{media_description}}': 'description',
-                          '{{media_author_url}}': 'author_url'}
-        for placeholder, source in oembed_mapping.iteritems():
-            if placeholder in string:
-                try:
-                    string = string.replace(placeholder,
-                                            item.media['oembed'][source])
-                except KeyError:
-                    pass
-
-    # replace any {{match_##}} with the corresponding match groups
-    string = re.sub(r'\{\{match-(\d+)\}\}', r'\\\1', string)
-    if match:
-        try:
-            string = match.expand(string)
-        except IndexError:
-            pass
+    return PlaceholderTemplate(string).render(item, match)
+
+
+class ReportStates(object):
+
+    """Fingerprints of reported items, as they were when last checked.
+
+    The report queue is walked back through the whole backlog every time
+    it's checked, but most of the items haven't changed since the last
+    time. An item is skipped if everything about it that conditions look
+    at is the same, and so are its subreddit's conditions. Entries expire
+    so that things outside the item (like the author's karma) are picked up
+    eventually. Items whose actions failed are never skipped.
+    """
+
+    def __init__(self, max_size, ttl):
+        self._cache = LRUCache(max_size, ttl)
+        # items whose actions failed this pass, so they aren't recorded
+        self._failed = set()
+        self._lock = threading.Lock()
+        self.skipped = 0
+        self.checked = 0
+
+    def reset(self):
+        with self._lock:
+            self._failed.clear()
+        self.skipped = 0
+        self.checked = 0
+
+    @staticmethod
+    def fingerprint(item, conditions):
+        """Returns a tuple of the item's state that affects checking it."""
+        if isinstance(item, praw.objects.Comment):
+            text = item.body
+        else:
+            text = u'{0}\n{1}'.format(item.title, item.selftext)
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+
+        return (conditions.version,
+                item.num_reports,
+                getattr(item, 'edited', False),
+                hashlib.sha1(text).digest(),
+                unicode(item.approved_by),
+                unicode(item.banned_by),
+                getattr(item, 'link_flair_text', None),
+                getattr(item, 'link_flair_css_class', None),
+                item.author_flair_text,
+                item.author_flair_css_class)
+
+    def is_unchanged(self, fullname, fingerprint):
+        """Returns True if the item was checked in the same state before."""
+        with self._lock:
+            unchanged = self._cache.get(fullname) == fingerprint
+        if unchanged:
+            self.skipped += 1
+            return True
+
+        self.checked += 1
+        return False
+
+    def record(self, fullname, fingerprint):
+        """Saves the state an item was fully checked in, unless any of
+        its actions failed this pass."""
+        with self._lock:
+            if fullname not in self._failed:
+                self._cache.set(fullname, fingerprint)
+
+    def forget(self, fullname):
+        """Makes sure the item is checked again, whether its state was
+        recorded yet or not. Called from the action workers."""
+        with self._lock:
+            self._failed.add(fullname)
+            self._cache.discard(fullname)
+
+    def skip_rate(self):
+        return float(self.skipped) / max(self.skipped + self.checked, 1)
+
+listing_recorder = ListingRecorder(
+    get_config_value('performance', 'record_listings_file', ''))
+atexit.register(listing_recorder.close)
+
+report_states = ReportStates(
+    int(get_config_value('performance', 'report_state_cache_size', 10000)),
+    int(get_config_value('performance', 'report_state_ttl_mins', 60)) * 60)
+
+
+def is_skipped(queue, item):
+    """Returns True if the item shouldn't be checked in the queue."""
+    # skip non-removed (reported) items when checking spam
+    if queue == 'spam' and not item.banned_by:
+        return True
+
+    # never check the bot's own comments
+    bot_username = cfg_file.get('reddit', 'username')
+    return bool(item.author and
+                item.author.name.lower() == bot_username.lower() and
+                isinstance(item, praw.objects.Comment))
+
+
+def is_past_stop_time(queue, item, stop_time):
+    """Returns True if the item is older than the queue needs checked."""
+    item_time = datetime.utcfromtimestamp(item.created_utc)
+    return (item_time < stop_time and
+            (queue != 'submission' or not item.approved_by))
+
+
+def is_last_item(queue, item, stop_time):
+    """Returns True if checking the queue stops at this item."""
+    return (not is_skipped(queue, item) and
+            is_past_stop_time(queue, item, stop_time))
+
+
+def prefetch_pages(queue, items, stop_time, sr_dict, cond_dict,
+                   page_size=100):
+    """Yields the items, loading what's needed to check them a page at a time.
+
+    This includes the actions already performed on them, and in the spam
+    queue, whether the users who might get approved are shadowbanned.
+    """
+    page = []
+    for item in items:
+        page.append(item)
+        # don't read further ahead than the checking will go
+        if (len(page) < page_size and
+                not is_last_item(queue, item, stop_time)):
+            continue
+
+        prefetch_page(queue, page, sr_dict, cond_dict)
+        for page_item in page:
+            yield page_item
+        page = []
+
+    prefetch_page(queue, page, sr_dict, cond_dict)
+    for page_item in page:
+        yield page_item
+
+
+def prefetch_page(queue, page, sr_dict, cond_dict):
+    action_log.prefetch([item.name for item in page])
+
+    if queue == 'spam':
+        users = []
+        for item in page:
+            sr_name = item.subreddit.display_name.lower()
+            if (item.author and
+                    not sr_dict[sr_name].exclude_banned_modqueue and
+                    any(c.action == 'approve'
+                        for c in cond_dict[sr_name][queue])):
+                users.append(item.author)
+        prefetch_shadowbanned(users)
+
+
+class ListingFetcher(object):
+
+    """Reads a queue's listing on a background thread, ahead of checking.
+
+    At most max_items are held at once, and reading stops at the item
+    that checking will stop at, or as soon as the fetcher is closed.
+    Errors from reading the listing are re-raised when iterating.
+    """
+
+    _end = object()
+
+    def __init__(self, queue, listing, stop_time, max_items):
+        self.queue = queue
+        self.stop_time = stop_time
+        self._listing = listing
+        self._items = Queue.Queue(max_items)
+        self._closed = threading.Event()
+        self._thread = threading.Thread(target=self._fetch,
+                                        name='listing-fetcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __iter__(self):
+        while True:
+            entry = self._items.get()
+            if entry is self._end:
+                return
+            if isinstance(entry, tuple):
+                # (type, value, traceback) of an error while reading
+                raise entry[0], entry[1], entry[2]
+            yield entry
+
+    def close(self):
+        self._closed.set()
+
+    def _put(self, entry):
+        while not self._closed.is_set():
+            try:
+                self._items.put(entry, timeout=1)
+                return True
+            except Queue.Full:
+                pass
+        return False
 
-    return string
+    def _fetch(self):
+        try:
+            for item in self._listing:
+                if not self._put(item):
+                    return
+                if is_last_item(self.queue, item, self.stop_time):
+                    break
+        except Exception:
+            self._put(sys.exc_info())
+        self._put(self._end)
 
 
 def check_items(queue, items, stop_time, sr_dict, cond_dict):
@@ -1084,70 +2397,99 @@ def check_items(queue, items, stop_time, sr_dict, cond_dict):
 
     logging.info('Checking {0} queue'.format(queue))
 
-    bot_username = cfg_file.get('reddit', 'username')
-    for item in items:
-        # skip non-removed (reported) items when checking spam
-        if queue == 'spam' and not item.banned_by:
-            continue
+    action_log.reset()
+    report_states.reset()
 
-        # never check the bot's own comments
-        if (item.author and
-                item.author.name.lower() == bot_username.lower() and
-                isinstance(item, praw.objects.Comment)):
-            continue
+    try:
+        for item in prefetch_pages(queue, items, stop_time,
+                                   sr_dict, cond_dict):
+            # stop if the action workers hit a permissions problem
+            action_executor.raise_errors()
+            action_log.flush_if_due()
+            listing_recorder.record(queue, item)
+
+            if is_skipped(queue, item):
+                continue
 
-        item_time = datetime.utcfromtimestamp(item.created_utc)
-        if (item_time < stop_time and
-                (queue != 'submission' or not item.approved_by)):
-            break
+            if is_past_stop_time(queue, item, stop_time):
+                break
+            item_time = datetime.utcfromtimestamp(item.created_utc)
 
-        sr_name = item.subreddit.display_name.lower()
-        subreddit = sr_dict[sr_name]
-        conditions = cond_dict[sr_name][queue]
+            sr_name = item.subreddit.display_name.lower()
+            subreddit = sr_dict[sr_name]
+            conditions = cond_dict[sr_name][queue]
 
-        if (queue != 'report' and
-                (queue != 'submission' or not item.approved_by) and
-                sr_name not in last_updates):
-            last_updates[sr_name] = item_time
+            if (queue != 'report' and
+                    (queue != 'submission' or not item.approved_by) and
+                    sr_name not in last_updates):
+                last_updates[sr_name] = item_time
 
-        # don't need to check for shadowbanned unless we're in spam
-        # and the subreddit doesn't exclude shadowbanned posts
-        if queue == 'spam' and not subreddit.exclude_banned_modqueue:
-            for condition in conditions:
-                condition.check_shadowbanned = True
-        else:
-            for condition in conditions:
-                condition.check_shadowbanned = False
+            # don't need to check for shadowbanned unless we're in spam
+            # and the subreddit doesn't exclude shadowbanned posts
+            check_shadowbanned = (queue == 'spam' and
+                                  not subreddit.exclude_banned_modqueue)
 
-        item_count += 1
+            # skip reported items that haven't changed since last time
+            if queue == 'report':
+                fingerprint = report_states.fingerprint(item, conditions)
+                if report_states.is_unchanged(item.name, fingerprint):
+                    continue
 
-        logging.info(u'Checking {0} old item {1}'
-                      .format(datetime.utcnow() - datetime.utcfromtimestamp(item.created_utc),
-                              get_permalink(item)))
+            item_count += 1
 
-        try:
-            # check removal conditions, stop checking if any matched
-            if check_conditions(subreddit, item,
-                                [c for c in conditions
-                                 if c.action in ('remove', 'spam')],
-                                stop_after_match=True):
-                continue
+            logging.info(u'Checking {0} old item {1}'
+                          .format(datetime.utcnow() - datetime.utcfromtimestamp(item.created_utc),
+                                  get_permalink(item)))
 
-            # check all other conditions
-            check_conditions(subreddit, item,
-                             [c for c in conditions
-                              if (c.action not in ('remove', 'spam')
-                                  or c.report)])
-        except (praw.errors.ModeratorRequired,
-                praw.errors.ModeratorOrScopeRequired,
-                HTTPError) as e:
-            if not isinstance(e, HTTPError) or e.response.status_code == 403:
-                logging.error('Permissions error in /r/{0}'
-                              .format(subreddit.name))
-            raise
-        except Exception as e:
-            logging.error('ERROR: {0}'.format(e))
-            logging.debug(traceback.format_exc())
+            # share the item's extracted fields between all the conditions
+            view = ItemView(item)
+            recent_items.add(sr_name, view)
+
+            try:
+                prefilter = conditions.prefilter(view)
+                removal_conditions, other_conditions = \
+                    conditions.partitions(item)
+
+                # check removal conditions, stop checking if any matched
+                # otherwise check all other conditions
+                failed = []
+                if not check_conditions(subreddit, item, removal_conditions,
+                                        stop_after_match=True,
+                                        view=view,
+                                        prefilter=prefilter,
+                                        check_shadowbanned=
+                                            check_shadowbanned,
+                                        failed=failed):
+                    check_conditions(subreddit, item, other_conditions,
+                                     view=view,
+                                     prefilter=prefilter,
+                                     check_shadowbanned=check_shadowbanned,
+                                     failed=failed)
+
+                # only skip it next time if every condition was checked
+                if queue == 'report' and not failed:
+                    report_states.record(item.name, fingerprint)
+            except (praw.errors.ModeratorRequired,
+                    praw.errors.ModeratorOrScopeRequired,
+                    HTTPError) as e:
+                if not isinstance(e, HTTPError) or e.response.status_code == 403:
+                    logging.error('Permissions error in /r/{0}'
+                                  .format(subreddit.name))
+                raise
+            except Exception as e:
+                logging.error('ERROR: {0}'.format(e))
+                logging.debug(traceback.format_exc())
+    finally:
+        # let the queued actions finish, and write out the log for
+        # everything done, even if checking failed
+        if action_executor.queue_depth():
+            logging.debug('Waiting for {0} queued actions'
+                          .format(action_executor.queue_depth()))
+        action_executor.join()
+        action_log.flush()
+        listing_recorder.flush()
+
+    action_executor.raise_errors()
 
     # Update "last_" entries in db
     logging.debug("Updating subreddit last_* values:\n")
@@ -1156,40 +2498,50 @@ def check_items(queue, items, stop_time, sr_dict, cond_dict):
         setattr(sr_dict[sr], 'last_'+queue, last_updates[sr])
     session.commit()
 
-    logging.info('Checked {0} items in {1}'
-                 .format(item_count, elapsed_since(start_time)))
-
-
-def check_conditions(subreddit, item, conditions, stop_after_match=False):
+    elapsed = elapsed_since(start_time)
+    logging.info('Checked {0} items in {1}'.format(item_count, elapsed))
+    if queue == 'report' and report_states.skipped:
+        logging.info('Skipped {0} unchanged reported items ({1:.0%})'
+                     .format(report_states.skipped,
+                             report_states.skip_rate()))
+    if action_log.matches:
+        logging.info('Logged {0} matches ({1} log rows), {2:.1f} matches/sec'
+                     .format(action_log.matches,
+                             action_log.rows_written,
+                             action_log.matches /
+                                 max(elapsed.total_seconds(), 0.001)))
+
+
+def check_conditions(subreddit, item, conditions, stop_after_match=False,
+                     view=None, prefilter=None, check_shadowbanned=False,
+                     failed=None):
     """Checks an item against a list of conditions.
 
+    The conditions must already be only the ones for the item's type, in
+    the order to check them (see ConditionSet.partitions). If a prefilter
+    is given, conditions it rules out aren't checked. Conditions that
+    couldn't be checked (because of an error or a regex timeout) are
+    added to the failed list, if one is given.
     Returns True if any conditions matched, False otherwise.
     """
-    bot_username = cfg_file.get('reddit', 'username')
+    if view is None:
+        view = ItemView(item)
 
-    if isinstance(item, praw.objects.Submission):
-        conditions = [c for c in conditions
-                          if c.type in ('submission', 'both')]
-    elif isinstance(item, praw.objects.Comment):
-        conditions = [c for c in conditions
-                          if c.type in ('comment', 'both')]
+    bot_username = cfg_file.get('reddit', 'username')
 
     # get what's already been performed out of the log
-    performed_actions = set()
-    performed_yaml = set()
-    log_entries = (session.query(Log)
-                          .filter(Log.item_fullname == item.name)
-                          .all())
-    for entry in log_entries:
-        performed_actions.add(entry.action)
-        performed_yaml.add(entry.condition_yaml)
-
-    # sort the conditions by desc priority, and then by required requests
-    conditions.sort(key=lambda c: c.requests_required)
-    conditions.sort(key=lambda c: c.priority, reverse=True)
+    performed_actions, performed_yaml = action_log.performed(item.name)
 
     any_matched = False
     for condition in conditions:
+        # skip conditions that can't match the item's values
+        if prefilter and not prefilter.allows(condition):
+            continue
+
+        # skip conditions whose regexes have been timing out
+        if regex_watchdog.is_quarantined(subreddit, condition):
+            continue
+
         # don't check remove/spam/report conditions on posts made by mods
         if (condition.moderators_exempt and
                 (condition.action in ('remove', 'spam', 'report')
@@ -1226,7 +2578,7 @@ def check_conditions(subreddit, item, conditions, stop_after_match=False):
 
         try:
             start_time = time()
-            match = condition.check_item(item)
+            match = condition.check_item(item, view, check_shadowbanned)
             if match:
                 if condition.action:
                     performed_actions.add(condition.action)
@@ -1242,10 +2594,17 @@ def check_conditions(subreddit, item, conditions, stop_after_match=False):
                 praw.errors.ModeratorOrScopeRequired,
                 HTTPError) as e:
             raise
+        except RegexTimeout as e:
+            regex_watchdog.record_timeout(subreddit, condition, e)
+            match = False
+            if failed is not None:
+                failed.append(condition)
         except Exception as e:
             logging.error(u'ERROR: {0}\n{1}'.format(e, condition.yaml))
             logging.debug(traceback.format_exc())
             match = False
+            if failed is not None:
+                failed.append(condition)
 
         any_matched = (any_matched or match)
         if stop_after_match and any_matched:
@@ -1278,24 +2637,300 @@ def filter_conditions(conditions, queue):
                    (c.action != 'approve' or c.report)]
 
 
+class LiteralMatcher(object):
+
+    """Finds which of a set of literal strings occur in a string.
+
+    The literals are stored in a trie, which is also turned into a single
+    regex that finds every position any of them could start at in one pass
+    over the string. Only those positions are then walked through the trie
+    to find the literals that actually occur, including overlapping ones.
+    """
+
+    # the start regex only needs to narrow down positions, so the trie is
+    # cut off at this depth to keep the regex small
+    _max_pattern_depth = 8
+
+    def __init__(self, literals):
+        self._trie = {}
+        for literal in literals:
+            node = self._trie
+            for char in literal:
+                node = node.setdefault(char, {})
+            # None can't be a char, so it marks the end of a literal
+            node[None] = literal
+
+        self._starts = re.compile(u'(?={0})'.format(self._pattern(self._trie)),
+                                  re.DOTALL|re.UNICODE)
+
+    def _pattern(self, node, depth=0):
+        # a literal ending here means the prefix so far is enough to match
+        if None in node or depth >= self._max_pattern_depth:
+            return u''
+
+        alternatives = [re.escape(char) + self._pattern(child, depth + 1)
+                        for char, child in sorted(node.iteritems())]
+        if len(alternatives) == 1:
+            return alternatives[0]
+        return u'(?:{0})'.format(u'|'.join(alternatives))
+
+    def find(self, string):
+        """Returns the set of literals that occur in the string."""
+        found = set()
+        length = len(string)
+        for match in self._starts.finditer(string):
+            node = self._trie
+            for i in xrange(match.start(), length):
+                node = node.get(string[i])
+                if node is None:
+                    break
+                if None in node:
+                    found.add(node[None])
+
+        return found
+
+
+class ConditionSet(object):
+
+    """The conditions a subreddit checks in one of the queues.
+
+    Conditions are indexed so that for each item only the ones that could
+    possibly match it need their regexes run:
+
+    - Subjects that have to exactly equal one of a list of values (the
+      full-exact default for users, domains, etc.) are indexed by those
+      values in hash sets. Inverse subjects are indexed the same way,
+      ruling out the conditions whose values do match.
+    - Otherwise, plain word lists on the title and body (and combined
+      subjects including them) are indexed by literal matchers, so one
+      pass over each field finds every condition with a value in it.
+
+    Conditions with nothing indexable are always checked.
+
+    The conditions are also sorted and split up for each type of item ahead
+    of time, since that never changes once they're loaded.
+    """
+
+    # the body is affected by ignore_blockquotes, so it isn't indexed
+    _unindexed_sources = set(['body'])
+    _literal_sources = set(['title', 'body'])
+
+    _versions = itertools.count()
+
+    def __init__(self, conditions):
+        self.conditions = conditions
+        # changes whenever a subreddit's conditions are rebuilt
+        self.version = next(self._versions)
+        # (source, case_sensitive, subdomains): {value: set(conditions)}
+        self._exact = {}
+        self._inverse = {}
+        # (source, ignore_blockquotes, case_sensitive):
+        #     {literal: set(conditions)}
+        self._literals = {}
+        self._indexed = set()
+
+        for condition in conditions:
+            self._index_condition(condition)
+
+        self._literal_matchers = dict((key, LiteralMatcher(literals))
+                                      for key, literals
+                                      in self._literals.iteritems())
+
+        # sort by desc priority, and then by required requests
+        ordered = sorted(conditions, key=lambda c: c.requests_required)
+        ordered.sort(key=lambda c: c.priority, reverse=True)
+        self._submission_partitions = self._partition(ordered, 'submission')
+        self._comment_partitions = self._partition(ordered, 'comment')
+
+    def __iter__(self):
+        return iter(self.conditions)
+
+    def __len__(self):
+        return len(self.conditions)
+
+    def _partition(self, ordered, item_type):
+        of_type = [c for c in ordered if c.type in (item_type, 'both')]
+        return (tuple(c for c in of_type if c.action in ('remove', 'spam')),
+                tuple(c for c in of_type
+                      if c.action not in ('remove', 'spam') or c.report))
+
+    def partitions(self, item):
+        """Returns the removal and other conditions to check an item with."""
+        if isinstance(item, praw.objects.Submission):
+            return self._submission_partitions
+        return self._comment_partitions
+
+    def _index_condition(self, condition):
+        indexed = False
+        for subject in sorted(condition.match_exact):
+            exact = condition.match_exact[subject]
+            sources = condition.match_sources[subject]
+            if not exact or sources & self._unindexed_sources:
+                continue
+
+            values, subdomains = exact
+            case_sensitive = not (condition.match_flags[subject] &
+                                  re.IGNORECASE)
+            if condition.match_success[subject]:
+                # one subject is enough to narrow down the conditions
+                if indexed:
+                    continue
+                index = self._exact
+                indexed = True
+                self._indexed.add(condition)
+            else:
+                index = self._inverse
+
+            for source in sources:
+                values_index = index.setdefault(
+                    (source, case_sensitive, subdomains), {})
+                for value in values:
+                    values_index.setdefault(value, set()).add(condition)
+
+        if not indexed:
+            self._index_literals(condition)
+
+    def _index_literals(self, condition):
+        for subject in sorted(condition.match_literals):
+            literals = condition.match_literals[subject]
+            sources = condition.match_sources[subject]
+            if (not literals or not condition.match_success[subject] or
+                    not sources & self._literal_sources):
+                continue
+
+            case_sensitive = not (condition.match_flags[subject] &
+                                  re.IGNORECASE)
+            for source in sources:
+                key = (source,
+                       source == 'body' and condition.ignore_blockquotes,
+                       case_sensitive)
+                literals_index = self._literals.setdefault(key, {})
+                for literal in literals:
+                    literals_index.setdefault(literal, set()).add(condition)
+
+            self._indexed.add(condition)
+            return
+
+    def _lookup(self, index, view):
+        found = set()
+        for (source, case_sensitive, subdomains), values_index in \
+                index.iteritems():
+            string = view.target(source)
+            if not case_sensitive:
+                string = string.lower()
+
+            # $ also matches before a trailing newline
+            lookups = [string]
+            if string.endswith('\n'):
+                lookups.append(string[:-1])
+            if subdomains:
+                lookups.extend([value[i+1:]
+                                for value in lookups
+                                for i, char in enumerate(value)
+                                if char == '.'])
+
+            for value in lookups:
+                found.update(values_index.get(value, ()))
+
+        return found
+
+    def _lookup_literals(self, view):
+        found = set()
+        for key, matcher in self._literal_matchers.iteritems():
+            source, ignore_blockquotes, case_sensitive = key
+            string = view.target(source, ignore_blockquotes)
+            if not case_sensitive:
+                string = string.lower()
+
+            literals_index = self._literals[key]
+            for literal in matcher.find(string):
+                found.update(literals_index[literal])
+
+        return found
+
+    def prefilter(self, view):
+        """Returns a filter of the conditions that could match the item."""
+        matched = self._lookup(self._exact, view)
+        matched.update(self._lookup_literals(view))
+        return ConditionPrefilter(self._indexed, matched,
+                                  self._lookup(self._inverse, view))
+
+
+class ConditionPrefilter(object):
+
+    """The conditions that can be skipped for an item, found by an index."""
+
+    def __init__(self, indexed, matched, excluded):
+        self._indexed = indexed
+        self._matched = matched
+        self._excluded = excluded
+
+    def allows(self, condition):
+        """Returns False if the condition can't possibly match the item."""
+        if condition in self._excluded:
+            return False
+        return condition not in self._indexed or condition in self._matched
+
+
 def get_user_rank(user, subreddit):
     """Returns the user's rank in the subreddit."""
-    sr_name = subreddit.display_name.lower()
+    moderators, contributors = rank_cache.get(subreddit)
+
+    if user.name in moderators:
+        return 'moderator'
+    elif user.name in contributors:
+        return 'contributor'
+    else:
+        return 'user'
+
+
+class RankCache(object):
+
+    """Moderator and contributor lists for each subreddit.
+
+    A subreddit's lists are only fetched inline the first time they're
+    needed. After that, lists that are due for a refresh keep being used
+    while a background thread fetches new ones, so checking an item never
+    waits on paging through a long contributor list. Refresh times are
+    jittered so that subreddits don't all come due in the same loop.
+
+    The lists can be saved to a snapshot file, so that a restart doesn't
+    have to fetch all of them again.
+    """
+
+    def __init__(self, ttl, snapshot_path=None):
+        self.ttl = ttl
+        self.snapshot_path = snapshot_path
+        # sr_name: (moderators, contributors, fetch time, refresh time)
+        self._entries = {}
+        self._refreshing = set()
+        self._to_refresh = Queue.Queue()
+        self._refresher = None
+        self._lock = threading.Lock()
+        self._changed = False
+
+    def get(self, subreddit):
+        """Returns sets of the subreddit's moderators and contributors."""
+        sr_name = subreddit.display_name.lower()
+        with self._lock:
+            entry = self._entries.get(sr_name)
+
+        if entry is None:
+            entry = self._fetch(subreddit)
+        elif entry[3] <= time():
+            self._refresh_later(subreddit)
 
-    # fetch mod/contrib lists if necessary
-    cached = False
-    if sr_name in get_user_rank.moderator_cache:
-        cache_age = datetime.utcnow() - get_user_rank.cache_time[sr_name]
-        if cache_age < timedelta(hours=1):
-            cached = True
+        return entry[0], entry[1]
 
-    if not cached:
-        get_user_rank.cache_time[sr_name] = datetime.utcnow()
+    def _refresh_time(self, fetch_time):
+        return fetch_time + self.ttl * random.uniform(0.75, 1.25)
+
+    def _fetch(self, subreddit):
+        sr_name = subreddit.display_name.lower()
 
         mod_list = set()
         for mod in subreddit.get_moderators():
             mod_list.add(mod.name)
-        get_user_rank.moderator_cache[sr_name] = mod_list
 
         contrib_list = set()
         try:
@@ -1304,23 +2939,132 @@ def get_user_rank(user, subreddit):
         except HTTPError as e:
             if e.response.status_code != 404:
                 raise
-        get_user_rank.contributor_cache[sr_name] = contrib_list
 
-    if user.name in get_user_rank.moderator_cache[sr_name]:
-        return 'moderator'
-    elif user.name in get_user_rank.contributor_cache[sr_name]:
-        return 'contributor'
-    else:
-        return 'user'
-get_user_rank.moderator_cache = {}
-get_user_rank.contributor_cache = {}
-get_user_rank.cache_time = {}
+        fetch_time = time()
+        entry = (mod_list, contrib_list,
+                 fetch_time, self._refresh_time(fetch_time))
+        with self._lock:
+            self._entries[sr_name] = entry
+            self._changed = True
+        return entry
+
+    def _refresh_later(self, subreddit):
+        sr_name = subreddit.display_name.lower()
+        with self._lock:
+            if sr_name in self._refreshing:
+                return
+            self._refreshing.add(sr_name)
+
+            if not self._refresher:
+                self._refresher = threading.Thread(target=self._refresh,
+                                                   name='rank-refresher')
+                self._refresher.daemon = True
+                self._refresher.start()
+
+        self._to_refresh.put(subreddit)
+
+    def _refresh(self):
+        while True:
+            subreddit = self._to_refresh.get()
+            sr_name = subreddit.display_name.lower()
+            try:
+                self._fetch(subreddit)
+            except Exception as e:
+                logging.error('ERROR: Unable to refresh moderators/'
+                              'contributors of /r/{0}: {1}'
+                              .format(sr_name, e))
+                # keep using the old lists for a while before trying again
+                with self._lock:
+                    mods, contribs, fetch_time, _ = self._entries[sr_name]
+                    self._entries[sr_name] = (mods, contribs, fetch_time,
+                                              self._refresh_time(time()))
+            finally:
+                with self._lock:
+                    self._refreshing.discard(sr_name)
+
+    def load_snapshot(self):
+        """Loads the lists saved by save_snapshot, if there are any."""
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+
+        try:
+            with open(self.snapshot_path) as snapshot_file:
+                snapshot = json.load(snapshot_file)
+        except (IOError, ValueError) as e:
+            logging.error('ERROR: Unable to load rank snapshot {0}: {1}'
+                          .format(self.snapshot_path, e))
+            return
+
+        with self._lock:
+            for sr_name, lists in snapshot.iteritems():
+                self._entries[sr_name] = (set(lists['moderators']),
+                                          set(lists['contributors']),
+                                          lists['fetched'],
+                                          self._refresh_time(lists['fetched']))
+        logging.info('Loaded moderator/contributor lists for {0} subreddits'
+                     .format(len(snapshot)))
+
+    def save_snapshot(self):
+        """Saves the lists to the snapshot file, if anything changed."""
+        if not self.snapshot_path or not self._changed:
+            return
+
+        with self._lock:
+            snapshot = {sr_name: {'moderators': sorted(entry[0]),
+                                  'contributors': sorted(entry[1]),
+                                  'fetched': entry[2]}
+                        for sr_name, entry in self._entries.iteritems()}
+            self._changed = False
+
+        # write to a temporary file first so a crash can't leave half of one
+        temp_path = self.snapshot_path + '.tmp'
+        with open(temp_path, 'w') as snapshot_file:
+            json.dump(snapshot, snapshot_file)
+        os.rename(temp_path, self.snapshot_path)
+
+rank_cache = RankCache(
+    60 * float(get_config_value('performance', 'rank_cache_ttl_mins', 60)),
+    get_config_value('performance', 'rank_cache_file', '') or None)
+
+
+class ShadowbanCache(object):
+
+    """Whether redditors are shadowbanned, by lowercased username.
+
+    Shadowbanned users are kept for positive_ttl seconds, others only for
+    negative_ttl, since a ban can start at any time but rarely ends soon.
+    """
+
+    def __init__(self, max_size, positive_ttl, negative_ttl):
+        self._cache = LRUCache(max_size)
+        self.positive_ttl = positive_ttl
+        self.negative_ttl = negative_ttl
+
+    def get(self, key):
+        """Returns True or False, or None if the user isn't cached."""
+        return self._cache.get(key)
+
+    def set(self, key, shadowbanned):
+        if shadowbanned:
+            ttl = self.positive_ttl
+        else:
+            ttl = self.negative_ttl
+        self._cache.set(key, shadowbanned, ttl)
 
 
 def user_is_shadowbanned(user):
     """Returns True if the user is shadowbanned."""
-    global r
+    key = user.name.lower()
+    shadowbanned = shadowban_cache.get(key)
+    if shadowbanned is None:
+        shadowbanned = probe_shadowbanned(user)
+        shadowban_cache.set(key, shadowbanned)
+
+    return shadowbanned
 
+
+def probe_shadowbanned(user):
+    """Requests the user's overview to find out if they're shadowbanned."""
     try: # try to get user overview
         list(user.get_overview(limit=1))
     except HTTPError as e:
@@ -1333,6 +3077,59 @@ def user_is_shadowbanned(user):
     return False
 
 
+def prefetch_shadowbanned(users):
+    """Finds out if any uncached users are shadowbanned, concurrently.
+
+    Only the requests are made on the probe threads, the cache is only
+    touched from the calling thread.
+    """
+    num_threads = int(get_config_value('performance',
+                                       'shadowban_probe_threads', 0))
+    unresolved = {}
+    for user in users:
+        key = user.name.lower()
+        if key not in unresolved and shadowban_cache.get(key) is None:
+            unresolved[key] = user
+    if not num_threads or not unresolved:
+        return
+
+    to_probe = Queue.Queue()
+    for key, user in unresolved.iteritems():
+        to_probe.put((key, user))
+    results = []
+
+    def probe():
+        while True:
+            try:
+                key, user = to_probe.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                results.append((key, probe_shadowbanned(user)))
+            except Exception as e:
+                # it'll just be checked again when it's needed
+                logging.debug('Unable to check /u/{0} for shadowban: {1}'
+                              .format(user.name, e))
+
+    threads = [threading.Thread(target=probe, name='shadowban-probe')
+               for i in range(min(num_threads, len(unresolved)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for key, shadowbanned in results:
+        shadowban_cache.set(key, shadowbanned)
+
+shadowban_cache = ShadowbanCache(
+    int(get_config_value('performance', 'shadowban_cache_size', 10000)),
+    60 * float(get_config_value('performance',
+                                'shadowban_positive_ttl_mins', 360)),
+    60 * float(get_config_value('performance',
+                                'shadowban_negative_ttl_mins', 30)))
+
+
 def get_permalink(item):
     """Returns the permalink for the item."""
     if isinstance(item, praw.objects.Submission):
@@ -1381,9 +3178,15 @@ def build_multireddit_groups(subreddits):
 
 
 def check_queues(queue_funcs, sr_dict, cond_dict):
-    """Checks all the queues for new items to process."""
+    """Checks all the queues for new items to process.
+
+    The listings for the next multireddit groups/queues are read in the
+    background while the current one is being checked.
+    """
     global r
 
+    # build the list of listings to check, in order
+    listings = []
     for queue in queue_funcs:
         subreddits = [s for s in sr_dict
                       if s in cond_dict and len(cond_dict[s][queue]) > 0]
@@ -1392,7 +3195,6 @@ def check_queues(queue_funcs, sr_dict, cond_dict):
 
         multireddits = build_multireddit_groups(subreddits)
 
-        # fetch and process the items for each multireddit
         for multi in multireddits:
             if queue == 'report':
                 limit = cfg_file.get('reddit', 'report_backlog_limit_hours')
@@ -1405,24 +3207,241 @@ def check_queues(queue_funcs, sr_dict, cond_dict):
             queue_subreddit = r.get_subreddit('+'.join(multi))
             if queue_subreddit:
                 queue_func = getattr(queue_subreddit, queue_funcs[queue])
-                items = queue_func(limit=None)
-                check_items(queue, items, stop_time, sr_dict, cond_dict)
+                listings.append((queue, queue_func, stop_time))
+
+    prefetch_depth = int(get_config_value('performance',
+                                          'listing_prefetch_depth', 1))
+    if not prefetch_depth:
+        for queue, queue_func, stop_time in listings:
+            check_items(queue, queue_func(limit=None), stop_time,
+                        sr_dict, cond_dict)
+        return
+
+    max_items = int(get_config_value('performance',
+                                     'listing_prefetch_items', 200))
+
+    # fetch and process the items for each multireddit, keeping the
+    # fetchers for up to prefetch_depth listings running ahead
+    fetchers = deque()
+    listings = deque(listings)
+    try:
+        while listings or fetchers:
+            while listings and len(fetchers) <= prefetch_depth:
+                queue, queue_func, stop_time = listings.popleft()
+                fetchers.append(ListingFetcher(queue, queue_func(limit=None),
+                                               stop_time, max_items))
+
+            fetcher = fetchers.popleft()
+            try:
+                check_items(fetcher.queue, fetcher, fetcher.stop_time,
+                            sr_dict, cond_dict)
+            finally:
+                fetcher.close()
+    finally:
+        for fetcher in fetchers:
+            fetcher.close()
+
+
+class StandardDependents(object):
+
+    """Index of the subreddit conditions that include each standard."""
+
+    def __init__(self):
+        # standard name: {sr_name: number of conditions including it}
+        self._by_standard = {}
+        self._by_subreddit = {}
+
+    def update(self, sr_name, conditions):
+        """Replaces the standards used by the subreddit's conditions."""
+        for name in self._by_subreddit.pop(sr_name, ()):
+            self._by_standard[name].pop(sr_name, None)
+
+        counts = {}
+        for condition in conditions:
+            name = getattr(condition, 'standard', None)
+            if isinstance(name, basestring):
+                counts[name.lower()] = counts.get(name.lower(), 0) + 1
+
+        for name, count in counts.iteritems():
+            self._by_standard.setdefault(name, {})[sr_name] = count
+        self._by_subreddit[sr_name] = set(counts)
+
+    def subreddits(self, names):
+        """Returns {sr_name: number of conditions} including any standard."""
+        dependents = {}
+        for name in names:
+            for sr_name, count in self._by_standard.get(name, {}).iteritems():
+                dependents[sr_name] = dependents.get(sr_name, 0) + count
+        return dependents
+
+standard_dependents = StandardDependents()
+
+
+# bump whenever Condition's attributes change, so conditions stored by an
+# older version are built from the YAML again
+COMPILED_CONDITIONS_VERSION = 1
+
+
+def get_compiled_conditions(sr_names):
+    """Returns {sr_name: CompiledConditions row} for the subreddits that
+    have their conditions stored compiled."""
+    rows = {}
+    try:
+        # in batches, to keep the queries a reasonable size
+        for i in range(0, len(sr_names), 500):
+            for row in (session.query(CompiledConditions)
+                               .filter(CompiledConditions.name
+                                       .in_(sr_names[i:i + 500]))):
+                rows[row.name] = row
+    except Exception as e:
+        session.rollback()
+        logging.error('ERROR: Unable to read compiled conditions: {0}'
+                      .format(e))
+        logging.debug(traceback.format_exc())
+
+    return rows
+
+
+def standard_checksums(conditions):
+    """Returns {name: checksum} of the standards the conditions include."""
+    checksums = {}
+    for condition in conditions:
+        name = getattr(condition, 'standard', None)
+        if isinstance(name, basestring):
+            checksums[name.lower()] = Condition._standard_checksums.get(
+                name.lower())
+    return checksums
+
+
+def load_compiled_conditions(subreddit, compiled):
+    """Returns the conditions stored for the subreddit, or None if they're
+    out of date and need to be built from its YAML again."""
+    if (compiled is None or
+            compiled.format_version != COMPILED_CONDITIONS_VERSION or
+            compiled.yaml_checksum != yaml_checksum(subreddit.conditions_yaml)):
+        return None
+
+    # any of the standards they include could have changed since
+    standards = json.loads(compiled.standards or '{}')
+    if any(Condition._standard_checksums.get(name) != checksum
+           for name, checksum in standards.iteritems()):
+        return None
+
+    try:
+        states = cPickle.loads(zlib.decompress(compiled.data))
+        return [Condition.from_state(state) for state in states]
+    except Exception as e:
+        logging.warning('Unable to load compiled conditions for /r/{0}: {1}'
+                        .format(subreddit.name, e))
+        return None
+
+
+def build_conditions(conditions_yaml):
+    """Builds the conditions defined in a subreddit's YAML."""
+    return [Condition(d)
+            for d in yaml.safe_load_all(conditions_yaml)
+            if isinstance(d, dict)]
 
 
-def update_conditions_for_sr(cond_dict, queues, subreddit):
+def store_compiled_conditions(subreddit, conditions, compiled=None):
+    """Stores the conditions built from the subreddit's YAML, updating its
+    existing row if given. The session needs to be committed after."""
+    if compiled is None:
+        compiled = CompiledConditions(name=subreddit.name)
+        session.add(compiled)
+
+    compiled.format_version = COMPILED_CONDITIONS_VERSION
+    compiled.yaml_checksum = yaml_checksum(subreddit.conditions_yaml)
+    compiled.standards = json.dumps(standard_checksums(conditions),
+                                    sort_keys=True)
+    compiled.data = zlib.compress(
+        cPickle.dumps([condition.get_state() for condition in conditions],
+                      cPickle.HIGHEST_PROTOCOL))
+
+
+def commit_compiled_conditions():
+    """Commits the stored compiled conditions, if it can be done.
+
+    Not being able to store them only means they're built from the YAML
+    again next time, so it isn't treated as an error.
+    """
+    try:
+        session.commit()
+    except Exception as e:
+        session.rollback()
+        logging.error('ERROR: Unable to store compiled conditions: {0}'
+                      .format(e))
+        logging.debug(traceback.format_exc())
+
+
+def update_conditions_for_sr(cond_dict, queues, subreddit,
+                             compiled_rows=None):
+    """Builds the subreddit's conditions for each queue.
+
+    The conditions stored compiled are used if they're up to date, and
+    otherwise they're built from the YAML and stored again, in which case
+    the caller needs to commit the session. compiled_rows is from
+    get_compiled_conditions, and is looked up if it isn't given.
+    Returns True if the conditions were loaded from the stored ones.
+    """
+    if compiled_rows is None:
+        compiled_rows = get_compiled_conditions([subreddit.name])
+    compiled = compiled_rows.get(subreddit.name)
+
+    conditions = load_compiled_conditions(subreddit, compiled)
+    loaded = conditions is not None
+    if not loaded:
+        conditions = build_conditions(subreddit.conditions_yaml)
+        store_compiled_conditions(subreddit, conditions, compiled)
+
     cond_dict[subreddit.name] = {}
-    conditions = [Condition(d)
-                  for d in yaml.safe_load_all(subreddit.conditions_yaml)
-                  if isinstance(d, dict)]
     for queue in queues:
-        cond_dict[subreddit.name][queue] = filter_conditions(conditions, queue)
+        cond_dict[subreddit.name][queue] = ConditionSet(
+            filter_conditions(conditions, queue))
+    standard_dependents.update(subreddit.name, conditions)
+    recent_items.track(subreddit.name.lower(),
+                       any(any(condition.match_watched.itervalues())
+                           for condition in conditions))
+    return loaded
+
+
+def update_conditions_for_standards(cond_dict, sr_dict, queues, standards):
+    """Rebuilds the conditions of subreddits that include the standards."""
+    start_time = time()
+    dependents = standard_dependents.subreddits(standards)
+    names = [sr_name for sr_name in dependents if sr_name in sr_dict]
+    compiled_rows = get_compiled_conditions(
+        [sr_dict[sr_name].name for sr_name in names])
+    for sr_name in names:
+        update_conditions_for_sr(cond_dict, queues, sr_dict[sr_name],
+                                 compiled_rows)
+    commit_compiled_conditions()
+
+    logging.info('Rebuilt conditions for {0} subreddits ({1} conditions '
+                 'using changed standards) in {2}'
+                 .format(len(names),
+                         sum(dependents.itervalues()),
+                         elapsed_since(start_time)))
 
 
 def load_all_conditions(sr_dict, queues):
+    start_time = time()
     cond_dict = {}
-    for sr in sr_dict.values():
-        update_conditions_for_sr(cond_dict, queues, sr)
-
+    subreddits = sr_dict.values()
+    loaded = 0
+    # in batches, so only some of the stored conditions are held at once
+    for i in range(0, len(subreddits), 500):
+        batch = subreddits[i:i + 500]
+        compiled_rows = get_compiled_conditions([sr.name for sr in batch])
+        for sr in batch:
+            if update_conditions_for_sr(cond_dict, queues, sr, compiled_rows):
+                loaded += 1
+    commit_compiled_conditions()
+
+    logging.info('Loaded conditions for {0} subreddits ({1} compiled, {2} '
+                 'built from YAML) in {3}'
+                 .format(len(cond_dict), loaded, len(cond_dict) - loaded,
+                         elapsed_since(start_time)))
     return cond_dict
 
 
@@ -1458,14 +3477,39 @@ def logging_trace(msg, *args, **kwargs):
     """
     logging.log(logging.TRACE, msg, *args, **kwargs)
 
-def main():
-    global r
+def add_trace_logging():
+    """Adds the TRACE logging level and logging.trace()."""
     logging.addLevelName(logging.DEBUG-1, "TRACE")
     setattr(logging, "TRACE", logging.DEBUG-1)
     setattr(logging, "trace", logging_trace)
+
+def exit_on_sigterm():
+    """Makes SIGTERM (how service managers stop the bot) exit the same way
+    Ctrl-C does, so the actions already done are still logged.
+
+    Without it the process is killed outright, skipping the log flushes in
+    check_items and atexit, and the actions would be done again after a
+    restart.
+    """
+    def handle_sigterm(signum, frame):
+        logging.info('Received SIGTERM, exiting')
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, handle_sigterm)
+
+
+def main():
+    global r
+    add_trace_logging()
     logging.config.fileConfig(path_to_cfg)
+    exit_on_sigterm()
 
-    # re.set_fallback_notification(re.FALLBACK_EXCEPTION)
+    if pattern_cache.engine not in PatternCache.engines:
+        logging.warning('Unknown regex_engine {0}, using re'
+                        .format(pattern_cache.engine))
+    elif pattern_cache.engine == 're2' and re2 is None:
+        logging.warning('The re2 module is not installed, using re for '
+                        'all patterns')
 
     # which queues to check and the function to call
     queue_funcs = {'report': 'get_reports',
@@ -1473,9 +3517,17 @@ def main():
                    'submission': 'get_new',
                    'comment': 'get_comments'}
 
+    rank_cache.load_snapshot()
+
     while True:
         try:
-            r = praw.Reddit(user_agent=cfg_file.get('reddit', 'user_agent'))
+            # a praw.ini site can point the bot at another server
+            r = ThreadSafeReddit(
+                user_agent=cfg_file.get('reddit', 'user_agent'),
+                site_name=get_config_value('reddit', 'site_name', None),
+                request_budget=request_budget)
+            # keep the items' JSON for recording them
+            r.config.store_json_result = bool(listing_recorder.path)
             logging.info('Logging in as {0}'
                          .format(cfg_file.get('reddit', 'username')))
             r.login(cfg_file.get('reddit', 'username'),
@@ -1493,13 +3545,19 @@ def main():
     last_reports_check = time()
 
     while True:
+        loop_start = time()
         try:
             sr_dict = get_enabled_subreddits(reload_mod_subs=False)
 
-            # if the standard conditions have changed, reinit all conditions
-            if Condition.update_standards():
-                logging.info('Updating standard conditions from database')
-                cond_dict = load_all_conditions(sr_dict, queue_funcs.keys())
+            # if the standard conditions have changed, reinit the
+            # conditions that use them
+            changed_standards = Condition.update_standards()
+            if changed_standards:
+                logging.info('Updating standard conditions from database: {0}'
+                             .format(', '.join(sorted(changed_standards))))
+                update_conditions_for_standards(cond_dict, sr_dict,
+                                                queue_funcs.keys(),
+                                                changed_standards)
 
             # check reports if past checking period
             if elapsed_since(last_reports_check) > reports_check_period:
@@ -1522,6 +3580,10 @@ def main():
                     update_conditions_for_sr(cond_dict,
                                              queue_funcs.keys(),
                                              sr_dict[sr])
+                    regex_watchdog.release(sr)
+                commit_compiled_conditions()
+
+            rank_cache.save_snapshot()
         except (praw.errors.ModeratorRequired,
                 praw.errors.ModeratorOrScopeRequired,
                 HTTPError) as e:
@@ -1540,6 +3602,13 @@ def main():
             logging.debug(traceback.format_exc())
             session.rollback()
 
+        logging.debug('Pattern cache: {0}'.format(pattern_cache.stats()))
+        logging.debug('Action latencies: {0}'.format(action_executor.stats()))
+        logging.debug('Redditor cache: {0}'.format(redditor_cache.stats()))
+        if resource:
+            logging.debug('Loop took {0}, peak memory {1} MB'.format(
+                elapsed_since(loop_start),
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024))
         logging.info("Looping")
 
 
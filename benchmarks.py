@@ -0,0 +1,375 @@
+"""Micro-benchmarks for building conditions and checking items against them.
+
+Usage: python benchmarks.py [--sizes 10,100,1000,10000] [--items N]
+                            [--output FILE] [--compare BASELINE]
+                            [--threshold FRACTION]
+
+The conditions and items are synthetic (see synthetic.py) and generated
+from fixed seeds, so every run times the same work. Each benchmark is run
+a few times and the fastest time per operation is kept, in microseconds.
+
+The results are written as JSON to the output file. With --compare, they're
+also compared to the results in a saved file, and any benchmark that has
+become slower by more than the threshold is reported as a regression, with
+a non-zero exit status, so it can be run before deploying. Only results
+from the same machine, with nothing else running, are worth comparing.
+
+Reddit isn't contacted: the actions of matched conditions aren't performed,
+and the users' profiles and ranks are made up.
+"""
+
+import argparse
+from datetime import datetime
+import gc
+import json
+import random
+import re
+import sys
+from timeit import default_timer
+
+import praw
+import yaml
+
+import automoderator
+from automoderator import Condition, ItemView, build_multireddit_groups
+from automoderator import filter_conditions, lowercase_keys_recursively
+from automoderator import replace_placeholders
+from models import cfg_file
+import synthetic
+
+# placeholder strings like the ones in conditions' comments and reports
+TEMPLATES = {'plain': 'This was removed because it broke a rule.',
+             'item': 'Your {{kind}} in /r/{{subreddit}} by /u/{{user}} '
+                     'was removed.',
+             'permalink': 'Please review {{permalink}} ({{title}})',
+             'match': 'Matched "{{match-1}}" on {{domain}}',
+             'body': '> {{body}}'}
+
+USER_CONDITIONS = {'account_age': {'account_age': '< 30'},
+                   'combined_karma': {'combined_karma': '> 100'},
+                   'is_gold': {'is_gold': False},
+                   'rank': {'rank': '= user'},
+                   'all': {'account_age': '> 7',
+                           'combined_karma': '> 10',
+                           'rank': '< moderator'},
+                   'any': {'account_age': '< 7',
+                           'combined_karma': '< 10',
+                           'must_satisfy': 'any'}}
+
+
+class SyntheticRedditorCache(object):
+
+    """Returns the users' synthetic profiles, without fetching them."""
+
+    def __init__(self):
+        self.now = (datetime.utcnow() - datetime(1970, 1, 1)).total_seconds()
+        self.profiles = {}
+
+    def get(self, user):
+        profile = self.profiles.get(user.name)
+        if profile is None:
+            profile = synthetic.user_data(user.name, self.now)
+            self.profiles[user.name] = profile
+        return profile
+
+    def stats(self):
+        return {}
+
+
+def stub_reddit():
+    """Replaces everything checking items would request from reddit."""
+    automoderator.redditor_cache = SyntheticRedditorCache()
+    automoderator.get_user_rank = lambda user, subreddit: 'user'
+    automoderator.probe_shadowbanned = lambda user: False
+    # only the matching is timed, not performing the actions
+    Condition.execute_actions = lambda self, item, match: None
+
+
+def load_standards(num_standards):
+    """Puts the synthetic standards into the cache conditions use them from,
+    and returns their names."""
+    names = []
+    for std_def in synthetic.standard_defs(num_standards):
+        std_def = dict(std_def)
+        name = std_def.pop('name')
+        Condition._standard_cache[name.lower()] = std_def
+        names.append(name)
+
+    return names
+
+
+def condition_defs(count, standards):
+    rng = random.Random('benchmarks')
+    return [synthetic.condition_def(rng, standards) for i in range(count)]
+
+
+def make_items(r, count):
+    """Returns synthetic submissions and comments, half of each."""
+    rng = random.Random('benchmark items')
+    now = (datetime.utcnow() - datetime(1970, 1, 1)).total_seconds()
+    items = []
+    for i in range(count):
+        sr_name = 'benchmark{0:02d}'.format(i % 10)
+        if i % 2:
+            data = synthetic.comment_data(rng, sr_name, now)
+            item = praw.objects.Comment(r, data)
+        else:
+            data = synthetic.submission_data(rng, sr_name, now)
+            item = praw.objects.Submission(r, data)
+        if rng.random() < 0.2:
+            synthetic.reported(rng, item.__dict__)
+        items.append(item)
+
+    return items
+
+
+def subject_values(subject):
+    """Returns values to match a subject against, like a condition would."""
+    rng = random.Random(subject)
+    if subject == 'user':
+        return rng.sample(synthetic.USERS, 20)
+    elif subject in ('domain', 'url', 'link_url', 'media_author_url'):
+        return list(synthetic.SPAM_DOMAINS) + list(synthetic.DOMAINS[:2])
+    elif subject in ('link_id', 'parent_comment_id'):
+        return [synthetic.item_id(rng) for i in range(10)]
+    return synthetic.random_words(rng, 5, synthetic.SPAM_WORDS) + ['update']
+
+
+def measure(func, ops, repeat, min_time=0.1):
+    """Returns the fastest time per operation of func, in microseconds.
+
+    func does ops operations per call. Quick ones are called several times
+    per run, so a run takes at least min_time. Like timeit, the garbage
+    collector is disabled while timing, so it doesn't add noise.
+    """
+    gc.collect()
+    gc.disable()
+    try:
+        loops = 1
+        while True:
+            start = default_timer()
+            for i in xrange(loops):
+                func()
+            elapsed = default_timer() - start
+            if elapsed >= min_time or loops >= 1000:
+                break
+            loops *= 10
+
+        best = elapsed
+        for i in range(repeat - 1):
+            start = default_timer()
+            for j in xrange(loops):
+                func()
+            best = min(best, default_timer() - start)
+    finally:
+        gc.enable()
+
+    return best / (loops * ops) * 1e6
+
+
+def check_all(conditions, items, views):
+    for item, view in zip(items, views):
+        for condition in conditions:
+            condition.check_item(item, view)
+
+
+def bench_construction(results, defs, repeat):
+    """Times building the conditions, and the steps it's made of."""
+    size = len(defs)
+    lowercased = [lowercase_keys_recursively(d) for d in defs]
+
+    results['lowercase_keys_recursively/{0}'.format(size)] = measure(
+        lambda: [lowercase_keys_recursively(d) for d in defs],
+        size, repeat)
+    results['yaml_dump/{0}'.format(size)] = measure(
+        lambda: [yaml.dump(d) for d in lowercased],
+        size, repeat)
+
+    def build_uncached():
+        # every pattern has to be compiled, as on the first load
+        automoderator.pattern_cache._cache.clear()
+        return [Condition(d) for d in defs]
+
+    results['condition_init/{0}'.format(size)] = measure(
+        build_uncached, size, repeat)
+    results['condition_init_cached/{0}'.format(size)] = measure(
+        lambda: [Condition(d) for d in defs], size, repeat)
+
+    conditions = [Condition(d) for d in defs]
+    states = [condition.get_state() for condition in conditions]
+    results['condition_from_state/{0}'.format(size)] = measure(
+        lambda: [Condition.from_state(state) for state in states],
+        size, repeat)
+
+    pattern_args = []
+    for condition in conditions:
+        for key in condition.match_patterns:
+            if isinstance(condition.modifiers, dict):
+                modifiers = condition.modifiers.get(key, [])
+            else:
+                modifiers = condition.modifiers
+            pattern_args.append((condition, key, modifiers))
+    if pattern_args:
+        results['get_pattern/{0}'.format(size)] = measure(
+            lambda: [c.get_pattern(key, modifiers)
+                     for c, key, modifiers in pattern_args],
+            len(pattern_args), repeat)
+
+    return conditions
+
+
+def bench_scaling(results, conditions, items, views, repeat):
+    """Times the functions that go over every condition or subreddit."""
+    size = len(conditions)
+    results['check_item/{0}'.format(size)] = measure(
+        lambda: check_all(conditions, items, views),
+        size * len(items), repeat)
+
+    for queue in ('spam', 'report', 'submission', 'comment'):
+        results['filter_conditions/{0}/{1}'.format(queue, size)] = measure(
+            lambda: filter_conditions(conditions, queue), size, repeat)
+
+    names = synthetic.subreddit_names(size)
+    results['build_multireddit_groups/{0}'.format(size)] = measure(
+        lambda: build_multireddit_groups(names), size, repeat)
+
+
+def bench_subjects(results, items, views, repeat):
+    """Times check_item for each subject, with each match modifier."""
+    subjects = Condition._match_targets + ['title+body']
+    modifiers = [None, 'regex'] + sorted(Condition._match_modifiers)
+    for subject in subjects:
+        values = subject_values(subject)
+        for modifier in modifiers:
+            values_def = {subject: values}
+            if modifier == 'regex':
+                # regexes are usually alternatives with some structure
+                values_def[subject] = '({0})s?'.format('|'.join(values))
+            if modifier:
+                values_def['modifiers'] = [modifier]
+            condition = Condition(values_def)
+            results['check_item/{0}/{1}'.format(
+                subject, modifier or 'default')] = measure(
+                lambda: check_all([condition], items, views),
+                len(items), repeat)
+
+
+def bench_user_conditions(results, items, repeat):
+    for name, user_conditions in sorted(USER_CONDITIONS.iteritems()):
+        condition = Condition({'user_conditions': user_conditions})
+        results['check_user_conditions/{0}'.format(name)] = measure(
+            lambda: [condition.check_user_conditions(item) for item in items],
+            len(items), repeat)
+
+
+def bench_placeholders(results, items, repeat):
+    # a match object like the one from a matched condition
+    pairs = [(item, re.search(r'(\w+)', item.__dict__.get(
+                 'title', item.__dict__.get('body', ''))))
+             for item in items]
+    for name, template in sorted(TEMPLATES.iteritems()):
+        results['replace_placeholders/{0}'.format(name)] = measure(
+            lambda: [replace_placeholders(template, item, match)
+                     for item, match in pairs],
+            len(pairs), repeat)
+
+
+def run_benchmarks(sizes, num_items, repeat):
+    r = praw.Reddit(user_agent=cfg_file.get('reddit', 'user_agent'),
+                    disable_update_check=True)
+    stub_reddit()
+    standards = load_standards(5)
+    items = make_items(r, num_items)
+    # the views are shared like in check_conditions, so after the first run
+    # only the matching itself is timed
+    views = [ItemView(item) for item in items]
+
+    results = {}
+    for size in sizes:
+        print 'Benchmarking {0} conditions'.format(size)
+        defs = condition_defs(size, standards)
+        conditions = bench_construction(results, defs, repeat)
+        # the largest sizes are only checked against some of the items
+        scaled_items = items[:max(10, num_items * 100 // size)]
+        bench_scaling(results, conditions, scaled_items,
+                      views[:len(scaled_items)], repeat)
+
+    print 'Benchmarking subjects and modifiers'
+    bench_subjects(results, items, views, repeat)
+    bench_user_conditions(results, items, repeat)
+    bench_placeholders(results, items, repeat)
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Prints the changes from the baseline. Returns the regressions."""
+    regressions = []
+    print '\n{0:<50} {1:>10} {2:>10} {3:>8}'.format(
+        'benchmark', 'baseline', 'current', 'change')
+    for name in sorted(set(results) | set(baseline)):
+        if name not in baseline or name not in results:
+            print '{0:<50} {1}'.format(
+                name, 'new' if name in results else 'missing')
+            continue
+
+        old, new = baseline[name], results[name]
+        change = new / old - 1 if old else 0.0
+        if change > threshold:
+            note = '  REGRESSION'
+            regressions.append(name)
+        elif change < -threshold:
+            note = '  faster'
+        else:
+            note = ''
+        print '{0:<50} {1:>10.2f} {2:>10.2f} {3:>+7.0%}{4}'.format(
+            name, old, new, change, note)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark building conditions and checking items.')
+    parser.add_argument('--sizes', default='10,100,1000,10000',
+                        help='comma-separated numbers of conditions')
+    parser.add_argument('--items', type=int, default=100,
+                        help='number of items to check')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='runs of each benchmark, the fastest is kept')
+    parser.add_argument('--output', default='benchmarks.json',
+                        help='file to write the results to')
+    parser.add_argument('--compare', metavar='BASELINE', default=None,
+                        help='results file to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='slowdown counted as a regression (0.25 = 25%%)')
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    results = run_benchmarks(sizes, args.items, args.repeat)
+
+    with open(args.output, 'w') as f:
+        json.dump({'created': datetime.utcnow().isoformat(),
+                   'python': sys.version.split()[0],
+                   'sizes': sizes,
+                   'items': args.items,
+                   'units': 'microseconds per operation',
+                   'results': results},
+                  f, indent=2, sort_keys=True)
+    print 'Wrote {0} results to {1}'.format(len(results), args.output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print '\n{0} regression(s) over {1:.0%}'.format(
+                len(regressions), args.threshold)
+            sys.exit(1)
+    else:
+        for name, value in sorted(results.iteritems()):
+            print '{0:<50} {1:>10.2f}us'.format(name, value)
+
+
+if __name__ == '__main__':
+    main()
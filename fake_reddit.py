@@ -0,0 +1,576 @@
+"""A local stand-in for the parts of the reddit API the bot uses.
+
+Usage: python fake_reddit.py [options] (see --help)
+
+It serves synthetic subreddits, with new submissions, comments, modqueue
+and reported items arriving at configurable rates, moderator lists, wiki
+pages with generated conditions, and "update" messages from a moderator.
+Actions (remove, approve, report, flair, comment, message...) are accepted
+and counted. Responses can be delayed, rate limited (with reddit's
+X-Ratelimit headers) and randomly fail with 403/404/5xx errors.
+
+To run the bot against it:
+
+1. Create the subreddits in the bot's database, with the same conditions
+   the fake wiki pages serve:
+
+       python fake_reddit.py --subreddits 2000 --populate
+
+2. Add a site for it to praw.ini in the bot's working directory (praw
+   always uses https, so the server does too, with a self-signed
+   certificate generated by openssl if the --cert file doesn't exist):
+
+       [fake_reddit]
+       api_domain: localhost:8443
+       permalink_domain: localhost:8443
+       oauth_domain: localhost:8443
+       api_request_delay: 0
+       check_for_updates: False
+       validate_certs: False
+
+3. Set site_name = fake_reddit in the [reddit] section of
+   automoderator.cfg, and run the bot as usual.
+
+The request counts, items served and actions taken are returned by
+/_stats and printed when the server is stopped.
+"""
+
+import argparse
+import BaseHTTPServer
+from collections import deque
+import json
+import os
+import random
+import re
+import signal
+import socket
+import SocketServer
+import ssl
+import subprocess
+import sys
+import threading
+from time import sleep, time
+import urlparse
+
+import yaml
+
+from models import cfg_file
+import synthetic
+
+
+def listing(children, after=None):
+    return {'kind': 'Listing',
+            'data': {'children': children,
+                     'after': after,
+                     'before': None,
+                     'modhash': FakeReddit.modhash}}
+
+
+def user_entries(names, now):
+    return [{'name': name,
+             'id': 't2_' + synthetic.user_id(name),
+             'date': now,
+             'mod_permissions': ['all']}
+            for name in names]
+
+
+class FakeReddit(object):
+
+    """The fake site: its subreddits, queues, and counts of what was done.
+
+    New items are generated when a listing is requested, for all the time
+    since the previous request, so the rates hold however often the bot
+    asks. Each queue keeps the newest queue_size items across all the
+    subreddits, like reddit's listings only go back 1000 items.
+    """
+
+    modhash = 'fakemodhash'
+
+    queues = ('new', 'comments', 'modqueue', 'reports', 'inbox')
+
+    def __init__(self, options):
+        self.options = options
+        self.username = cfg_file.get('reddit', 'username')
+        self.sr_names = synthetic.subreddit_names(options.subreddits,
+                                                  options.prefix)
+        self.standards_sr = cfg_file.get('reddit',
+                                         'standards_wiki_subreddit').lower()
+        self.standard_names = [std_def['name'] for std_def in
+                               synthetic.standard_defs(options.standards)]
+
+        self.rng = random.Random(options.seed)
+        self.lock = threading.Lock()
+        self.items = dict((queue, deque(maxlen=options.queue_size))
+                          for queue in self.queues)
+        self.arrival_rates = {'new': options.submissions_per_min / 60.0,
+                              'comments': options.comments_per_min / 60.0,
+                              'inbox': options.updates_per_min / 60.0}
+        self.carried = dict((queue, 0.0) for queue in self.arrival_rates)
+        self.generated_until = time() - 60 * options.backlog_mins
+
+        self.started = time()
+        self.window_start = time()
+        self.window_used = 0
+        self.requests = {}
+        self.statuses = {}
+        self.items_served = {}
+        self.actions = {}
+        self.unknown_paths = {}
+
+        self.routes = [
+            ('POST', r'api/login(?:/[^/]+)?', self.login),
+            ('GET', r'subreddits/mine/moderator', self.my_moderation),
+            ('GET', r'r/([^/]+)/new', self.queue_listing('new')),
+            ('GET', r'r/([^/]+)/comments', self.queue_listing('comments')),
+            ('GET', r'r/([^/]+)/about/modqueue',
+             self.queue_listing('modqueue')),
+            ('GET', r'r/([^/]+)/about/reports', self.queue_listing('reports')),
+            ('GET', r'r/([^/]+)/about', self.subreddit_about),
+            ('GET', r'r/([^/]+)/about/moderators', self.moderators),
+            ('GET', r'r/([^/]+)/about/contributors', self.contributors),
+            ('GET', r'r/([^/]+)/wiki/([^/]+)', self.wiki_page),
+            ('GET', r'comments/(\w+)(?:/[^/]*(?:/(\w+))?)?', self.thread),
+            ('GET', r'message/inbox', self.queue_listing('inbox')),
+            ('GET', r'user/([^/]+)/about', self.user_about),
+            ('GET', r'user/([^/]+)(?:/overview)?', self.user_overview),
+            ('POST', r'api/comment', self.comment),
+            ('POST', r'(?:r/[^/]+/)?api/(\w+)', self.action),
+            ('GET', r'_stats', self.stats),
+        ]
+        self.routes = [(method, re.compile('^' + pattern + '$'), func)
+                       for method, pattern, func in self.routes]
+
+    def count(self, counts, key, amount=1):
+        with self.lock:
+            counts[key] = counts.get(key, 0) + amount
+
+    def handle(self, method, path, params):
+        """Returns the status, headers and JSON body for a request."""
+        if path.endswith('.json'):
+            path = path[:-len('.json')]
+        path = path.strip('/')
+
+        for route_method, pattern, func in self.routes:
+            match = pattern.match(path)
+            if route_method == method and match:
+                break
+        else:
+            self.count(self.unknown_paths, method + ' /' + path)
+            return self.respond(404, {}, {'error': 404})
+
+        endpoint = func.__name__
+        self.count(self.requests, endpoint)
+        if endpoint in ('login', 'stats'):
+            return self.respond(200, {}, func(params, *match.groups()))
+
+        headers, limited = self.rate_limit()
+        if limited:
+            return self.respond(429, headers, {'error': 429})
+
+        status = self.injected_error()
+        if status:
+            return self.respond(status, headers, {'error': status})
+
+        status, result = 200, func(params, *match.groups())
+        if isinstance(result, int):
+            status, result = result, {'error': result}
+        return self.respond(status, headers, result)
+
+    def respond(self, status, headers, result):
+        self.count(self.statuses, status)
+        return status, headers, json.dumps(result)
+
+    def latency(self):
+        """Returns a random delay for a response, in seconds."""
+        delay = self.options.latency_ms / 1000.0
+        jitter = delay * self.options.jitter
+        return max(0.0, self.rng.uniform(delay - jitter, delay + jitter))
+
+    def rate_limit(self):
+        """Counts a request against the rate limit.
+
+        Returns the X-Ratelimit headers and whether the limit was exceeded.
+        """
+        if not self.options.rate_limit:
+            return {}, False
+
+        with self.lock:
+            now = time()
+            period = self.options.rate_limit_period
+            if now - self.window_start >= period:
+                self.window_start = now
+                self.window_used = 0
+            self.window_used += 1
+            remaining = self.options.rate_limit - self.window_used
+            headers = {'X-Ratelimit-Used': str(self.window_used),
+                       'X-Ratelimit-Remaining': str(max(remaining, 0)),
+                       'X-Ratelimit-Reset':
+                           str(int(self.window_start + period - now))}
+
+        return headers, remaining < 0
+
+    def injected_error(self):
+        """Returns an error status to fail the request with, or None."""
+        chance = self.rng.random()
+        for status, rate in ((503, self.options.server_errors),
+                             (403, self.options.forbidden),
+                             (404, self.options.not_found)):
+            if chance < rate:
+                if status == 503:
+                    return self.rng.choice((500, 502, 503, 504))
+                return status
+            chance -= rate
+
+        return None
+
+    def generate(self):
+        """Adds the items that arrived since the last time to the queues."""
+        with self.lock:
+            now = time()
+            for queue, rate in self.arrival_rates.iteritems():
+                expected = rate * (now - self.generated_until)
+                expected += self.carried[queue]
+                count = int(expected)
+                self.carried[queue] = expected - count
+
+                arrivals = sorted(self.rng.uniform(self.generated_until, now)
+                                  for i in range(count))
+                for created_utc in arrivals:
+                    self.add_item(queue, created_utc)
+            self.generated_until = now
+
+    def add_item(self, queue, created_utc):
+        rng = self.rng
+        if queue == 'inbox':
+            sr_name = rng.choice(self.sr_names)
+            id = synthetic.item_id(rng)
+            data = {'id': id,
+                    'name': 't4_' + id,
+                    'author': synthetic.MODERATOR,
+                    'subject': '/r/' + sr_name,
+                    'body': 'update',
+                    'dest': self.username,
+                    'created_utc': created_utc,
+                    'created': created_utc,
+                    'was_comment': False,
+                    'subreddit': None,
+                    'new': True,
+                    'replies': ''}
+            self.items['inbox'].append((sr_name, 't4', data))
+            return
+
+        sr_name = rng.choice(self.sr_names)
+        if queue == 'new':
+            kind = 't3'
+            data = synthetic.submission_data(rng, sr_name, created_utc)
+        else:
+            kind = 't1'
+            data = synthetic.comment_data(rng, sr_name, created_utc)
+
+        # filtered items only show up in the modqueue
+        if rng.random() < self.options.spam_fraction:
+            data['banned_by'] = True
+            self.items['modqueue'].append((sr_name, kind, data))
+        else:
+            self.items[queue].append((sr_name, kind, data))
+
+        if rng.random() < self.options.reported_fraction:
+            data = synthetic.reported(rng, dict(data))
+            self.items['reports'].append((sr_name, kind, data))
+            self.items['modqueue'].append((sr_name, kind, data))
+
+    def page(self, things, params):
+        """Returns the page of the things after params['after']."""
+        start = 0
+        after = params.get('after')
+        if after:
+            names = [thing['data']['name'] for thing in things]
+            start = names.index(after) + 1 if after in names else len(names)
+        limit = min(int(params.get('limit', 25)), 100)
+
+        page = things[start:start + limit]
+        if start + limit < len(things):
+            return listing(page, page[-1]['data']['name'])
+        return listing(page)
+
+    def queue_listing(self, queue):
+        """Returns the handler for one of the queues' listings."""
+        def handler(params, sr_names=None):
+            self.generate()
+            wanted = set(sr_names.lower().split('+')) if sr_names else None
+            with self.lock:
+                things = [{'kind': kind, 'data': data}
+                          for sr_name, kind, data in reversed(self.items[queue])
+                          if wanted is None or sr_name in wanted]
+            result = self.page(things, params)
+            self.count(self.items_served, queue,
+                       len(result['data']['children']))
+            return result
+
+        handler.__name__ = queue
+        return handler
+
+    def login(self, params):
+        return {'json': {'errors': [],
+                         'data': {'modhash': self.modhash,
+                                  'cookie': 'fakecookie'}}}
+
+    def my_moderation(self, params):
+        things = [{'kind': 't5',
+                   'data': {'id': sr_name,
+                            'name': 't5_' + sr_name,
+                            'display_name': sr_name,
+                            'url': '/r/{0}/'.format(sr_name)}}
+                  for sr_name in self.sr_names + [self.standards_sr]]
+        return self.page(things, params)
+
+    def subreddit_about(self, params, sr_name):
+        return {'kind': 't5',
+                'data': {'id': sr_name,
+                         'name': 't5_' + sr_name,
+                         'display_name': sr_name,
+                         'subreddit_type': 'restricted',
+                         'url': '/r/{0}/'.format(sr_name)}}
+
+    def moderators(self, params, sr_name):
+        return {'kind': 'UserList',
+                'data': {'children': user_entries([self.username,
+                                                   synthetic.MODERATOR],
+                                                  time())}}
+
+    def contributors(self, params, sr_name):
+        return listing(user_entries(synthetic.USERS[:5], time()))
+
+    def wiki_page(self, params, sr_name, page):
+        sr_name = sr_name.lower()
+        if sr_name == self.standards_sr:
+            content = yaml.safe_dump_all(
+                synthetic.standard_defs(self.options.standards),
+                default_flow_style=False)
+        elif sr_name in self.sr_names:
+            content = synthetic.conditions_yaml(sr_name,
+                                                self.options.conditions,
+                                                self.standard_names)
+        else:
+            return 404
+
+        return {'kind': 'wikipage',
+                'data': {'content_md': content,
+                         'content_html': '',
+                         'may_revise': True,
+                         'revision_date': time(),
+                         'revision_by': {'kind': 't2',
+                                         'data': {'name': synthetic.MODERATOR}}}}
+
+    def thread(self, params, link_id, comment_id=None):
+        """Returns a submission's page, with the comment if one is given.
+
+        Items aren't kept after they leave the queues, so the submission
+        is made up again, the same every time for the same id.
+        """
+        rng = random.Random(link_id)
+        data = synthetic.submission_data(rng, rng.choice(self.sr_names),
+                                         time())
+        data.update({'id': link_id, 'name': 't3_' + link_id})
+        comments = []
+        if comment_id:
+            comment = synthetic.comment_data(rng, data['subreddit'], time())
+            comment.update({'id': comment_id,
+                            'name': 't1_' + comment_id,
+                            'link_id': data['name'],
+                            'parent_id': data['name']})
+            comments.append({'kind': 't1', 'data': comment})
+
+        return [listing([{'kind': 't3', 'data': data}]), listing(comments)]
+
+    def shadowbanned(self, name):
+        chance = random.Random(name + '/shadowbanned').random()
+        return chance < self.options.shadowbanned
+
+    def user_about(self, params, name):
+        if self.shadowbanned(name):
+            return 404
+        return {'kind': 't2', 'data': synthetic.user_data(name, time())}
+
+    def user_overview(self, params, name):
+        if self.shadowbanned(name):
+            return 404
+        return listing([])
+
+    def comment(self, params):
+        self.count(self.actions, 'comment')
+        data = synthetic.comment_data(self.rng, self.sr_names[0], time())
+        data.update({'author': self.username,
+                     'body': params.get('text', ''),
+                     'parent_id': params.get('thing_id')})
+        return {'json': {'errors': [],
+                         'data': {'things': [{'kind': 't1', 'data': data}]}}}
+
+    def action(self, params, name):
+        self.count(self.actions, name)
+        return {'json': {'errors': []}}
+
+    def stats(self, params=None):
+        with self.lock:
+            requests = sum(self.requests.itervalues())
+            items = sum(self.items_served.itervalues())
+            return {'uptime_secs': time() - self.started,
+                    'requests': dict(self.requests),
+                    'statuses': dict(self.statuses),
+                    'items_served': dict(self.items_served),
+                    'requests_per_item': float(requests) / max(items, 1),
+                    'actions': dict(self.actions),
+                    'unknown_paths': dict(self.unknown_paths)}
+
+
+class RequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    # keep-alive, so the bot's requests session reuses its connections
+    protocol_version = 'HTTP/1.1'
+    # the headers and body are written separately, don't wait for acks
+    disable_nagle_algorithm = True
+
+    reasons = {429: 'Too Many Requests'}
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def handle_request(self, method):
+        site = self.server.site
+        url = urlparse.urlsplit(self.path)
+        params = dict(urlparse.parse_qsl(url.query))
+        if method == 'POST':
+            length = int(self.headers.getheader('Content-Length') or 0)
+            params.update(urlparse.parse_qsl(self.rfile.read(length)))
+
+        sleep(site.latency())
+        status, headers, body = site.handle(method, url.path, params)
+
+        # BaseHTTPServer doesn't know the reason for 429
+        self.send_response(status, self.reasons.get(status))
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.iteritems():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.site.options.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format,
+                                                              *args)
+
+
+class FakeRedditServer(SocketServer.ThreadingMixIn,
+                       BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, site):
+        BaseHTTPServer.HTTPServer.__init__(self, address, RequestHandler)
+        self.site = site
+
+    def handle_error(self, request, client_address):
+        # clients closing their connections aren't worth a traceback
+        if not isinstance(sys.exc_info()[1], socket.error):
+            BaseHTTPServer.HTTPServer.handle_error(self, request,
+                                                   client_address)
+
+
+def ensure_certificate(cert_path, key_path):
+    """Generates a self-signed certificate if there isn't one already."""
+    if os.path.exists(cert_path) and os.path.exists(key_path):
+        return
+
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call(['openssl', 'req', '-x509', '-newkey',
+                               'rsa:2048', '-nodes', '-days', '3650',
+                               '-subj', '/CN=localhost',
+                               '-keyout', key_path, '-out', cert_path],
+                              stdout=devnull, stderr=devnull)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Serve a fake reddit API for load testing the bot.')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8443)
+    parser.add_argument('--cert', default='fake_reddit.crt',
+                        help='certificate file (generated if missing)')
+    parser.add_argument('--key', default='fake_reddit.key',
+                        help='private key file (generated if missing)')
+    parser.add_argument('--subreddits', type=int, default=1000,
+                        help='number of subreddits the bot moderates')
+    parser.add_argument('--prefix', default='loadtest',
+                        help='prefix of the subreddit names')
+    parser.add_argument('--conditions', type=int, default=20,
+                        help='number of conditions per subreddit')
+    parser.add_argument('--standards', type=int, default=0,
+                        help='number of standard conditions')
+    parser.add_argument('--populate', action='store_true',
+                        help='write the subreddits and standards to the '
+                             'database and exit')
+    parser.add_argument('--submissions-per-min', type=float, default=600)
+    parser.add_argument('--comments-per-min', type=float, default=3000)
+    parser.add_argument('--updates-per-min', type=float, default=0,
+                        help='rate of "update" messages from a moderator')
+    parser.add_argument('--spam-fraction', type=float, default=0.05,
+                        help='fraction of items filtered into the modqueue')
+    parser.add_argument('--reported-fraction', type=float, default=0.02)
+    parser.add_argument('--backlog-mins', type=float, default=5,
+                        help='minutes of items already there at startup')
+    parser.add_argument('--queue-size', type=int, default=20000,
+                        help='number of items kept in each queue')
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--jitter', type=float, default=0.5,
+                        help='latency varies by up to this fraction')
+    parser.add_argument('--rate-limit', type=int, default=0,
+                        help='requests allowed per period (0 for no limit)')
+    parser.add_argument('--rate-limit-period', type=float, default=600)
+    parser.add_argument('--server-errors', type=float, default=0,
+                        help='fraction of requests failing with 5xx')
+    parser.add_argument('--forbidden', type=float, default=0,
+                        help='fraction of requests failing with 403')
+    parser.add_argument('--not-found', type=float, default=0,
+                        help='fraction of requests failing with 404')
+    parser.add_argument('--shadowbanned', type=float, default=0.02,
+                        help='fraction of users that are shadowbanned')
+    parser.add_argument('--seed', default=None)
+    parser.add_argument('--verbose', action='store_true',
+                        help='log every request')
+    options = parser.parse_args()
+
+    if options.populate:
+        sr_names = synthetic.subreddit_names(options.subreddits,
+                                             options.prefix)
+        synthetic.populate(sr_names, options.conditions, options.standards)
+        print 'Wrote {0} subreddits with {1} conditions each'.format(
+            len(sr_names), options.conditions)
+        return
+
+    ensure_certificate(options.cert, options.key)
+    site = FakeReddit(options)
+    server = FakeRedditServer((options.host, options.port), site)
+    server.socket = ssl.wrap_socket(server.socket,
+                                    certfile=options.cert,
+                                    keyfile=options.key,
+                                    server_side=True)
+
+    # print the stats when killed, too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print 'Serving {0} subreddits on https://{1}:{2}'.format(
+        len(site.sr_names), options.host, options.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print json.dumps(site.stats(), indent=4, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,7 +2,8 @@ import sys, os
 from ConfigParser import SafeConfigParser
 
 from sqlalchemy import create_engine
-from sqlalchemy import Boolean, Column, DateTime, Enum, Integer, String, Text
+from sqlalchemy import Boolean, Column, DateTime, Enum, Integer, LargeBinary
+from sqlalchemy import String, Text
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 
@@ -60,6 +61,7 @@ class StandardCondition(Base):
 
     name - A name identifying the condition (used to include that condition)
     yaml - The YAML definition of the standard condition
+    checksum - SHA-1 of the YAML, used to tell which standards have changed
     """
 
     __tablename__ = 'standard_conditions'
@@ -67,6 +69,46 @@ class StandardCondition(Base):
     name = Column(String(255), primary_key=True)
     # last_update = Column(DateTime, nullable=False, default=datetime.now, onupdate=datetime.now)
     yaml = Column(Text)
+    checksum = Column(String(40))
+
+
+class StandardConditionsVersion(Base):
+
+    """Single-row table used to detect changes to the standard conditions.
+
+    version - Incremented every time the standard conditions are updated
+    """
+
+    __tablename__ = 'standard_conditions_version'
+
+    id = Column(Integer, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+class CompiledConditions(Base):
+
+    """Table containing subreddits' conditions, already built from the YAML.
+
+    Loading these when the bot starts is much faster than parsing every
+    subreddit's conditions_yaml and building the conditions again.
+
+    name - The subreddit's name, as in the subreddits table
+    format_version - Version of the stored format, rows with any other
+        version are built from the YAML again
+    yaml_checksum - SHA-1 of the conditions_yaml they were built from
+    standards - JSON object of the standard conditions included, and the
+        checksums of the standards they were built with
+    data - The conditions' attributes, pickled and compressed
+    """
+
+    __tablename__ = 'compiled_conditions'
+
+    name = Column(String(100), primary_key=True)
+    format_version = Column(Integer, nullable=False)
+    yaml_checksum = Column(String(40), nullable=False)
+    standards = Column(Text)
+    # long enough for a MEDIUMBLOB in MySQL
+    data = Column(LargeBinary(2 ** 24 - 1))
 
 
 class Log(Base):
@@ -0,0 +1,90 @@
+"""Recording of the items read from the queues, and reading them back.
+
+Recordings are gzipped files with one item per line, as JSON:
+{"queue": "comment", "kind": "t1", "data": {...}}, where data is the item
+exactly as reddit returned it in the listing.
+"""
+
+import gzip
+import json
+
+import praw
+
+
+class ListingRecorder(object):
+
+    """Appends the raw JSON of items read from the queues to a recording.
+
+    Needs praw's store_json_result setting, which keeps the JSON each
+    object was built from. Nothing is recorded if no path is set.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.recorded = 0
+        self._file = None
+
+    def record(self, queue, item):
+        json_dict = getattr(item, 'json_dict', None)
+        if not self.path or json_dict is None:
+            return
+
+        # appending adds a new gzip member, which reads back as one file
+        if self._file is None:
+            self._file = gzip.open(self.path, 'ab')
+
+        self._file.write(json.dumps({'queue': queue,
+                                     'kind': item.name.split('_')[0],
+                                     'data': json_dict}))
+        self._file.write('\n')
+        self.recorded += 1
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def open_recording(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    return open(path, 'rb')
+
+
+def read_recording(r, path):
+    """Yields the (queue, item) recorded in a file, as praw objects.
+
+    The queue is None for files of plain listing things without one. A
+    recording the bot was killed while writing ends with an unfinished
+    gzip member, so reading stops at the last complete item.
+    """
+    with open_recording(path) as recording:
+        while True:
+            try:
+                line = recording.readline()
+            except (IOError, EOFError):
+                # the end of the file was never written
+                break
+            if not line:
+                break
+            if not line.strip():
+                continue
+            try:
+                thing = json.loads(line)
+            except ValueError:
+                # cut off in the middle of an item
+                break
+            if thing['kind'] == 't3':
+                item = praw.objects.Submission(r, thing['data'])
+            elif thing['kind'] == 't1':
+                # comments from listings don't include their replies
+                thing['data'].setdefault('replies', '')
+                item = praw.objects.Comment(r, thing['data'])
+            else:
+                continue
+
+            yield thing.get('queue'), item
@@ -0,0 +1,291 @@
+"""Static analysis of regexes for catastrophic backtracking hazards.
+
+The patterns are parsed with sre_parse (the re module's own parser), and
+the parse trees are checked for the constructs that make a backtracking
+engine take exponential or high-polynomial time on strings that almost
+match. The same trees are used to generate strings that try to trigger it,
+so the patterns can be timed against them.
+"""
+
+import sre_constants
+import sre_parse
+import string as string_module
+
+from sre_constants import (ANY, ASSERT, ASSERT_NOT, AT, BRANCH, CATEGORY,
+                           GROUPREF_EXISTS, IN, LITERAL, MAX_REPEAT,
+                           MIN_REPEAT, NEGATE, NOT_LITERAL, RANGE, SUBPATTERN)
+
+MAXREPEAT = sre_constants.MAXREPEAT
+
+# chars used to approximate which chars an element can match
+ALPHABET = unicode(string_module.printable) + u'\xe9\u4e00\x00'
+
+# repeats with a max at least this high are treated as unbounded
+UNBOUNDED = 10
+
+# appended to generated strings to make the match fail at the very end,
+# which is what forces the engine to try every other way of matching
+BREAKERS = (u'!', u'\x00', u'\n')
+
+PUMP_COUNTS = (24, 2000)
+MAX_STRINGS = 60
+
+_categories = {
+    sre_constants.CATEGORY_DIGIT: lambda c: c.isdigit(),
+    sre_constants.CATEGORY_NOT_DIGIT: lambda c: not c.isdigit(),
+    sre_constants.CATEGORY_SPACE: lambda c: c.isspace(),
+    sre_constants.CATEGORY_NOT_SPACE: lambda c: not c.isspace(),
+    sre_constants.CATEGORY_WORD: lambda c: c.isalnum() or c == u'_',
+    sre_constants.CATEGORY_NOT_WORD: lambda c: not (c.isalnum() or c == u'_'),
+    sre_constants.CATEGORY_LINEBREAK: lambda c: c == u'\n',
+    sre_constants.CATEGORY_NOT_LINEBREAK: lambda c: c != u'\n',
+}
+
+
+def _children(op, av):
+    """Returns the sub-patterns contained in a parse tree element."""
+    if op == SUBPATTERN:
+        return [av[-1]]
+    if op in (MAX_REPEAT, MIN_REPEAT):
+        return [av[2]]
+    if op == BRANCH:
+        return list(av[1])
+    if op in (ASSERT, ASSERT_NOT):
+        return [av[1]]
+    if op == GROUPREF_EXISTS:
+        return [sp for sp in av[1:] if sp is not None]
+    return []
+
+
+def _is_repeat(op, av):
+    return op in (MAX_REPEAT, MIN_REPEAT) and av[1] >= UNBOUNDED
+
+
+def _char_chars(op, av, flags):
+    """Returns the ALPHABET chars a single-char element can match."""
+    ignore_case = flags & sre_parse.SRE_FLAG_IGNORECASE
+
+    def matches_literal(char, code):
+        if ignore_case:
+            return char.lower() == unichr(code).lower()
+        return char == unichr(code)
+
+    if op == LITERAL:
+        return set(c for c in ALPHABET if matches_literal(c, av))
+    if op == NOT_LITERAL:
+        return set(c for c in ALPHABET if not matches_literal(c, av))
+    if op == ANY:
+        if flags & sre_parse.SRE_FLAG_DOTALL:
+            return set(ALPHABET)
+        return set(c for c in ALPHABET if c != u'\n')
+    if op == IN:
+        chars = set()
+        negate = False
+        for item_op, item_av in av:
+            if item_op == NEGATE:
+                negate = True
+            elif item_op == RANGE:
+                low, high = item_av
+                for c in ALPHABET:
+                    variants = [c]
+                    if ignore_case:
+                        variants.extend([c.lower(), c.upper()])
+                    if any(low <= ord(v) <= high for v in variants):
+                        chars.add(c)
+            elif item_op == CATEGORY:
+                check = _categories.get(item_av, lambda c: True)
+                chars.update(c for c in ALPHABET if check(c))
+            else:
+                chars.update(_char_chars(item_op, item_av, flags))
+        if negate:
+            return set(ALPHABET) - chars
+        return chars
+    return None
+
+
+def _first_chars(subpattern, flags):
+    """Returns the ALPHABET chars that a subpattern's matches can start with.
+
+    The second value is True if the subpattern can match an empty string.
+    """
+    chars = set()
+    for op, av in subpattern:
+        element_chars = _char_chars(op, av, flags)
+        if element_chars is not None:
+            chars.update(element_chars)
+            return chars, False
+
+        if op in (AT, ASSERT, ASSERT_NOT):
+            continue
+
+        children = _children(op, av)
+        optional = (op in (MAX_REPEAT, MIN_REPEAT) and av[0] == 0 or
+                    op == GROUPREF_EXISTS)
+        for child in children:
+            child_chars, child_empty = _first_chars(child, flags)
+            chars.update(child_chars)
+            optional = optional or child_empty
+        if children and not optional:
+            return chars, False
+
+    return chars, True
+
+
+def _all_chars(subpattern, flags):
+    """Returns the ALPHABET chars a subpattern can match anywhere."""
+    chars = set()
+    for op, av in subpattern:
+        element_chars = _char_chars(op, av, flags)
+        if element_chars is not None:
+            chars.update(element_chars)
+        for child in _children(op, av):
+            chars.update(_all_chars(child, flags))
+
+    return chars
+
+
+def _contains_repeat(subpattern):
+    for op, av in subpattern:
+        if _is_repeat(op, av):
+            return True
+        if any(_contains_repeat(child) for child in _children(op, av)):
+            return True
+
+    return False
+
+
+def _overlapping_branches(subpattern, flags):
+    """Returns True if alternatives of a branch can start the same way."""
+    for op, av in subpattern:
+        if op == BRANCH:
+            seen = set()
+            for alternative in av[1]:
+                chars, empty = _first_chars(alternative, flags)
+                if chars & seen:
+                    return True
+                seen.update(chars)
+        if any(_overlapping_branches(child, flags)
+               for child in _children(op, av)
+               if op not in (MAX_REPEAT, MIN_REPEAT)):
+            return True
+
+    return False
+
+
+def find_hazards(pattern, flags=0):
+    """Returns descriptions of the backtracking hazards found in a pattern."""
+    hazards = []
+
+    def check(subpattern):
+        previous_repeat = None
+        for op, av in subpattern:
+            if _is_repeat(op, av):
+                body = av[2]
+                if _contains_repeat(body):
+                    hazards.append('nested quantifiers, like (a+)+')
+                if _overlapping_branches(body, flags):
+                    hazards.append('a repeated group with alternatives that '
+                                   'can match the same text, like (a|ab)*')
+                if (previous_repeat is not None and
+                        _all_chars(previous_repeat, flags) &
+                        _all_chars(body, flags)):
+                    hazards.append('adjacent quantifiers that can match the '
+                                   'same characters, like \\s*\\s*')
+                previous_repeat = body
+            elif op not in (AT, ASSERT, ASSERT_NOT):
+                previous_repeat = None
+
+            for child in _children(op, av):
+                check(child)
+
+    check(sre_parse.parse(pattern, flags))
+
+    # only describe each kind of hazard once
+    return sorted(set(hazards))
+
+
+def _example(subpattern, flags, pumped, count):
+    """Returns a string matching the subpattern (as far as possible).
+
+    Each repeat is repeated the minimum number of times it needs, except
+    the pumped one (by identity), which is repeated count times.
+    """
+    parts = []
+    for op, av in subpattern:
+        chars = _char_chars(op, av, flags)
+        if chars is not None:
+            # prefer a letter, since they're what most patterns are about
+            letters = sorted(c for c in chars if c.isalpha())
+            parts.append((letters or sorted(chars) or [u''])[0])
+        elif op in (MAX_REPEAT, MIN_REPEAT):
+            low, high, body = av
+            if av is pumped:
+                repeat = min(high, count)
+            else:
+                repeat = min(high, max(low, 1))
+            parts.append(_example(body, flags, pumped, count) * repeat)
+        elif op == SUBPATTERN:
+            parts.append(_example(av[-1], flags, pumped, count))
+        elif op == BRANCH:
+            # use the alternative containing the pumped repeat, if any
+            alternatives = list(av[1])
+            for alternative in alternatives:
+                if _contains_node(alternative, pumped):
+                    break
+            else:
+                alternative = alternatives[0]
+            parts.append(_example(alternative, flags, pumped, count))
+        elif op == GROUPREF_EXISTS:
+            parts.append(_example(av[1], flags, pumped, count))
+
+    return u''.join(parts)
+
+
+def _contains_node(subpattern, node):
+    for op, av in subpattern:
+        if av is node:
+            return True
+        if any(_contains_node(child, node) for child in _children(op, av)):
+            return True
+
+    return False
+
+
+def _repeats(subpattern):
+    """Returns the repeat nodes in a subpattern, outermost first."""
+    found = []
+    for op, av in subpattern:
+        if _is_repeat(op, av):
+            found.append(av)
+        for child in _children(op, av):
+            found.extend(_repeats(child))
+
+    return found
+
+
+def adversarial_strings(pattern, flags=0):
+    """Returns strings likely to make the pattern backtrack excessively.
+
+    For each unbounded repeat, the pattern is matched with that repeat
+    pumped up many times, and then a char that makes it fail is appended,
+    both with the rest of the pattern around it and on its own.
+    """
+    parsed = sre_parse.parse(pattern, flags)
+    strings = []
+    for repeat in _repeats(parsed):
+        for count in PUMP_COUNTS:
+            pumped = _example(parsed, flags, repeat, count)
+            alone = _example(repeat[2], flags, None, 0) * count
+            for breaker in BREAKERS:
+                strings.append(pumped + breaker)
+                strings.append(alone + breaker)
+
+    # drop duplicates, keeping the shorter (quicker to test) strings first
+    unique = []
+    seen = set()
+    for candidate in sorted(strings, key=len):
+        if candidate not in seen:
+            seen.add(candidate)
+            unique.append(candidate)
+
+    return unique[:MAX_STRINGS]
@@ -0,0 +1,150 @@
+"""Compares the regex engines on the conditions' patterns and recorded items.
+
+Usage: python regex_benchmark.py ITEMS_FILE [SUBREDDIT ...]
+
+ITEMS_FILE is a recording made with record_listings_file (see recording.py),
+or any file with one listing thing per line: {"kind": "t3", "data": {...}},
+gzipped if it ends in .gz. Every match pattern of the enabled subreddits'
+conditions (or only the named subreddits') is compiled with each engine,
+then searched for in the recorded items from its subreddit, and the search
+times are compared.
+"""
+
+import sys
+from timeit import default_timer
+
+import praw
+import yaml
+
+import automoderator
+from automoderator import Condition, ItemView, compile_pattern, pattern_engine
+from models import cfg_file, session, Subreddit
+from recording import read_recording
+
+
+def get_patterns(subreddit):
+    """Returns the distinct (pattern, flags, source, ignore_blockquotes)
+    combinations checked by a subreddit's conditions."""
+    patterns = set()
+    for d in yaml.safe_load_all(subreddit.conditions_yaml):
+        if not isinstance(d, dict):
+            continue
+        condition = Condition(d)
+        for subject, pattern in condition.match_patterns.iteritems():
+            for source in condition.match_sources[subject]:
+                patterns.add((pattern,
+                              condition.match_flags[subject],
+                              source,
+                              source == 'body' and
+                              condition.ignore_blockquotes))
+
+    return patterns
+
+
+def percentile(times, fraction):
+    if not times:
+        return 0.0
+    return sorted(times)[min(len(times) - 1, int(len(times) * fraction))]
+
+
+def benchmark(engine, patterns_by_sr, views_by_sr):
+    """Searches all the items with all the patterns compiled by the engine.
+
+    Returns a dict of the results, including the total search time taken
+    by each pattern.
+    """
+    compiled = {'re': 0, 're2': 0}
+    times = []
+    pattern_times = {}
+    for sr_name, patterns in patterns_by_sr.iteritems():
+        views = views_by_sr.get(sr_name, [])
+        for pattern, flags, source, ignore_blockquotes in patterns:
+            regex = compile_pattern(pattern, flags, engine)
+            compiled[pattern_engine(regex)] += 1
+
+            total = 0.0
+            for view in views:
+                string = view.target(source, ignore_blockquotes)
+                start = default_timer()
+                regex.search(string)
+                elapsed = default_timer() - start
+                times.append(elapsed)
+                total += elapsed
+
+            key = (sr_name, pattern)
+            pattern_times[key] = pattern_times.get(key, 0.0) + total
+
+    return {'compiled': compiled,
+            'searches': len(times),
+            'total': sum(times),
+            'p50': percentile(times, 0.5),
+            'p99': percentile(times, 0.99),
+            'max': max(times) if times else 0.0,
+            'pattern_times': pattern_times}
+
+
+def main():
+    if len(sys.argv) < 2:
+        print __doc__
+        sys.exit(1)
+
+    r = praw.Reddit(user_agent=cfg_file.get('reddit', 'user_agent'),
+                    disable_update_check=True)
+    items = [item for queue, item in read_recording(r, sys.argv[1])]
+
+    subreddits = session.query(Subreddit).filter(Subreddit.enabled == True)
+    if len(sys.argv) > 2:
+        names = [name.lower() for name in sys.argv[2:]]
+        subreddits = [sr for sr in subreddits if sr.name.lower() in names]
+
+    Condition.update_standards()
+    patterns_by_sr = dict((sr.name.lower(), get_patterns(sr))
+                          for sr in subreddits)
+
+    # share the views between the engines, so both search the same strings
+    views_by_sr = {}
+    for item in items:
+        sr_name = item.subreddit.display_name.lower()
+        if sr_name in patterns_by_sr:
+            views_by_sr.setdefault(sr_name, []).append(ItemView(item))
+
+    print 'Loaded {0} items, {1} patterns from {2} subreddits'.format(
+        sum(len(views) for views in views_by_sr.itervalues()),
+        sum(len(patterns) for patterns in patterns_by_sr.itervalues()),
+        len(patterns_by_sr))
+
+    engines = ['re']
+    if automoderator.re2 is not None:
+        engines.append('re2')
+    else:
+        print 'The re2 module is not installed, only benchmarking re'
+
+    results = {}
+    for engine in engines:
+        results[engine] = benchmark(engine, patterns_by_sr, views_by_sr)
+        result = results[engine]
+        print ('\n{0}: {1[searches]} searches in {1[total]:.3f}s, '
+               'p50 {2:.1f}us, p99 {3:.1f}us, max {4:.1f}ms'
+               .format(engine, result,
+                       result['p50'] * 1e6,
+                       result['p99'] * 1e6,
+                       result['max'] * 1e3))
+        print '    compiled with re: {0[re]}, re2: {0[re2]}'.format(
+            result['compiled'])
+
+    # the patterns that took longest with re, and how long re2 took on them
+    print '\nSlowest patterns:'
+    slowest = sorted(results['re']['pattern_times'].iteritems(),
+                     key=lambda (key, total): total,
+                     reverse=True)[:10]
+    for (sr_name, pattern), total in slowest:
+        line = '  /r/{0} re {1:.3f}s'.format(sr_name, total)
+        if 're2' in results:
+            line += ', re2 {0:.3f}s'.format(
+                results['re2']['pattern_times'][(sr_name, pattern)])
+        print line
+        print '    {0}'.format(pattern[:200].encode('utf-8'))
+
+
+if __name__ == '__main__':
+    main()
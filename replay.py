@@ -0,0 +1,255 @@
+"""Replays recorded queue items through the condition engine, offline.
+
+Usage: python replay.py RECORDING [--database PATH] [--repeat N] [--top N]
+
+RECORDING is a file written with the record_listings_file option. The
+enabled subreddits and the standard conditions are read from the configured
+database and copied into a SQLite database (in memory unless a path is
+given), which the replay uses for everything else, so the real log table is
+never touched.
+
+With --repeat, every pass checks the items as they were recorded, with no
+reported items skipped and no actions already logged by an earlier pass.
+
+Reddit isn't contacted: the requests that matched conditions would make are
+only counted, nobody is a moderator or shadowbanned, and every user has the
+same profile (100 link and comment karma, a year old, no gold).
+"""
+
+import argparse
+from datetime import datetime
+import logging
+from itertools import groupby
+from time import time
+from timeit import default_timer
+
+import praw
+from sqlalchemy import create_engine
+from sqlalchemy.pool import StaticPool
+
+import automoderator
+from automoderator import ActionExecutor, Condition
+from models import Base, cfg_file, Log, session, StandardCondition
+from models import StandardConditionsVersion, Subreddit
+from recording import ListingRecorder, read_recording
+from regex_benchmark import percentile
+
+
+class StubReddit(object):
+
+    """Stands in for the bot's reddit session, counting messages sent."""
+
+    def __init__(self):
+        self.messages = 0
+
+    def send_message(self, *args, **kwargs):
+        self.messages += 1
+
+
+class StubRedditorCache(object):
+
+    """Returns the same profile for every user, without fetching it."""
+
+    def __init__(self):
+        self.profile = {'link_karma': 100,
+                        'comment_karma': 100,
+                        'created_utc': time() - 365 * 24 * 60 * 60,
+                        'is_gold': False}
+
+    def get(self, user):
+        return self.profile
+
+    def stats(self):
+        return {}
+
+
+class DryRunExecutor(ActionExecutor):
+
+    """Counts the requests for matched conditions instead of making them."""
+
+    def __init__(self):
+        ActionExecutor.__init__(self, 0, 0)
+        self.requests = {}
+
+    def _run(self, steps, description, on_success):
+        for name, func in steps:
+            self.requests[name] = self.requests.get(name, 0) + 1
+
+        if on_success:
+            on_success()
+
+
+class ItemTimer(object):
+
+    """Wraps check_conditions to time how long each item takes to check."""
+
+    def __init__(self, check_conditions):
+        self.check_conditions = check_conditions
+        self.item_times = {}
+        self.sr_times = {}
+
+    def __call__(self, subreddit, item, *args, **kwargs):
+        start_time = default_timer()
+        try:
+            return self.check_conditions(subreddit, item, *args, **kwargs)
+        finally:
+            elapsed = default_timer() - start_time
+            self.item_times[item.name] = (self.item_times.get(item.name, 0.0)
+                                          + elapsed)
+            sr_name = subreddit.name.lower()
+            self.sr_times[sr_name] = self.sr_times.get(sr_name, 0.0) + elapsed
+
+    def end_pass(self):
+        """Returns the times of the items checked since the last pass."""
+        times = self.item_times.values()
+        self.item_times = {}
+        return times
+
+
+def use_replay_database(path):
+    """Copies the subreddits and standards into a SQLite database, and
+    switches the session over to it. Returns the subreddits."""
+    subreddits = (session.query(Subreddit)
+                         .filter(Subreddit.enabled == True)
+                         .all())
+    standards = session.query(StandardCondition).all()
+    versions = session.query(StandardConditionsVersion).all()
+    session.expunge_all()
+    session.close()
+
+    if path:
+        replay_engine = create_engine('sqlite:///' + path)
+    else:
+        # one shared connection, so every thread sees the same database
+        replay_engine = create_engine(
+            'sqlite://',
+            connect_args={'check_same_thread': False},
+            poolclass=StaticPool)
+    Base.metadata.create_all(replay_engine)
+    session.bind = replay_engine
+
+    subreddits = [session.merge(sr) for sr in subreddits]
+    for row in standards + versions:
+        session.merge(row)
+    session.commit()
+
+    return subreddits
+
+
+def stub_reddit():
+    """Replaces everything that would make requests to reddit."""
+    automoderator.r = StubReddit()
+    automoderator.action_executor = DryRunExecutor()
+    automoderator.redditor_cache = StubRedditorCache()
+    automoderator.get_user_rank = lambda user, subreddit: 'user'
+    automoderator.probe_shadowbanned = lambda user: False
+    automoderator.prefetch_shadowbanned = lambda users: None
+    # don't record the replay into a recording
+    automoderator.listing_recorder = ListingRecorder(None)
+
+
+def reset_state():
+    """Forgets what earlier passes did, so every pass does the same work.
+
+    Otherwise unchanged reported items would be skipped, and actions that
+    were already logged wouldn't be repeated.
+    """
+    automoderator.action_log.flush()
+    session.query(Log).delete()
+    session.commit()
+    automoderator.action_log.reset()
+    automoderator.report_states._cache.clear()
+
+
+def default_queue(item):
+    if isinstance(item, praw.objects.Comment):
+        return 'comment'
+    return 'submission'
+
+
+def read_items(r, path, sr_dict):
+    """Returns the recorded (queue, item) pairs that can be replayed."""
+    # only the subreddits the conditions are loaded for can be replayed
+    # files without queues are replayed as if from the new items queues
+    return [(queue or default_queue(item), item)
+            for queue, item in read_recording(r, path)
+            if item.subreddit.display_name.lower() in sr_dict]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Replay recorded queue items through the conditions.')
+    parser.add_argument('recording')
+    parser.add_argument('--database', default=None,
+                        help='SQLite file to use (default: in memory)')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='number of passes over the recording')
+    parser.add_argument('--top', type=int, default=10,
+                        help='number of most expensive subreddits to show')
+    args = parser.parse_args()
+
+    # only show problems, not every item being checked
+    automoderator.add_trace_logging()
+    logging.basicConfig(level=logging.WARNING)
+
+    r = praw.Reddit(user_agent=cfg_file.get('reddit', 'user_agent'),
+                    disable_update_check=True)
+
+    sr_dict = dict((sr.name.lower(), sr)
+                   for sr in use_replay_database(args.database))
+    stub_reddit()
+    timer = ItemTimer(automoderator.check_conditions)
+    automoderator.check_conditions = timer
+
+    queues = ['report', 'spam', 'submission', 'comment']
+    Condition.update_standards()
+    start_time = default_timer()
+    cond_dict = automoderator.load_all_conditions(sr_dict, queues)
+    print 'Loaded conditions for {0} subreddits in {1:.2f}s'.format(
+        len(cond_dict), default_timer() - start_time)
+
+    # everything recorded is newer than this, so nothing is stopped at
+    stop_time = datetime.utcfromtimestamp(0)
+    recorded = []
+    item_times = []
+    elapsed = 0.0
+    for i in range(args.repeat):
+        # matched conditions change the items (flair), so every pass reads
+        # them again, and starts from the same state
+        recorded = read_items(r, args.recording, sr_dict)
+        if i == 0:
+            print 'Replaying {0} items, {1} time(s)'.format(len(recorded),
+                                                            args.repeat)
+        reset_state()
+
+        start_time = default_timer()
+        for queue, run in groupby(recorded, key=lambda (queue, item): queue):
+            automoderator.check_items(queue,
+                                      iter([item for _, item in run]),
+                                      stop_time, sr_dict, cond_dict)
+        elapsed += default_timer() - start_time
+        item_times.extend(timer.end_pass())
+
+    replayed = len(recorded) * args.repeat
+    print '\n{0} items in {1:.2f}s: {2:.1f} items/sec'.format(
+        replayed, elapsed, replayed / max(elapsed, 0.001))
+    print '{0} items checked, per-item latency p50 {1:.2f}ms, ' \
+          'p99 {2:.2f}ms, max {3:.2f}ms'.format(
+              len(item_times),
+              percentile(item_times, 0.5) * 1000,
+              percentile(item_times, 0.99) * 1000,
+              max(item_times or [0]) * 1000)
+    print 'Requests that would have been made: {0}'.format(
+        automoderator.action_executor.requests)
+
+    print '\nMost expensive subreddits:'
+    costs = sorted(timer.sr_times.iteritems(),
+                   key=lambda (sr_name, total): total,
+                   reverse=True)[:args.top]
+    for sr_name, total in costs:
+        print '  /r/{0}: {1:.3f}s ({2:.1%})'.format(
+            sr_name, total, total / max(sum(timer.sr_times.values()), 1e-9))
+
+
+if __name__ == '__main__':
+    main()
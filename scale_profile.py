@@ -0,0 +1,228 @@
+"""Profiles loading the conditions of many subreddits, for capacity planning.
+
+Usage: python scale_profile.py --populate [--subreddits N] [--conditions N]
+                               [--standards N] [--database PATH]
+       python scale_profile.py [--database PATH] [--top N] [--no-breakdown]
+
+With --populate, synthetic subreddits (with realistic wiki configs, see
+synthetic.py) and standard conditions are written to a SQLite database,
+then it exits, so the memory used generating them isn't counted. Without
+it, the bot's startup steps are run on that database, and the time taken
+and memory used by get_enabled_subreddits, Condition.update_standards and
+load_all_conditions are reported, followed by a breakdown of the memory
+held by the loaded conditions, by type and by Condition attribute. The
+first run builds the conditions from the YAML and stores them compiled, so
+later runs profile loading them from there.
+
+The configured database is never touched. Reddit isn't contacted either:
+the bot is taken to moderate all the enabled subreddits.
+"""
+
+import argparse
+import gc
+import resource
+import sys
+import types
+from timeit import default_timer
+
+from sqlalchemy import create_engine
+
+import automoderator
+from automoderator import Condition
+from models import Base, session, Subreddit
+import synthetic
+
+# shared by everything, so not counted as part of what's loaded
+SKIPPED_TYPES = (type, types.ModuleType, types.FunctionType,
+                 types.BuiltinFunctionType, types.MethodType)
+
+
+class StubUser(object):
+
+    def __init__(self, sr_names):
+        self._mod_subs = dict((name.lower(), None) for name in sr_names)
+
+
+class StubReddit(object):
+
+    """Stands in for the bot's reddit session, moderating the subreddits."""
+
+    def __init__(self, sr_names):
+        self.user = StubUser(sr_names)
+
+
+def use_database(path):
+    engine = create_engine('sqlite:///' + path)
+    Base.metadata.create_all(engine)
+    session.bind = engine
+
+
+def memory_mb():
+    """Returns the current and peak resident memory, in MB."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024.0, peak
+    except IOError:
+        pass
+
+    # without /proc, only the peak is known
+    return peak, peak
+
+
+def profile_step(name, func, *args, **kwargs):
+    """Runs func, printing how long it took and how much memory it used."""
+    gc.collect()
+    before = memory_mb()[0]
+    start_time = default_timer()
+    result = func(*args, **kwargs)
+    elapsed = default_timer() - start_time
+    after, peak = memory_mb()
+    print ('{0:<28} {1:>8.2f}s {2:>+10.1f} MB {3:>10.1f} MB {4:>10.1f} MB'
+           .format(name, elapsed, after - before, after, peak))
+    return result
+
+
+def object_sizes(roots, seen, sizes):
+    """Adds the count and size of everything reachable from the roots that
+    hasn't been seen yet to sizes, by type name. Returns the bytes added."""
+    total = 0
+    stack = list(roots)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, SKIPPED_TYPES):
+            continue
+        seen.add(id(obj))
+
+        size = sys.getsizeof(obj)
+        entry = sizes.setdefault(type(obj).__name__, [0, 0])
+        entry[0] += 1
+        entry[1] += size
+        total += size
+        stack.extend(gc.get_referents(obj))
+
+    return total
+
+
+def memory_breakdown(cond_dict, top):
+    """Prints the memory held by the loaded conditions, by type and by
+    Condition attribute.
+
+    Objects shared between conditions (like compiled patterns from the
+    pattern cache) are counted once, for the first one they're found in.
+    """
+    conditions = {}
+    for queues in cond_dict.itervalues():
+        for condition_set in queues.itervalues():
+            for condition in condition_set:
+                conditions[id(condition)] = condition
+
+    seen = set()
+    type_sizes = {}
+    attr_sizes = {}
+    for condition in conditions.itervalues():
+        attrs = vars(condition)
+        seen.add(id(attrs))
+        attr_sizes['(instance)'] = (attr_sizes.get('(instance)', 0) +
+                                    sys.getsizeof(condition) +
+                                    sys.getsizeof(attrs))
+        for attr, value in attrs.iteritems():
+            attr_sizes[attr] = (attr_sizes.get(attr, 0) +
+                                object_sizes([value], seen, type_sizes))
+    conditions_total = sum(attr_sizes.itervalues())
+
+    # the condition sets' indexes, partitions and the cond_dict itself
+    other_total = object_sizes([cond_dict], seen, type_sizes)
+    standards_total = object_sizes([Condition._standard_cache], seen,
+                                   type_sizes)
+
+    print '\n{0} distinct conditions: {1:.1f} MB ({2:.0f} bytes each)'.format(
+        len(conditions), conditions_total / 1048576.0,
+        conditions_total / float(max(len(conditions), 1)))
+    print 'Condition sets and indexes: {0:.1f} MB'.format(
+        other_total / 1048576.0)
+    print 'Standard conditions: {0:.1f} MB'.format(standards_total / 1048576.0)
+
+    print '\nBy Condition attribute:'
+    for attr, size in sorted(attr_sizes.iteritems(),
+                             key=lambda (attr, size): size,
+                             reverse=True)[:top]:
+        print '  {0:<28} {1:>10.1f} MB {2:>6.1%}'.format(
+            attr, size / 1048576.0, size / float(max(conditions_total, 1)))
+
+    print '\nBy type:'
+    for name, (count, size) in sorted(type_sizes.iteritems(),
+                                      key=lambda (name, entry): entry[1],
+                                      reverse=True)[:top]:
+        print '  {0:<28} {1:>10} objects {2:>10.1f} MB'.format(
+            name, count, size / 1048576.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Profile loading the conditions of many subreddits.')
+    parser.add_argument('--database', default='scale_profile.db',
+                        help='SQLite file to use')
+    parser.add_argument('--populate', action='store_true',
+                        help='write synthetic subreddits and standards to '
+                             'the database and exit')
+    parser.add_argument('--subreddits', type=int, default=10000)
+    parser.add_argument('--conditions', type=int, default=100,
+                        help='number of conditions per subreddit')
+    parser.add_argument('--standards', type=int, default=50,
+                        help='number of standard conditions')
+    parser.add_argument('--prefix', default='scaletest',
+                        help='prefix of the subreddit names')
+    parser.add_argument('--top', type=int, default=15,
+                        help='number of attributes and types to show')
+    parser.add_argument('--no-breakdown', action='store_true',
+                        help="don't break down the memory used by type")
+    args = parser.parse_args()
+
+    use_database(args.database)
+
+    if args.populate:
+        sr_names = synthetic.subreddit_names(args.subreddits, args.prefix)
+        start_time = default_timer()
+        synthetic.populate(sr_names, args.conditions, args.standards)
+        print ('Wrote {0} subreddits with {1} conditions each in {2:.1f}s'
+               .format(len(sr_names), args.conditions,
+                       default_timer() - start_time))
+        return
+
+    sr_names = [name for (name,) in (session.query(Subreddit.name)
+                                     .filter(Subreddit.enabled == True))]
+    if not sr_names:
+        print 'No enabled subreddits in {0}, run with --populate first'.format(
+            args.database)
+        sys.exit(1)
+    automoderator.r = StubReddit(sr_names)
+
+    queues = ['report', 'spam', 'submission', 'comment']
+    print '{0:<28} {1:>9} {2:>13} {3:>13} {4:>13}'.format(
+        'step', 'time', 'memory', 'rss', 'peak rss')
+    print '{0:<28} {1:>9} {2:>13} {3:>10.1f} MB {4:>10.1f} MB'.format(
+        '(before)', '', '', *memory_mb())
+    sr_dict = profile_step('get_enabled_subreddits',
+                           automoderator.get_enabled_subreddits,
+                           reload_mod_subs=False)
+    profile_step('Condition.update_standards', Condition.update_standards)
+    cond_dict = profile_step('load_all_conditions',
+                             automoderator.load_all_conditions,
+                             sr_dict, queues)
+
+    num_conditions = sum(len(condition_set)
+                         for queues_dict in cond_dict.itervalues()
+                         for condition_set in queues_dict.itervalues())
+    print '\n{0} subreddits, {1} conditions in queue lists'.format(
+        len(cond_dict), num_conditions)
+    print 'Pattern cache: {0}'.format(automoderator.pattern_cache.stats())
+
+    if not args.no_breakdown:
+        memory_breakdown(cond_dict, args.top)
+
+
+if __name__ == '__main__':
+    main()
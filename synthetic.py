@@ -0,0 +1,282 @@
+"""Synthetic subreddit configurations and queue items, for load testing.
+
+Everything is generated from random.Random instances seeded by name, so
+the same subreddit gets the same conditions whether they're written to the
+database or served from a fake wiki page.
+"""
+
+from datetime import datetime
+import random
+import string
+
+import yaml
+
+from models import session, StandardCondition, StandardConditionsVersion
+from models import Subreddit
+
+WORDS = ('the', 'a', 'this', 'is', 'my', 'what', 'how', 'why', 'new',
+         'first', 'best', 'question', 'help', 'news', 'update', 'discussion',
+         'review', 'guide', 'photo', 'video', 'game', 'music', 'art',
+         'science', 'history', 'politics', 'sports', 'food', 'travel',
+         'weekly', 'thread', 'announcement', 'request', 'original', 'content',
+         'repost', 'link', 'source', 'opinion', 'today', 'finally', 'found')
+
+# what the conditions look for, only in some of the items
+SPAM_WORDS = ('spam', 'free', 'cheap', 'deal', 'offer', 'click', 'subscribe',
+              'giveaway', 'crypto', 'coupon', 'casino', 'pills', 'discount',
+              'followers', 'promo', 'earn', 'bitcoin', 'winner')
+SPAM_CHANCE = 0.05
+
+DOMAINS = ('imgur.com', 'i.imgur.com', 'youtube.com', 'youtu.be',
+           'twitter.com', 'gfycat.com', 'github.com', 'wikipedia.org',
+           'news.example.com', 'nytimes.com', 'bbc.co.uk', 'reuters.com')
+
+SPAM_DOMAINS = ('spam-shop.example.net', 'deals.example.org',
+                'blogspot.com', 'wordpress.com', 'tumblr.com',
+                'cheap-pills.example.com', 'promo.example.info')
+
+USERS = ['user{0:04d}'.format(i) for i in range(2000)]
+
+# the moderator that sends the fake update messages
+MODERATOR = 'loadtest_mod'
+
+
+def subreddit_names(count, prefix='loadtest'):
+    return ['{0}{1:05d}'.format(prefix, i) for i in range(count)]
+
+
+def random_words(rng, count, words=WORDS):
+    return [rng.choice(words) for i in range(count)]
+
+
+def random_sentence(rng, min_words=3, max_words=12):
+    words = random_words(rng, rng.randint(min_words, max_words))
+    if words and rng.random() < SPAM_CHANCE:
+        words[rng.randrange(len(words))] = rng.choice(SPAM_WORDS)
+    return ' '.join(words)
+
+
+def random_domain(rng):
+    if rng.random() < SPAM_CHANCE:
+        return rng.choice(SPAM_DOMAINS)
+    return rng.choice(DOMAINS)
+
+
+def condition_def(rng, standards=()):
+    """Returns a condition dict, picking from the kinds subreddits use."""
+    kind = rng.randint(0, 9)
+    if kind == 0:
+        cond = {'title': random_words(rng, rng.randint(1, 6), SPAM_WORDS),
+                'action': 'remove'}
+    elif kind == 1:
+        cond = {'domain': rng.sample(SPAM_DOMAINS, rng.randint(1, 4)),
+                'action': 'spam'}
+    elif kind == 2:
+        cond = {'user': rng.sample(USERS, rng.randint(1, 20)),
+                'action': 'remove'}
+    elif kind == 3:
+        cond = {'body': '({0})s? +{1}'.format(
+                    '|'.join(random_words(rng, 3, SPAM_WORDS)),
+                    rng.choice(WORDS)),
+                'modifiers': ['regex'],
+                'action': 'report',
+                'report_reason': 'Matched {{match}}'}
+    elif kind == 4:
+        cond = {'title+body': random_words(rng, rng.randint(2, 8),
+                                           SPAM_WORDS),
+                'modifiers': ['includes-word'],
+                'action': 'remove',
+                'comment': 'Your {{kind}} in /r/{{subreddit}} was removed.'}
+    elif kind == 5:
+        cond = {'url': rng.choice(SPAM_DOMAINS).split('.')[0],
+                'modifiers': ['includes'],
+                'user_conditions': {'account_age': '< {0}'.format(
+                                        rng.choice((1, 7, 30))),
+                                    'combined_karma': '< {0}'.format(
+                                        rng.choice((10, 100)))},
+                'action': 'remove'}
+    elif kind == 6:
+        cond = {'reports': rng.randint(1, 5),
+                'action': 'remove',
+                'modmail': '{{permalink}} was removed after reports.'}
+    elif kind == 7:
+        cond = {'title': [rng.choice(WORDS)],
+                'modifiers': ['starts-with'],
+                'link_flair_text': rng.choice(WORDS).capitalize(),
+                'link_flair_class': rng.choice(WORDS)}
+    elif kind == 8:
+        cond = {'~domain': rng.sample(DOMAINS, 2),
+                'body_min_length': rng.randint(500, 2000),
+                'type': 'comment',
+                'action': 'report',
+                'report': 'Long comment'}
+    elif standards:
+        cond = {'standard': rng.choice(standards)}
+    else:
+        cond = {'author_flair_css_class': rng.choice(SPAM_WORDS),
+                'action': 'approve'}
+
+    if rng.random() < 0.2:
+        cond['priority'] = rng.randint(-2, 5)
+
+    return cond
+
+
+def conditions_yaml(sr_name, num_conditions, standards=()):
+    """Returns the YAML for a subreddit's synthetic conditions."""
+    rng = random.Random(sr_name)
+    defs = [condition_def(rng, standards) for i in range(num_conditions)]
+    return yaml.safe_dump_all(defs, default_flow_style=False)
+
+
+def standard_defs(num_standards):
+    """Returns the definitions of synthetic standard conditions."""
+    rng = random.Random('standards')
+    defs = []
+    for i in range(num_standards):
+        cond = condition_def(rng)
+        cond.pop('standard', None)
+        cond['name'] = 'standard{0:03d}'.format(i)
+        defs.append(cond)
+
+    return defs
+
+
+def item_id(rng):
+    return ''.join(rng.choice(string.ascii_lowercase + string.digits)
+                   for i in range(7))
+
+
+def submission_data(rng, sr_name, created_utc):
+    """Returns a submission as it appears in a listing's children."""
+    id = item_id(rng)
+    is_self = rng.random() < 0.4
+    domain = 'self.' + sr_name if is_self else random_domain(rng)
+    title = random_sentence(rng)
+    permalink = '/r/{0}/comments/{1}/{2}/'.format(
+        sr_name, id, '_'.join(title.split()[:5]))
+    return {'id': id,
+            'name': 't3_' + id,
+            'title': title,
+            'selftext': random_sentence(rng, 0, 80) if is_self else '',
+            'author': rng.choice(USERS),
+            'subreddit': sr_name,
+            'subreddit_id': 't5_' + sr_name,
+            'domain': domain,
+            'url': ('https://www.reddit.com' + permalink if is_self else
+                    'http://{0}/{1}'.format(domain,
+                                            '/'.join(random_words(rng, 2)))),
+            'is_self': is_self,
+            'permalink': permalink,
+            'created_utc': created_utc,
+            'created': created_utc,
+            'num_reports': 0,
+            'user_reports': [],
+            'mod_reports': [],
+            'approved_by': None,
+            'banned_by': None,
+            'link_flair_text': None,
+            'link_flair_css_class': None,
+            'author_flair_text': rng.choice((None, None, 'Flair')),
+            'author_flair_css_class': rng.choice((None, None, 'flair')),
+            'media': None,
+            'over_18': False,
+            'score': rng.randint(0, 50),
+            'num_comments': rng.randint(0, 20),
+            'distinguished': None,
+            'edited': False}
+
+
+def comment_data(rng, sr_name, created_utc):
+    """Returns a comment as it appears in a listing's children."""
+    id = item_id(rng)
+    link_id = item_id(rng)
+    is_reply = rng.random() < 0.5
+    return {'id': id,
+            'name': 't1_' + id,
+            'body': random_sentence(rng, 1, 60),
+            'author': rng.choice(USERS),
+            'subreddit': sr_name,
+            'subreddit_id': 't5_' + sr_name,
+            'link_id': 't3_' + link_id,
+            'parent_id': 't1_' + item_id(rng) if is_reply else 't3_' + link_id,
+            'link_title': random_sentence(rng),
+            'link_author': rng.choice(USERS),
+            'link_url': 'http://{0}/'.format(random_domain(rng)),
+            'created_utc': created_utc,
+            'created': created_utc,
+            'num_reports': 0,
+            'user_reports': [],
+            'mod_reports': [],
+            'approved_by': None,
+            'banned_by': None,
+            'author_flair_text': rng.choice((None, None, 'Flair')),
+            'author_flair_css_class': rng.choice((None, None, 'flair')),
+            'replies': '',
+            'score': rng.randint(-5, 50),
+            'distinguished': None,
+            'edited': False}
+
+
+def reported(rng, data):
+    """Adds reports to an item's data."""
+    data['num_reports'] = rng.randint(1, 6)
+    data['user_reports'] = [[rng.choice(SPAM_WORDS), data['num_reports']]]
+    return data
+
+
+def user_id(name):
+    return item_id(random.Random(name + '/id'))
+
+
+def user_data(name, now):
+    """Returns a user's profile, as from /user/NAME/about."""
+    rng = random.Random(name)
+    return {'id': user_id(name),
+            'name': name,
+            'link_karma': int(rng.expovariate(1 / 500.0)),
+            'comment_karma': int(rng.expovariate(1 / 2000.0)),
+            'created_utc': now - rng.randint(0, 5 * 365) * 24 * 60 * 60,
+            'is_gold': rng.random() < 0.05,
+            'is_mod': False,
+            'has_verified_email': True}
+
+
+def populate(sr_names, num_conditions, num_standards=0):
+    """Writes synthetic subreddits and standards to the database.
+
+    Existing rows with the same names are replaced, and the subreddits'
+    last seen items are reset to now, so only new items get checked.
+    """
+    standards = standard_defs(num_standards)
+    for std_def in standards:
+        std_def = dict(std_def)
+        name = std_def.pop('name')
+        # without a checksum, the bot works it out from the yaml
+        session.merge(StandardCondition(name=name,
+                                        yaml=yaml.safe_dump(std_def),
+                                        checksum=None))
+    if standards:
+        db_version = session.query(StandardConditionsVersion).first()
+        if not db_version:
+            db_version = StandardConditionsVersion(version=0)
+            session.add(db_version)
+        db_version.version += 1
+
+    standard_names = [d['name'] for d in standards]
+    existing = dict((sr.name, sr) for sr in session.query(Subreddit))
+    now = datetime.utcnow()
+    for sr_name in sr_names:
+        subreddit = existing.get(sr_name)
+        if not subreddit:
+            subreddit = Subreddit(name=sr_name)
+            session.add(subreddit)
+        subreddit.enabled = True
+        subreddit.conditions_yaml = conditions_yaml(sr_name, num_conditions,
+                                                    standard_names)
+        subreddit.last_submission = now
+        subreddit.last_spam = now
+        subreddit.last_comment = now
+        subreddit.exclude_banned_modqueue = False
+
+    session.commit()
@@ -0,0 +1,76 @@
+"""Tests for AutoModerator.
+
+Run them from the repository root with:
+
+    python -m unittest discover -s tests -t .
+
+models reads automoderator.cfg from the running script's directory as soon
+as it's imported, so before anything imports it, it's pointed at a
+temporary config with an in-memory SQLite database. The configured
+database is never touched.
+"""
+
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+TEST_CONFIG = """
+[database]
+system = sqlite
+database = :memory:
+
+[reddit]
+username = AutoModerator
+disclaimer = *I am a bot.*
+wiki_page_name = automoderator
+"""
+
+_config_dir = tempfile.mkdtemp()
+atexit.register(shutil.rmtree, _config_dir, True)
+with open(os.path.join(_config_dir, 'automoderator.cfg'), 'w') as cfg:
+    cfg.write(TEST_CONFIG)
+sys.argv[0] = os.path.join(_config_dir, 'tests')
+
+import praw
+
+from models import Base, engine
+import automoderator
+
+Base.metadata.create_all(engine)
+# as main() does, since checking items logs with logging.trace
+automoderator.add_trace_logging()
+
+reddit = praw.Reddit(user_agent='AutoModerator tests',
+                     disable_update_check=True)
+
+
+def make_submission(**values):
+    """Returns a Submission with the given values, and defaults for the
+    rest, without contacting reddit."""
+    data = {'id': 'abc', 'name': 't3_abc', 'title': 'A title',
+            'selftext': '', 'author': 'someone', 'subreddit': 'testsr',
+            'domain': 'self.testsr', 'url': 'http://reddit.com/r/testsr/abc',
+            'permalink': 'http://reddit.com/r/testsr/comments/abc/',
+            'is_self': True, 'created_utc': 1400000000, 'num_reports': 0,
+            'approved_by': None, 'banned_by': None, 'edited': False,
+            'link_flair_text': None, 'link_flair_css_class': None,
+            'author_flair_text': None, 'author_flair_css_class': None,
+            'media': None, 'over_18': False}
+    data.update(values)
+    return praw.objects.Submission(reddit, data)
+
+
+def make_comment(**values):
+    """Returns a Comment with the given values, and defaults for the rest,
+    without contacting reddit."""
+    data = {'id': 'c1', 'name': 't1_c1', 'body': '', 'author': 'someone',
+            'subreddit': 'testsr', 'link_id': 't3_abc', 'parent_id': 't3_abc',
+            'link_title': 'A title', 'link_author': 'someone else',
+            'created_utc': 1400000000, 'num_reports': 0,
+            'approved_by': None, 'banned_by': None, 'edited': False,
+            'replies': '', 'author_flair_text': None,
+            'author_flair_css_class': None}
+    data.update(values)
+    return praw.objects.Comment(reddit, data)
@@ -0,0 +1,149 @@
+import logging
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import automoderator
+from automoderator import ActionLog
+from models import Log, session
+
+# run in a separate process, which buffers log entries and is then sent
+# SIGTERM while it's busy
+SIGTERM_SCRIPT = """
+import os, signal, time
+import automoderator
+from models import Base, engine
+Base.metadata.create_all(engine)
+automoderator.exit_on_sigterm()
+automoderator.action_log.record('t3_a', ['remove'], 'yaml a')
+os.kill(os.getpid(), signal.SIGTERM)
+time.sleep(30)
+"""
+
+
+class FailingSession(object):
+
+    """Stands in for the session, failing to execute anything."""
+
+    def execute(self, *args, **kwargs):
+        raise IOError('database went away')
+
+    def rollback(self):
+        pass
+
+
+class ActionLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.action_log = ActionLog(flush_rows=3, flush_secs=3600)
+
+    def tearDown(self):
+        session.query(Log).delete()
+        session.commit()
+
+    def logged(self):
+        return sorted((row.item_fullname, row.action, row.condition_yaml)
+                      for row in session.query(Log))
+
+    def test_entries_written_on_flush(self):
+        self.action_log.record('t3_a', ['remove', 'link_flair'], 'yaml a')
+        self.action_log.record('t1_b', ['report'], 'yaml b')
+        self.assertEqual(self.logged(), [])
+
+        self.assertTrue(self.action_log.flush())
+        self.assertEqual(self.logged(),
+                         [('t1_b', 'report', 'yaml b'),
+                          ('t3_a', 'link_flair', 'yaml a'),
+                          ('t3_a', 'remove', 'yaml a')])
+        self.assertEqual(self.action_log.rows_written, 3)
+        self.assertEqual(self.action_log.matches, 2)
+
+    def test_flushed_when_enough_rows(self):
+        self.action_log.record('t3_a', ['remove'], 'yaml a')
+        self.action_log.flush_if_due()
+        self.assertEqual(self.logged(), [])
+
+        self.action_log.record('t3_b', ['remove', 'link_flair'], 'yaml b')
+        self.action_log.flush_if_due()
+        self.assertEqual(len(self.logged()), 3)
+
+    def test_flushed_when_enough_time_passed(self):
+        self.action_log.flush_secs = 0
+        self.action_log.record('t3_a', ['remove'], 'yaml a')
+        self.action_log.flush_if_due()
+        self.assertEqual(self.logged(), [('t3_a', 'remove', 'yaml a')])
+
+    def test_buffered_entries_performed(self):
+        # recorded before the item was prefetched, and after
+        self.action_log.record('t3_a', ['remove'], 'yaml a')
+        self.action_log.prefetch(['t3_a', 't3_b'])
+        self.action_log.record('t3_b', ['approve'], 'yaml b')
+
+        self.assertEqual(self.action_log.performed('t3_a'),
+                         (set(['remove']), set(['yaml a'])))
+        self.assertEqual(self.action_log.performed('t3_b'),
+                         (set(['approve']), set(['yaml b'])))
+        self.assertEqual(self.logged(), [])
+
+    def test_written_entries_performed(self):
+        self.action_log.record('t3_a', ['spam'], 'yaml a')
+        self.action_log.flush()
+
+        # as in the next pass
+        self.action_log.reset()
+        self.assertEqual(self.action_log.performed('t3_a'),
+                         (set(['spam']), set(['yaml a'])))
+        self.assertEqual(self.action_log.performed('t3_b'), (set(), set()))
+
+    def test_entries_kept_if_write_fails(self):
+        self.action_log.record('t3_a', ['remove'], 'yaml a')
+        automoderator.session = FailingSession()
+        logging.disable(logging.ERROR)
+        try:
+            self.assertFalse(self.action_log.flush())
+        finally:
+            automoderator.session = session
+            logging.disable(logging.NOTSET)
+        self.assertEqual(self.logged(), [])
+
+        self.action_log.record('t3_b', ['remove'], 'yaml b')
+        self.assertTrue(self.action_log.flush())
+        self.assertEqual(self.logged(), [('t3_a', 'remove', 'yaml a'),
+                                         ('t3_b', 'remove', 'yaml b')])
+
+
+class ShutdownTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.db_path = os.path.join(self.temp_dir, 'test.db')
+        # models reads the config from the script's directory, which is
+        # the working directory with -c
+        with open(os.path.join(self.temp_dir, 'automoderator.cfg'),
+                  'w') as cfg:
+            cfg.write('[database]\nsystem = sqlite\ndatabase = {0}\n'
+                      .format(self.db_path))
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def test_pending_entries_written_on_sigterm(self):
+        repo_dir = os.path.dirname(os.path.abspath(automoderator.__file__))
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [repo_dir] + [path for path in sys.path if path])
+        process = subprocess.Popen([sys.executable, '-c', SIGTERM_SCRIPT],
+                                   cwd=self.temp_dir, env=env)
+        self.assertEqual(process.wait(), 0)
+
+        connection = sqlite3.connect(self.db_path)
+        try:
+            rows = connection.execute('SELECT item_fullname, action, '
+                                      'condition_yaml FROM log').fetchall()
+        finally:
+            connection.close()
+        self.assertEqual(rows, [('t3_a', 'remove', 'yaml a')])
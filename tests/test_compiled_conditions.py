@@ -0,0 +1,158 @@
+import unittest
+
+import automoderator
+from automoderator import (Condition, build_conditions,
+                           load_compiled_conditions, store_compiled_conditions,
+                           update_from_wiki, yaml_checksum)
+from models import CompiledConditions, session, Subreddit
+from tests import make_submission
+
+CONDITIONS_YAML = u"""
+title: [cheap pills, "free money"]
+action: remove
+priority: 2
+---
+user: [spammer]
+modifiers: [includes]
+action: spam
+comment: "Removed, {{user}}."
+---
+body: "(buy|sell) now"
+modifiers: [regex]
+ignore_blockquotes: true
+report: "Sales {{match-1}}"
+---
+user_conditions: {account_age: "< 1", rank: "== user"}
+domain: [example.com]
+link_flair_text: "{{domain}}"
+---
+standard: spamdomains
+action: report
+---
+This section is only a comment.
+"""
+
+STANDARD = {'domain': ['spam.net', 'example.com'], 'action': 'remove',
+            'modifiers': ['full-exact']}
+
+
+class StubWikiPage(object):
+
+    def __init__(self, content_md):
+        self.content_md = content_md
+
+
+class StubSubreddit(object):
+
+    def __init__(self, display_name, content_md):
+        self.display_name = display_name
+        self._page = StubWikiPage(content_md)
+
+    def get_wiki_page(self, page_name):
+        return self._page
+
+
+class StubReddit(object):
+
+    def __init__(self):
+        self.messages = []
+
+    def send_message(self, *args):
+        self.messages.append(args)
+
+
+class CompiledConditionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved_standards = (dict(Condition._standard_cache),
+                                dict(Condition._standard_checksums))
+        Condition._standard_cache['spamdomains'] = STANDARD
+        Condition._standard_checksums['spamdomains'] = 'checksum'
+        self.subreddit = Subreddit(name='testsr',
+                                   conditions_yaml=CONDITIONS_YAML)
+
+    def tearDown(self):
+        Condition._standard_cache.clear()
+        Condition._standard_cache.update(self.saved_standards[0])
+        Condition._standard_checksums.clear()
+        Condition._standard_checksums.update(self.saved_standards[1])
+        session.rollback()
+        session.query(CompiledConditions).delete()
+        session.query(Subreddit).delete()
+        session.commit()
+
+    def store(self):
+        compiled = CompiledConditions(name=self.subreddit.name)
+        store_compiled_conditions(self.subreddit,
+                                  build_conditions(CONDITIONS_YAML), compiled)
+        return compiled
+
+    def assertSameConditions(self, stored, built):
+        self.assertEqual([c.get_state() for c in stored],
+                         [c.get_state() for c in built])
+        # and the attributes compiled when they're loaded
+        for stored_condition, built_condition in zip(stored, built):
+            self.assertEqual(
+                dict((key, (regex.pattern, regex.flags)) for key, regex
+                     in stored_condition.match_regexes.iteritems()),
+                dict((key, (regex.pattern, regex.flags)) for key, regex
+                     in built_condition.match_regexes.iteritems()))
+            self.assertEqual(stored_condition.user_predicates,
+                             built_condition.user_predicates)
+            self.assertEqual(
+                dict((field, template.segments) for field, template
+                     in stored_condition.templates.iteritems()),
+                dict((field, template.segments) for field, template
+                     in built_condition.templates.iteritems()))
+
+    def test_stored_conditions_equal_yaml_built(self):
+        stored = load_compiled_conditions(self.subreddit, self.store())
+        self.assertSameConditions(stored, build_conditions(CONDITIONS_YAML))
+
+    def test_templates_compiled_again(self):
+        stored = load_compiled_conditions(self.subreddit, self.store())
+        self.assertEqual(stored[3].render('link_flair_text',
+                                          make_submission(domain='a.com'),
+                                          None),
+                         'a.com')
+
+    def test_standard_values_overridden(self):
+        stored = load_compiled_conditions(self.subreddit, self.store())
+        self.assertEqual(stored[4].action, 'report')
+        self.assertEqual(stored[4].match_patterns,
+                         build_conditions(CONDITIONS_YAML)[4].match_patterns)
+
+    def test_changed_yaml_not_loaded(self):
+        compiled = self.store()
+        self.subreddit.conditions_yaml = CONDITIONS_YAML + u'---\nuser: x\n'
+        self.assertEqual(load_compiled_conditions(self.subreddit, compiled),
+                         None)
+
+    def test_changed_standard_not_loaded(self):
+        compiled = self.store()
+        Condition._standard_checksums['spamdomains'] = 'changed'
+        self.assertEqual(load_compiled_conditions(self.subreddit, compiled),
+                         None)
+
+    def test_old_format_not_loaded(self):
+        compiled = self.store()
+        compiled.format_version -= 1
+        self.assertEqual(load_compiled_conditions(self.subreddit, compiled),
+                         None)
+
+    def test_update_from_wiki_stores_yaml_built(self):
+        saved_r = automoderator.r
+        automoderator.r = StubReddit()
+        try:
+            self.assertTrue(update_from_wiki(
+                StubSubreddit('TestSR', CONDITIONS_YAML), 'somemod'))
+        finally:
+            automoderator.r = saved_r
+
+        compiled = session.query(CompiledConditions).get('testsr')
+        self.assertEqual(compiled.yaml_checksum,
+                         yaml_checksum(CONDITIONS_YAML))
+        stored = load_compiled_conditions(self.subreddit, compiled)
+        self.assertSameConditions(stored, build_conditions(CONDITIONS_YAML))
+        self.assertEqual(stored[4].yaml,
+                         'action: report\nstandard: spamdomains\n')
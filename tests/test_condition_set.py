@@ -0,0 +1,123 @@
+import unittest
+
+import yaml
+
+from automoderator import Condition, ConditionSet, ItemView, LiteralMatcher
+from tests import make_comment, make_submission
+
+# no actions, so checking only decides whether they match
+CONDITIONS_YAML = u"""
+domain: [example.com, spam.net]
+---
+domain: example.com
+modifiers: [full-exact]
+---
+user: [Spammer, carol]
+---
+~user: [someone]
+title: [free]
+---
+title: [cheap pills, free money]
+---
+title: [Cheap]
+modifiers: [case-sensitive, includes]
+---
+body: [click here]
+ignore_blockquotes: true
+---
+title+body: [giveaway, "100% off"]
+---
+url: [bit.ly]
+---
+title: "(buy|sell) (now|today)"
+modifiers: [regex]
+---
+~domain: [example.com]
+title: [now]
+---
+link_id: [abc]
+parent_comment_id: [c0]
+---
+author_flair_text: [verified]
+---
+body: [click]
+modifiers: [starts-with]
+---
+title: [money]
+modifiers: [ends-with]
+"""
+
+ITEMS = [
+    make_submission(),
+    make_submission(domain='example.com', url='http://example.com/a',
+                    is_self=False),
+    make_submission(domain='www.spam.net', title='Free money!',
+                    url='http://bit.ly/x', is_self=False),
+    make_submission(author='spammer', title='cheap pills, buy now'),
+    make_submission(author='carol', title='Cheap giveaway, 100% off'),
+    make_submission(title='Buy today', selftext='click here\n> quoted'),
+    make_submission(domain='example.com', title='Now or never',
+                    author_flair_text='Verified'),
+    make_comment(body='> click here\nnot in a quote'),
+    make_comment(body='click here for free money', parent_id='t1_c0'),
+    make_comment(body='nothing to see', author='Spammer',
+                 author_flair_text='verified'),
+    make_comment(body='GIVEAWAY\n'),
+]
+
+
+class ConditionSetTest(unittest.TestCase):
+
+    def setUp(self):
+        conditions = [Condition(d)
+                      for d in yaml.safe_load_all(CONDITIONS_YAML)]
+        self.condition_set = ConditionSet(conditions)
+
+    def test_prefilter_selects_same_conditions_as_full_scan(self):
+        ruled_out = 0
+        for item in ITEMS:
+            view = ItemView(item)
+            prefilter = self.condition_set.prefilter(view)
+            full_scan = [c for c in self.condition_set
+                         if c.check_item(item, view)]
+            prefiltered = [c for c in self.condition_set
+                           if prefilter.allows(c) and c.check_item(item, view)]
+            self.assertEqual(full_scan, prefiltered,
+                             u'{0}: {1} != {2}'.format(
+                                 item.name,
+                                 [c.yaml for c in full_scan],
+                                 [c.yaml for c in prefiltered]))
+            ruled_out += sum(1 for c in self.condition_set
+                             if not prefilter.allows(c))
+
+        # otherwise the prefilter isn't doing anything
+        self.assertTrue(ruled_out > 0)
+
+    def test_partitions_by_item_type(self):
+        submission_conditions = sum(
+            self.condition_set.partitions(make_submission()), ())
+        comment_conditions = sum(
+            self.condition_set.partitions(make_comment()), ())
+
+        self.assertTrue(all(c.type in ('submission', 'both')
+                            for c in submission_conditions))
+        self.assertTrue(all(c.type in ('comment', 'both')
+                            for c in comment_conditions))
+        self.assertEqual(
+            set(submission_conditions) | set(comment_conditions),
+            set(self.condition_set))
+
+
+class LiteralMatcherTest(unittest.TestCase):
+
+    def test_finds_overlapping_literals(self):
+        matcher = LiteralMatcher([u'free', u'free money', u'money',
+                                  u'one'])
+        self.assertEqual(matcher.find(u'get free money'),
+                         set([u'free', u'free money', u'money', u'one']))
+        self.assertEqual(matcher.find(u'nothing here'), set())
+
+    def test_literals_longer_than_pattern_depth(self):
+        matcher = LiteralMatcher([u'abcdefghijkl', u'abcdefghijxx'])
+        self.assertEqual(matcher.find(u'..abcdefghijxx..'),
+                         set([u'abcdefghijxx']))
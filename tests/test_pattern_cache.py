@@ -0,0 +1,48 @@
+import re
+import unittest
+
+import automoderator
+from automoderator import (PatternCache, compile_pattern, pattern_engine,
+                           re2_differs)
+
+FLAGS = re.DOTALL | re.UNICODE | re.IGNORECASE
+
+
+class Re2DiffersTest(unittest.TestCase):
+
+    def test_unicode_word_escapes(self):
+        for pattern in (ur'\bspam\b', ur'spam\B', ur'\w+', ur'[\W_]'):
+            self.assertTrue(re2_differs(pattern, FLAGS), pattern)
+            self.assertFalse(re2_differs(pattern, re.IGNORECASE), pattern)
+
+    def test_end_anchor(self):
+        self.assertTrue(re2_differs(u'^spam$', FLAGS))
+        self.assertTrue(re2_differs(u'spam$', 0))
+        self.assertFalse(re2_differs(u'spam$', re.MULTILINE))
+
+    def test_literals_not_counted(self):
+        for pattern in (ur'^spam', ur'\$5', ur'[$]', ur'[]$]', ur'[^]$]',
+                        ur'\\w', ur'[\b]', ur'(free|cheap) pills'):
+            self.assertFalse(re2_differs(pattern, FLAGS), pattern)
+
+
+@unittest.skipIf(automoderator.re2 is None, 'the re2 module is not installed')
+class Re2FallbackTest(unittest.TestCase):
+
+    def test_differing_patterns_use_re(self):
+        self.assertEqual(pattern_engine(
+            compile_pattern(ur'^spam$', FLAGS, 're2')), 're')
+        self.assertEqual(pattern_engine(
+            compile_pattern(ur'(?:^|\W|\b)spam(?:$|\W|\b)', FLAGS, 're2')),
+            're')
+        self.assertEqual(pattern_engine(
+            compile_pattern(ur'(free|cheap) pills', FLAGS, 're2')), 're2')
+
+    def test_matches_same_as_re(self):
+        pattern_cache = PatternCache(10, 're2')
+        for pattern, string in [(ur'\bcaf\xe9\b', u'un caf\xe9!'),
+                                (ur'x$', u'x\n'),
+                                (ur'sp+am', u'SPPAM')]:
+            self.assertEqual(
+                bool(pattern_cache.compile(pattern, FLAGS).search(string)),
+                bool(re.compile(pattern, FLAGS).search(string)), pattern)
@@ -0,0 +1,74 @@
+import re
+import unittest
+
+from automoderator import PlaceholderTemplate, replace_placeholders
+from tests import make_comment, make_submission
+
+MEDIA = {'oembed': {'author_name': 'uploader', 'title': 'Video title',
+                    'author_url': 'http://video.example.com/uploader'}}
+
+
+class PlaceholderTemplateTest(unittest.TestCase):
+
+    def test_without_placeholders(self):
+        template = PlaceholderTemplate(u'Nothing to fill in {here}')
+        self.assertEqual(template.segments, [u'Nothing to fill in {here}'])
+        self.assertEqual(template.render(make_submission(), None),
+                         u'Nothing to fill in {here}')
+
+    def test_item_values(self):
+        submission = make_submission(author='poster', title='Hello',
+                                     domain='example.com')
+        self.assertEqual(
+            replace_placeholders(
+                u'{{user}} posted {{title}} ({{kind}}) from {{domain}} '
+                u'in /r/{{subreddit}}', submission, None),
+            u'poster posted Hello (submission) from example.com in /r/testsr')
+
+        comment = make_comment(body='Some text', link_id='t3_xyz')
+        self.assertEqual(
+            replace_placeholders(u'{{kind}} {{link_id}}: {{body}} on '
+                                 u'{{title}}', comment, None),
+            u'comment xyz: Some text on A title')
+
+    def test_unknown_placeholders_kept(self):
+        self.assertEqual(
+            replace_placeholders(u'{{nothing}} and {{user}}',
+                                 make_submission(), None),
+            u'{{nothing}} and someone')
+
+    def test_match_groups(self):
+        match = re.search(u'(cheap) (pills)?(x)?', u'cheap pills')
+        template = PlaceholderTemplate(
+            u'{{match-1}}/{{match-2}}/{{match-3}}/{{match-4}}')
+        self.assertEqual(template.render(make_submission(), match),
+                         u'cheap/pills//{{match-4}}')
+        self.assertEqual(template.render(make_submission(), None),
+                         u'{{match-1}}/{{match-2}}/{{match-3}}/{{match-4}}')
+
+    def test_media(self):
+        template = PlaceholderTemplate(u'{{media_user}}: {{media_title}} '
+                                       u'{{media_description}}')
+        self.assertEqual(template.render(make_submission(media=MEDIA), None),
+                         u'uploader: Video title {{media_description}}')
+        self.assertEqual(template.render(make_submission(media=None), None),
+                         u'{{media_user}}: {{media_title}} '
+                         u'{{media_description}}')
+
+        # comments don't have a media attribute at all
+        self.assertEqual(template.render(make_comment(), None),
+                         u'{{media_user}}: {{media_title}} '
+                         u'{{media_description}}')
+
+    def test_values_looked_up_once(self):
+        lookups = []
+
+        class CountingTemplate(PlaceholderTemplate):
+            def get_value(self, name, item, match):
+                lookups.append(name)
+                return PlaceholderTemplate.get_value(self, name, item, match)
+
+        template = CountingTemplate(u'{{user}}, {{user}} and {{domain}}')
+        self.assertEqual(template.render(make_submission(), None),
+                         u'someone, someone and self.testsr')
+        self.assertEqual(sorted(lookups), ['domain', 'user'])
@@ -0,0 +1,159 @@
+import logging
+import os
+import shutil
+import tempfile
+import threading
+from time import sleep
+import unittest
+
+from requests import Response
+from requests.exceptions import HTTPError
+
+from automoderator import RankCache
+
+
+class StubUser(object):
+
+    def __init__(self, name):
+        self.name = name
+
+
+class StubSubreddit(object):
+
+    """Counts the list fetches, and signals when one is done."""
+
+    def __init__(self, display_name, moderators, contributors=()):
+        self.display_name = display_name
+        self.moderators = moderators
+        self.contributors = contributors
+        self.contributors_error = None
+        self.fetches = 0
+        self.fetched = threading.Event()
+
+    def get_moderators(self):
+        return [StubUser(name) for name in self.moderators]
+
+    def get_contributors(self):
+        try:
+            if self.contributors_error:
+                raise self.contributors_error
+            return [StubUser(name) for name in self.contributors]
+        finally:
+            self.fetches += 1
+            self.fetched.set()
+
+
+def http_error(status_code):
+    response = Response()
+    response.status_code = status_code
+    return HTTPError(response=response)
+
+
+class RankCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.snapshot_path = os.path.join(self.temp_dir, 'ranks.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def wait_for_refresh(self, subreddit, rank_cache):
+        subreddit.fetched.wait(5)
+        # the refresher finishes up after the fetch itself
+        for i in range(500):
+            with rank_cache._lock:
+                if not rank_cache._refreshing:
+                    return
+            sleep(0.01)
+
+    def test_fetched_once_until_due(self):
+        rank_cache = RankCache(3600)
+        subreddit = StubSubreddit('TestSR', ['mod1', 'mod2'], ['user1'])
+
+        self.assertEqual(rank_cache.get(subreddit),
+                         (set(['mod1', 'mod2']), set(['user1'])))
+        subreddit.moderators = ['mod3']
+        self.assertEqual(rank_cache.get(subreddit),
+                         (set(['mod1', 'mod2']), set(['user1'])))
+        self.assertEqual(subreddit.fetches, 1)
+
+    def test_due_lists_refreshed_in_background(self):
+        rank_cache = RankCache(0)
+        subreddit = StubSubreddit('TestSR', ['mod1'])
+        rank_cache.get(subreddit)
+        subreddit.fetched.clear()
+        subreddit.moderators = ['mod2']
+
+        # the old lists are used while the new ones are fetched
+        self.assertEqual(rank_cache.get(subreddit), (set(['mod1']), set()))
+        self.wait_for_refresh(subreddit, rank_cache)
+        self.assertEqual(subreddit.fetches, 2)
+        self.assertEqual(rank_cache.get(subreddit)[0], set(['mod2']))
+
+    def test_old_lists_kept_if_refresh_fails(self):
+        rank_cache = RankCache(0)
+        subreddit = StubSubreddit('TestSR', ['mod1'])
+        rank_cache.get(subreddit)
+        subreddit.fetched.clear()
+        subreddit.contributors_error = http_error(500)
+
+        logging.disable(logging.ERROR)
+        try:
+            rank_cache.get(subreddit)
+            self.wait_for_refresh(subreddit, rank_cache)
+            self.assertEqual(subreddit.fetches, 2)
+            # still due, so this starts another refresh that fails too
+            subreddit.fetched.clear()
+            self.assertEqual(rank_cache.get(subreddit),
+                             (set(['mod1']), set()))
+            self.wait_for_refresh(subreddit, rank_cache)
+        finally:
+            logging.disable(logging.NOTSET)
+
+    def test_contributors_not_found(self):
+        rank_cache = RankCache(3600)
+        subreddit = StubSubreddit('TestSR', ['mod1'], ['user1'])
+        subreddit.contributors_error = http_error(404)
+        self.assertEqual(rank_cache.get(subreddit), (set(['mod1']), set()))
+
+        subreddit = StubSubreddit('Other', ['mod1'])
+        subreddit.contributors_error = http_error(403)
+        self.assertRaises(HTTPError, rank_cache.get, subreddit)
+
+    def test_snapshot(self):
+        rank_cache = RankCache(3600, self.snapshot_path)
+        rank_cache.get(StubSubreddit('TestSR', ['mod1'], ['user1']))
+        rank_cache.save_snapshot()
+
+        loaded = RankCache(3600, self.snapshot_path)
+        loaded.load_snapshot()
+        subreddit = StubSubreddit('testsr', ['mod2'])
+        self.assertEqual(loaded.get(subreddit),
+                         (set(['mod1']), set(['user1'])))
+        self.assertEqual(subreddit.fetches, 0)
+
+    def test_snapshot_only_saved_if_changed(self):
+        rank_cache = RankCache(3600, self.snapshot_path)
+        rank_cache.save_snapshot()
+        self.assertFalse(os.path.exists(self.snapshot_path))
+
+        rank_cache.get(StubSubreddit('TestSR', ['mod1']))
+        rank_cache.save_snapshot()
+        os.remove(self.snapshot_path)
+        rank_cache.save_snapshot()
+        self.assertFalse(os.path.exists(self.snapshot_path))
+
+    def test_unreadable_snapshot_ignored(self):
+        with open(self.snapshot_path, 'w') as snapshot_file:
+            snapshot_file.write('{not json')
+
+        rank_cache = RankCache(3600, self.snapshot_path)
+        logging.disable(logging.ERROR)
+        try:
+            rank_cache.load_snapshot()
+        finally:
+            logging.disable(logging.NOTSET)
+        subreddit = StubSubreddit('TestSR', ['mod1'])
+        self.assertEqual(rank_cache.get(subreddit), (set(['mod1']), set()))
+        self.assertEqual(subreddit.fetches, 1)
@@ -0,0 +1,54 @@
+import unittest
+
+import automoderator
+from automoderator import ItemView, RecentItems, update_conditions_for_sr
+from models import session, Subreddit
+from tests import make_submission
+
+
+class RecentItemsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.recent_items = RecentItems(2)
+
+    def test_only_tracked_subreddits_kept(self):
+        self.recent_items.add('testsr', ItemView(make_submission()))
+        self.assertEqual(self.recent_items.get('testsr'), [])
+
+        self.recent_items.track('testsr', True)
+        for title in ('one', 'two', 'three'):
+            self.recent_items.add('testsr',
+                                  ItemView(make_submission(title=title)))
+        self.assertEqual([item['title'] for item
+                          in self.recent_items.get('TestSR')],
+                         ['two', 'three'])
+
+        self.recent_items.track('testsr', False)
+        self.assertEqual(self.recent_items.get('testsr'), [])
+
+    def test_strings_truncated(self):
+        self.recent_items.track('testsr', True)
+        self.recent_items.add('testsr', ItemView(make_submission(
+            title='title', selftext='x' * 100000)))
+        item = self.recent_items.get('testsr')[0]
+        self.assertEqual(item['title'], 'title')
+        self.assertEqual(item['body'], 'x' * RecentItems._max_chars)
+
+    def test_tracked_when_conditions_use_regexes(self):
+        saved_recent_items = automoderator.recent_items
+        automoderator.recent_items = self.recent_items
+        try:
+            subreddit = Subreddit(name='testsr',
+                                  conditions_yaml=u'title: [spam]\n')
+            update_conditions_for_sr({}, ['submission'], subreddit, {})
+            self.recent_items.add('testsr', ItemView(make_submission()))
+            self.assertEqual(self.recent_items.get('testsr'), [])
+
+            subreddit.conditions_yaml = (u'title: "sp+am"\n'
+                                         u'modifiers: [regex]\n')
+            update_conditions_for_sr({}, ['submission'], subreddit, {})
+            self.recent_items.add('testsr', ItemView(make_submission()))
+            self.assertEqual(len(self.recent_items.get('testsr')), 1)
+        finally:
+            automoderator.recent_items = saved_recent_items
+            session.rollback()
@@ -0,0 +1,152 @@
+from functools import partial
+import logging
+import unittest
+
+from automoderator import (ActionExecutor, Condition, ConditionSet,
+                           ReportStates, check_conditions)
+from models import Subreddit
+from tests import make_comment, make_submission
+
+
+class ReportStatesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.report_states = ReportStates(100, 3600)
+        self.conditions = ConditionSet([])
+
+    def fingerprint(self, item, conditions=None):
+        if conditions is None:
+            conditions = self.conditions
+        return ReportStates.fingerprint(item, conditions)
+
+    def test_unchanged_item_skipped(self):
+        item = make_submission(num_reports=1)
+        fingerprint = self.fingerprint(item)
+        self.assertFalse(self.report_states.is_unchanged(item.name,
+                                                         fingerprint))
+        self.report_states.record(item.name, fingerprint)
+
+        same_item = make_submission(num_reports=1)
+        self.assertTrue(self.report_states.is_unchanged(
+            same_item.name, self.fingerprint(same_item)))
+        self.assertEqual((self.report_states.skipped,
+                          self.report_states.checked), (1, 1))
+        self.assertEqual(self.report_states.skip_rate(), 0.5)
+
+    def test_changes_checked_again(self):
+        submission = make_submission(num_reports=1, title=u'Caf\xe9')
+        changed_submissions = [
+            make_submission(num_reports=2, title=u'Caf\xe9'),
+            make_submission(num_reports=1, title=u'Cafe'),
+            make_submission(num_reports=1, title=u'Caf\xe9',
+                            selftext='edited', edited=1400000100),
+            make_submission(num_reports=1, title=u'Caf\xe9',
+                            approved_by='somemod'),
+            make_submission(num_reports=1, title=u'Caf\xe9',
+                            link_flair_text='Flair'),
+            make_submission(num_reports=1, title=u'Caf\xe9',
+                            author_flair_css_class='flair'),
+        ]
+        fingerprint = self.fingerprint(submission)
+        for changed in changed_submissions:
+            self.assertNotEqual(self.fingerprint(changed), fingerprint)
+
+        comment = make_comment(num_reports=1, body='text')
+        self.assertNotEqual(
+            self.fingerprint(make_comment(num_reports=1, body='changed')),
+            self.fingerprint(comment))
+        self.assertNotEqual(
+            self.fingerprint(make_comment(num_reports=1, body='text',
+                                          banned_by='somemod')),
+            self.fingerprint(comment))
+
+    def test_changed_conditions_checked_again(self):
+        item = make_submission(num_reports=1)
+        self.assertNotEqual(self.fingerprint(item, ConditionSet([])),
+                            self.fingerprint(item))
+
+    def test_entries_expire(self):
+        report_states = ReportStates(100, 0)
+        item = make_submission(num_reports=1)
+        report_states.record(item.name, self.fingerprint(item))
+        self.assertFalse(report_states.is_unchanged(item.name,
+                                                    self.fingerprint(item)))
+
+    def test_reset_keeps_entries(self):
+        item = make_submission(num_reports=1)
+        self.report_states.record(item.name, self.fingerprint(item))
+        self.report_states.is_unchanged(item.name, self.fingerprint(item))
+        self.report_states.reset()
+
+        self.assertEqual(self.report_states.skip_rate(), 0.0)
+        self.assertTrue(self.report_states.is_unchanged(
+            item.name, self.fingerprint(item)))
+
+    def test_failed_actions_not_recorded(self):
+        item = make_submission(num_reports=1)
+        # the action worker fails before checking the item is finished
+        self.report_states.forget(item.name)
+        self.report_states.record(item.name, self.fingerprint(item))
+        self.assertFalse(self.report_states.is_unchanged(
+            item.name, self.fingerprint(item)))
+
+        # and after
+        other = make_submission(num_reports=1, id='def', name='t3_def')
+        self.report_states.record(other.name, self.fingerprint(other))
+        self.report_states.forget(other.name)
+        self.assertFalse(self.report_states.is_unchanged(
+            other.name, self.fingerprint(other)))
+
+    def test_failures_only_kept_for_pass(self):
+        item = make_submission(num_reports=1)
+        self.report_states.forget(item.name)
+        self.report_states.reset()
+        self.report_states.record(item.name, self.fingerprint(item))
+        self.assertTrue(self.report_states.is_unchanged(
+            item.name, self.fingerprint(item)))
+
+    def test_forgotten_when_worker_action_fails(self):
+        def failing_request():
+            raise IOError('connection reset')
+
+        item = make_submission(num_reports=1)
+        self.report_states.record(item.name, self.fingerprint(item))
+        executor = ActionExecutor(1, 10)
+        logging.disable(logging.ERROR)
+        try:
+            executor.submit(item, [('remove', failing_request)], 'yaml',
+                            on_failure=partial(self.report_states.forget,
+                                               item.name))
+            executor.join()
+        finally:
+            logging.disable(logging.NOTSET)
+
+        self.assertFalse(self.report_states.is_unchanged(
+            item.name, self.fingerprint(item)))
+
+
+class CheckConditionsFailedTest(unittest.TestCase):
+
+    def test_conditions_that_raise_reported(self):
+        def broken_check(*args):
+            raise ValueError('broken')
+
+        working = Condition({'title': ['nothing like it']})
+        broken = Condition({'title': ['broken']})
+        broken.check_item = broken_check
+        subreddit = Subreddit(name='testsr')
+        item = make_submission(num_reports=1)
+
+        failed = []
+        logging.disable(logging.ERROR)
+        try:
+            self.assertFalse(check_conditions(subreddit, item,
+                                              [working, broken],
+                                              failed=failed))
+        finally:
+            logging.disable(logging.NOTSET)
+        self.assertEqual(failed, [broken])
+
+        failed = []
+        check_conditions(subreddit, item, [working], failed=failed)
+        self.assertEqual(failed, [])
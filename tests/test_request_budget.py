@@ -0,0 +1,71 @@
+import threading
+from time import time
+import unittest
+
+import praw
+
+from automoderator import ThreadSafeReddit, TokenBucket
+
+
+class CountingBudget(object):
+
+    def __init__(self):
+        self.acquired = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        with self._lock:
+            self.acquired += tokens
+
+
+class TokenBucketTest(unittest.TestCase):
+
+    def test_burst_then_rate(self):
+        bucket = TokenBucket(20, 2)
+        start_time = time()
+        bucket.acquire()
+        bucket.acquire()
+        self.assertTrue(time() - start_time < 0.04)
+
+        # the burst is used up, so this has to wait for a refill
+        bucket.acquire()
+        self.assertTrue(time() - start_time >= 0.04)
+
+    def test_no_limit(self):
+        bucket = TokenBucket(0, 0)
+        for i in range(100):
+            bucket.acquire()
+
+
+class ThreadSafeRedditTest(unittest.TestCase):
+
+    def setUp(self):
+        self.saved_request = praw.Reddit._request
+        praw.Reddit._request = lambda self, url, *args, **kwargs: url
+
+    def tearDown(self):
+        praw.Reddit._request = self.saved_request
+
+    def test_every_thread_takes_from_budget(self):
+        budget = CountingBudget()
+        r = ThreadSafeReddit(user_agent='AutoModerator tests',
+                             disable_update_check=True,
+                             request_budget=budget)
+
+        results = []
+        threads = [threading.Thread(
+                       target=lambda: results.append(r._request('url')))
+                   for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        r._request('url')
+
+        self.assertEqual(results, ['url'] * 5)
+        self.assertEqual(budget.acquired, 6)
+
+    def test_without_budget(self):
+        r = ThreadSafeReddit(user_agent='AutoModerator tests',
+                             disable_update_check=True)
+        self.assertEqual(r._request('url'), 'url')